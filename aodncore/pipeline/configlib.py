@@ -12,7 +12,7 @@ from celery import Celery
 from .exceptions import InvalidConfigError
 from .log import WorkerLoggingConfigBuilder, get_watchservice_logging_config
 from .schema import validate_logging_config, validate_pipeline_config
-from .watch import get_task_name, CeleryConfig, CeleryContext
+from .watch import get_task_name, CeleryConfig, CeleryContext, MAX_TASK_PRIORITY
 from ..util import discover_entry_points, format_exception, lazyproperty, validate_type, WriteOnceOrderedDict
 
 __all__ = [
@@ -42,7 +42,8 @@ class LazyConfigManager(object):
     @lazyproperty
     def celery_application(self):
         application = Celery(self.pipeline_config['watch']['task_namespace'])
-        celeryconfig = CeleryConfig(self.celery_routes)
+        queue_max_priority = MAX_TASK_PRIORITY if 'routing' in self.pipeline_config['watch'] else None
+        celeryconfig = CeleryConfig(self.celery_routes, queue_max_priority=queue_max_priority)
         celerycontext = CeleryContext(application, self, celeryconfig)
         return celerycontext.application
 
@@ -77,14 +78,31 @@ class LazyConfigManager(object):
         validate_logging_config(watchservice_logging_config)
         return watchservice_logging_config
 
+    @lazyproperty
+    def _worker_logging_configs(self):
+        return {}
+
     def get_worker_logging_config(self, task_name):
         """Get the logging config for an individual task
 
+        The config is built and validated once per task name, and the same object is returned by subsequent calls
+        until the logging section of the pipeline config changes.
+
         :param task_name: name of the task to retrieve the log config for
         :return: logging config for use by logging.config.dictConfig
         """
+        logging_config_key = json.dumps(self.pipeline_config['logging'], sort_keys=True)
+        try:
+            cached_key, worker_logging_config = self._worker_logging_configs[task_name]
+        except KeyError:
+            pass
+        else:
+            if cached_key == logging_config_key:
+                return worker_logging_config
+
         worker_logging_config = WorkerLoggingConfigBuilder(self.pipeline_config).add_watch_config(task_name).build()
         validate_logging_config(worker_logging_config)
+        self._worker_logging_configs[task_name] = (logging_config_key, worker_logging_config)
         return worker_logging_config
 
     @lazyproperty
@@ -1,32 +1,323 @@
 import csv
+import gzip
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
 import psycopg2
 from psycopg2 import sql, extras
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
 import yaml
 
 from .exceptions import InvalidSQLConnectionError, InvalidSQLTransactionError, MissingFileError
 from ..util import find_file, get_field_type, get_tableschema_descriptor, is_nonstring_iterable
 
 __all__ = [
-    'DatabaseInteractions'
+    'DatabaseConnectionPool',
+    'DatabaseInteractions',
+    'get_connection_pool',
+    'get_csv_partitions',
+    'get_primary_key_name',
+    'get_staging_table_name'
 ]
 
+STAGING_TABLE_SUFFIX = '__staging'
+
+PRIMARY_KEY_SUFFIX = '_pkey'
+
+# maximum length of a PostgreSQL identifier in bytes, beyond which names are truncated
+MAX_IDENTIFIER_LENGTH = 63
+
+# size of the reads from csv files passed to COPY FROM STDIN
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# minimum number of bytes in each partition of a csv file loaded in parallel
+MIN_COPY_PARTITION_SIZE = 64 * 1024 * 1024
+
+GZIP_EXTENSION = '.gz'
+
+DEFAULT_POOL_MAX_IDLE_TIME = 300
+DEFAULT_POOL_HEALTH_CHECK_INTERVAL = 30
+DEFAULT_POOL_MAX_SIZE = 8
+
+
+def get_staging_table_name(name):
+    """Get the name of the staging table used to load data for the given table before it is swapped into place
+
+    :param name: name of the live table
+    :return: name of the staging table
+    """
+    return "{name}{suffix}".format(name=name, suffix=STAGING_TABLE_SUFFIX)
+
+
+def get_primary_key_name(name):
+    """Get the name of the primary key constraint (and index) of the given table, as chosen by PostgreSQL by default
+
+    The table name is truncated so that the constraint name fits within the maximum identifier length, as PostgreSQL
+    does when generating the name.
+
+    :param name: name of the table
+    :return: name of the primary key constraint
+    """
+    max_length = MAX_IDENTIFIER_LENGTH - len(PRIMARY_KEY_SUFFIX)
+    truncated = name.encode('utf-8')[:max_length].decode('utf-8', 'ignore')
+    return "{name}{suffix}".format(name=truncated, suffix=PRIMARY_KEY_SUFFIX)
+
+
+def get_csv_partitions(path, partitions, min_partition_size=MIN_COPY_PARTITION_SIZE):
+    """Split an uncompressed csv file into contiguous, row aligned byte ranges, excluding the header row
+
+    Each range starts at the beginning of a line, so the file must not contain quoted values with embedded newlines.
+    Fewer ranges than requested are returned if the ranges would otherwise be smaller than `min_partition_size`.
+
+    :param path: path to the csv file
+    :param partitions: maximum number of ranges to split the file into
+    :param min_partition_size: minimum size of each range, in bytes
+    :return: list of (start, end) tuples containing the byte offsets of each range
+    """
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        f.readline()
+        data_start = start = f.tell()
+        if start >= size:
+            return []
+
+        count = max(1, min(partitions, (size - data_start) // max(min_partition_size, 1)))
+        ranges = []
+        for i in range(1, count):
+            f.seek(max(start, data_start + (size - data_start) * i // count))
+            f.readline()
+            end = f.tell()
+            if end >= size:
+                break
+            if end > start:
+                ranges.append((start, end))
+                start = end
+        ranges.append((start, size))
+    return ranges
+
+
+class _FileRangeReader(object):
+    """Read-only file-like object limited to a range of bytes of an underlying binary file, for use with COPY
+    """
+
+    def __init__(self, f, start, end):
+        self._f = f
+        self._f.seek(start)
+        self._remaining = end - start
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._f.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def readline(self, size=-1):
+        if size is None or size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._f.readline(size)
+        self._remaining -= len(data)
+        return data
+
+
+def _open_csv(path):
+    """Open a csv file for reading as bytes, transparently decompressing gzip files
+
+    :param path: path to the csv file, which is decompressed if it ends with '.gz'
+    :return: binary file object
+    """
+    if path.endswith(GZIP_EXTENSION):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb', buffering=COPY_BUFFER_SIZE)
+
+
+def _connect(params):
+    # use ssl if it is enabled on the server
+    return psycopg2.connect(sslmode='prefer', **params)
+
+
+class DatabaseConnectionPool(object):
+    """Thread safe pool of idle database connections, keyed by their connection parameters, so that connections may be
+    reused by successive :py:class:`DatabaseInteractions` contexts instead of paying the connection, TLS and
+    authentication cost each time.
+
+    Connections which have been idle for longer than `max_idle_time` seconds are closed rather than reused, and those
+    idle for longer than `health_check_interval` seconds are checked with a trivial query before being reused. The
+    session state of each connection is discarded (with DISCARD ALL) when it is returned to the pool, so that settings
+    such as search_path made by one context are not seen by the next.
+
+    :param max_idle_time: number of seconds after which an idle connection is closed
+    :param health_check_interval: number of seconds after which an idle connection is checked before reuse
+    :param max_size: maximum number of idle connections retained for each set of connection parameters
+    """
+
+    def __init__(self, max_idle_time=DEFAULT_POOL_MAX_IDLE_TIME,
+                 health_check_interval=DEFAULT_POOL_HEALTH_CHECK_INTERVAL, max_size=DEFAULT_POOL_MAX_SIZE):
+        self.max_idle_time = max_idle_time
+        self.health_check_interval = health_check_interval
+        self.max_size = max_size
+
+        self._idle = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(connections) for connections in self._idle.values())
+
+    @staticmethod
+    def _get_key(params):
+        return tuple(sorted((k, str(v)) for k, v in params.items()))
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    @staticmethod
+    def _is_healthy(conn):
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _prune(self, now):
+        """Remove the connections which have exceeded the maximum idle time, oldest first
+
+        :param now: current monotonic time
+        :return: list of expired connections, which should be closed outside of the lock
+        """
+        expired = []
+        for key in list(self._idle):
+            connections = self._idle[key]
+            while connections and now - connections[0][1] > self.max_idle_time:
+                expired.append(connections.pop(0)[0])
+            if not connections:
+                del self._idle[key]
+        return expired
+
+    def acquire(self, params):
+        """Get an idle connection for the given connection parameters, or a new connection if there are none
+
+        :param params: dict of connection parameters, as passed to :py:func:`psycopg2.connect`
+        :return: :py:class:`psycopg2.extensions.connection` instance
+        """
+        key = self._get_key(params)
+        while True:
+            now = time.monotonic()
+            with self._lock:
+                expired = self._prune(now)
+                connections = self._idle.get(key)
+                conn, released = connections.pop() if connections else (None, None)
+            for expired_conn in expired:
+                self._close(expired_conn)
+
+            if conn is None:
+                return _connect(params)
+            if conn.closed:
+                continue
+            if now - released > self.health_check_interval and not self._is_healthy(conn):
+                self._close(conn)
+                continue
+            return conn
+
+    def release(self, params, conn):
+        """Return a connection to the pool, or close it if it is broken, in a transaction or the pool is full
+
+        :param params: dict of connection parameters used to create the connection
+        :param conn: :py:class:`psycopg2.extensions.connection` instance
+        :return: None
+        """
+        if conn.closed or conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+            self._close(conn)
+            return
+
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute('DISCARD ALL')
+            conn.autocommit = False
+        except Exception:
+            self._close(conn)
+            return
+
+        key = self._get_key(params)
+        with self._lock:
+            connections = self._idle[key]
+            if len(connections) < self.max_size:
+                connections.append((conn, time.monotonic()))
+                conn = None
+        if conn is not None:
+            self._close(conn)
+
+    def close(self):
+        """Close all idle connections
+
+        :return: None
+        """
+        with self._lock:
+            connections = [conn for idle in self._idle.values() for conn, _ in idle]
+            self._idle.clear()
+        for conn in connections:
+            self._close(conn)
+
+
+_connection_pool = None
+_connection_pool_pid = None
+_connection_pool_lock = threading.Lock()
+
+# pools inherited from a parent process, which are referenced so that their connections are never garbage collected
+_inherited_connection_pools = []
+
+
+def get_connection_pool(**kwargs):
+    """Get the connection pool for the current process, creating it with the given parameters if it does not exist
+
+    A new pool is created in a forked child process, since connections cannot be shared between processes. The
+    connections inherited from the parent process are left open (without being closed) so that the connections of the
+    parent are not terminated when they are garbage collected.
+
+    :param kwargs: keyword arguments passed to :py:class:`DatabaseConnectionPool` when the pool is created
+    :return: :py:class:`DatabaseConnectionPool` instance
+    """
+    global _connection_pool, _connection_pool_pid
+    with _connection_pool_lock:
+        if _connection_pool is None or _connection_pool_pid != os.getpid():
+            if _connection_pool is not None:
+                _inherited_connection_pools.append(_connection_pool)
+            _connection_pool = DatabaseConnectionPool(**kwargs)
+            _connection_pool_pid = os.getpid()
+        return _connection_pool
+
 
 class DatabaseInteractions(object):
     """Database connection object.
 
     This class should be instantiated via the 'with DatabaseInteractions() as...' method, so the __enter__ and __exit__
     functions will be correctly implemented.
+
+    If a :py:class:`DatabaseConnectionPool` is given, the connection is acquired from the pool, and returned to the
+    pool rather than closed on exit.
     """
 
     # private methods
 
-    def __init__(self, config, schema_base_path, logger):
+    def __init__(self, config, schema_base_path, logger, pool=None):
         self._conn = None
         self._cur = None
         self.config = config
         self._logger = logger
         self.schema_base_path = schema_base_path
+        self.pool = pool
         self.status = 'initiated'
+        self._extent_cache = {}
 
     def __enter__(self):
         # Call database connection method and then create a cursor
@@ -38,16 +329,22 @@ class DatabaseInteractions(object):
     def __exit__(self, exc_type, exc_val, exc_tb):
         # Check for errors and roll back changes if they exist, otherwise commit changes
         # Finally close the cursor and the connection
-        if exc_type:
-            self._logger.info("Rolling back changes")
-            self._conn.rollback()
-            self.status = 'rolled_back'
-        else:
-            self._logger.info("Committing changes")
-            self._conn.commit()
-            self.status = 'committed'
-        self._cur.close()
-        self._conn.close()
+        try:
+            if exc_type:
+                self._logger.info("Rolling back changes")
+                self._conn.rollback()
+                self.status = 'rolled_back'
+            else:
+                self._logger.info("Committing changes")
+                self._conn.commit()
+                self.status = 'committed'
+        finally:
+            self._cur.close()
+            if self.pool is None:
+                self._conn.close()
+            else:
+                # connections left in a failed transaction are closed rather than returned to the pool
+                self.pool.release(self.config, self._conn)
 
     def __connect(self):
         """Connect to the PostgreSQL database server.
@@ -56,8 +353,9 @@ class DatabaseInteractions(object):
         """
         params = self.config
         try:
-            # use ssl if it is enabled on the server
-            return psycopg2.connect(sslmode='prefer', **params)
+            if self.pool is not None:
+                return self.pool.acquire(params)
+            return _connect(params)
         except Exception as error:
             raise InvalidSQLConnectionError(error)
 
@@ -66,6 +364,7 @@ class DatabaseInteractions(object):
 
         :param statement: A string containing an SQL statement or multiple statements separated by semi-colons.
         """
+        self._extent_cache.clear()
         try:
             self._cur.execute(sql.SQL(statement))
             self._logger.sysinfo(self._cur.query)
@@ -96,20 +395,96 @@ class DatabaseInteractions(object):
         :param file: A readable file-like object.
         :return: None
         """
+        self._extent_cache.clear()
         try:
-            self._cur.copy_expert(sql.SQL(statement), file)
+            self._cur.copy_expert(sql.SQL(statement), file, size=COPY_BUFFER_SIZE)
             self._logger.sysinfo(self._cur.query)
         except Exception as error:
             raise InvalidSQLTransactionError(error)
 
     # public methods
 
-    def compare_schemas(self):
-        """Placeholder for possible future implementation of schema version checking
+    def get_table_schema(self, name):
+        """Introspect the columns and primary key of the specified table from the information_schema.
+
+        Column types are normalised to their canonical PostgreSQL names (e.g. 'integer', 'character varying'), without
+        any type modifiers, so that they may be compared with those of a tableschema definition.
+
+        :param name: name of the table, optionally schema qualified
+        :return: dict containing 'fields' (a list of (name, type) tuples in column order) and 'primaryKey' (a list of
+            column names) keys, or None if the table does not exist
+        """
+        columns_query = """
+            SELECT c.column_name,
+                to_regtype(quote_ident(c.udt_schema) || '.' || quote_ident(c.udt_name))::text AS data_type
+            FROM information_schema.columns c
+            WHERE to_regclass(quote_ident(c.table_schema) || '.' || quote_ident(c.table_name)) = to_regclass('{name}')
+            ORDER BY c.ordinal_position
+        """.format(name=name)
+        columns = self.__query(columns_query, many=True)
+        if not columns:
+            return None
+
+        pk_query = """
+            SELECT k.column_name
+            FROM information_schema.table_constraints t
+            JOIN information_schema.key_column_usage k
+                ON k.constraint_schema = t.constraint_schema AND k.constraint_name = t.constraint_name
+            WHERE t.constraint_type = 'PRIMARY KEY'
+                AND to_regclass(quote_ident(t.table_schema) || '.' || quote_ident(t.table_name)) = to_regclass('{name}')
+            ORDER BY k.ordinal_position
+        """.format(name=name)
+        return {
+            'fields': [(c['column_name'], c['data_type']) for c in columns],
+            'primaryKey': [k['column_name'] for k in self.__query(pk_query, many=True)]
+        }
+
+    def get_expected_schema(self, step):
+        """Build the columns and primary key of the specified table from its yaml file, as they would be created by
+        :py:meth:`create_table_from_yaml_file`, in the same form as :py:meth:`get_table_schema`.
+
+        :param step: A dict containing 'name' and 'type' (at least) keys
+        :return: dict containing 'fields' and 'primaryKey' keys, or None if there is no yaml file for the table
+        """
+        _, schema = self._get_yaml_schema(step)
+        if not schema:
+            return None
+
+        # let the database resolve the type names, so that aliases (e.g. 'int' and 'integer') compare as equal
+        types = sorted({get_field_type(f['type']) for f in schema['fields']})
+        values = ','.join("('{}')".format(t.replace("'", "''")) for t in types)
+        types_query = "SELECT t.name, to_regtype(t.name)::text AS data_type FROM (VALUES {}) AS t(name)".format(values)
+        resolved = {r['name']: r['data_type'] for r in self.__query(types_query, many=True)}
+
+        # unquoted identifiers are folded to lower case when the table is created
+        return {
+            'fields': [(f['name'].lower(), resolved[get_field_type(f['type'])]) for f in schema['fields']],
+            'primaryKey': [k.lower() for k in self._get_primary_key(schema) or []]
+        }
 
+    def compare_schemas(self, steps):
+        """Compare the live tables in the database with their yaml file definitions, to determine whether the existing
+        tables can be reused (i.e. truncated or appended to) rather than dropped and recreated.
+
+        Only tables with a yaml file are compared, since the definition of any other object is not known.
+
+        :param steps: list of dicts containing 'name' and 'type' (at least) keys
         :return: boolean - True if schemas match, else False
         """
-        self._logger.info("Compare schema not yet implemented...")
+        for step in steps:
+            if step['type'] != 'table':
+                continue
+            expected = self.get_expected_schema(step)
+            if expected is None:
+                continue
+            actual = self.get_table_schema(step['name'])
+            if actual is None:
+                self._logger.info("Table {} does not exist".format(step['name']))
+                return False
+            if actual != expected:
+                self._logger.info("Schema of table {name} does not match its definition. Expected {expected}, found "
+                                  "{actual}".format(name=step['name'], expected=expected, actual=actual))
+                return False
         return True
 
     def truncate_table(self, step):
@@ -123,16 +498,65 @@ class DatabaseInteractions(object):
         if step['type'] == 'table':
             self.__exec("TRUNCATE TABLE {}".format(step['name']))
 
+    def object_exists(self, name):
+        """Determine whether the specified database object exists.
+
+        :param name: name of the database object, optionally schema qualified
+        :return: boolean - True if the object exists, else False
+        """
+        return self.__query("SELECT to_regclass('{}') IS NOT NULL AS exists".format(name))['exists']
+
+    def can_refresh_concurrently(self, name):
+        """Determine whether the specified materialized view can be refreshed with the CONCURRENTLY parameter, which
+        requires the view to be populated and to have at least one unique index covering all rows.
+
+        :param name: name of the materialized view, optionally schema qualified
+        :return: boolean - True if the view can be refreshed concurrently, else False
+        """
+        query = """
+            SELECT m.ispopulated AND EXISTS (
+                SELECT 1 FROM pg_index i
+                WHERE i.indrelid = to_regclass('{name}') AND i.indisunique AND i.indpred IS NULL
+            ) AS concurrently
+            FROM pg_matviews m
+            WHERE to_regclass(quote_ident(m.schemaname) || '.' || quote_ident(m.matviewname)) = to_regclass('{name}')
+        """.format(name=name)
+        result = self.__query(query)
+        return bool(result and result['concurrently'])
+
     def refresh_materialized_view(self, step):
         """Refresh the specified materialized view.
 
+        The CONCURRENTLY parameter is used where possible (see :py:meth:`can_refresh_concurrently`), so that readers of
+        the view are not blocked while it is refreshed.
+
         :param step: A dict containing 'name' and 'type' (at least) keys
         - step.name is the name of the database object
         - step.type is the type of database object - the database transaction will only be performed
             if type = 'materialized view'
         """
         if step['type'] == 'materialized view':
-            self.__exec("REFRESH MATERIALIZED VIEW {}".format(step['name']))
+            concurrently = 'CONCURRENTLY ' if self.can_refresh_concurrently(step['name']) else ''
+            self.__exec("REFRESH MATERIALIZED VIEW {}{}".format(concurrently, step['name']))
+
+    def restore_object(self, step):
+        """Restore the specified database object after the tables it depends on have been swapped into place.
+
+        Views which were dropped when a table was swapped (see :py:meth:`swap_staging_table`) are recreated from their
+        sql file, while views which still exist are refreshed (see :py:meth:`refresh_materialized_view`). Tables which
+        were swapped have their sql file executed, as per the `replace` process sequence.
+
+        :param step: A dict containing 'name' and 'type' (at least) keys
+        - step.name is the name of the database object
+        - step.type is the type of database object
+        """
+        if step['type'] == 'table':
+            if step.get('local_path'):
+                self.execute_sql_file(step)
+        elif not self.object_exists(step['name']):
+            self.execute_sql_file(step)
+        else:
+            self.refresh_materialized_view(step)
 
     def drop_object(self, step):
         """Drop the specified database object.
@@ -149,25 +573,84 @@ class DatabaseInteractions(object):
         stmt = "DROP {type} IF EXISTS {name} CASCADE".format(**step)
         self.__exec(stmt)
 
-    def load_data_from_csv(self, step):
+    def load_data_from_csv(self, step, table_name=None):
         """Function to read a csv file prior to loading into the specified table.
 
-        Currently uses the utf-8 encoding to read the csv file, and reads the headings into the COPY FROM statement -
-        the latter may not be necessary as it is assumed that the file has been validated in a previous handler step.
+        The file is passed to the COPY FROM statement as raw utf-8 bytes, without being decoded by the client, and files
+        ending with '.gz' are decompressed as they are read. The headings are skipped rather than being read into the
+        COPY FROM statement, as it is assumed that the file has been validated in a previous handler step.
         :param step: A dict containing 'name' and 'local_path' (at least) keys
         - step.name is the name of the target table
-        - step.local_path is the full path to the source file (csv)
+        - step.local_path is the full path to the source file (csv or csv.gz)
+        :param table_name: optional name of the table to load, if different from step.name (e.g. a staging table)
         """
         fn = step.get('local_path', '')
         if fn:
             try:
-                with open(fn, encoding="utf-8") as f:
+                with _open_csv(fn) as f:
                     self._logger.info("Loading data from {}".format(fn))
-                    stmt = "COPY {} FROM STDIN WITH HEADER CSV".format(step['name'])
+                    stmt = "COPY {} FROM STDIN WITH (FORMAT csv, HEADER true, ENCODING 'UTF8')".format(
+                        table_name or step['name'])
                     self.__exec_copy(stmt, f)
             except FileNotFoundError as e:
                 raise MissingFileError(e)
 
+    def load_data_from_csv_range(self, step, start, end, table_name=None):
+        """Function to load a range of rows of an uncompressed csv file into the specified table.
+
+        :param step: A dict containing 'name' and 'local_path' (at least) keys
+        - step.name is the name of the target table
+        - step.local_path is the full path to the source file (csv)
+        :param start: byte offset of the first row to load, which must not be the header row
+        :param end: byte offset of the end of the last row to load
+        :param table_name: optional name of the table to load, if different from step.name (e.g. a staging table)
+        """
+        fn = step['local_path']
+        try:
+            with open(fn, 'rb') as f:
+                self._logger.info("Loading data from {fn} bytes {start}-{end}".format(fn=fn, start=start, end=end))
+                stmt = "COPY {} FROM STDIN WITH (FORMAT csv, ENCODING 'UTF8')".format(table_name or step['name'])
+                self.__exec_copy(stmt, _FileRangeReader(f, start, end))
+        except FileNotFoundError as e:
+            raise MissingFileError(e)
+
+    def load_data_from_csv_parallel(self, step, partitions, table_name=None):
+        """Function to load a large csv file into the specified table in parallel, by splitting it into row aligned
+        byte ranges (see :py:func:`get_csv_partitions`) and loading each range over a separate database connection.
+
+        Since the ranges are loaded and committed independently of the transaction of this instance, the table must
+        already be committed (e.g. a staging table), and it should be dropped if this method fails, as some of the
+        ranges may have been loaded. Compressed files are loaded with :py:meth:`load_data_from_csv` instead, within the
+        transaction of this instance.
+
+        :param step: A dict containing 'name' and 'local_path' (at least) keys
+        - step.name is the name of the target table
+        - step.local_path is the full path to the source file (csv or csv.gz)
+        :param partitions: maximum number of ranges (and connections) to load in parallel
+        :param table_name: optional name of the table to load, if different from step.name (e.g. a staging table)
+        """
+        fn = step.get('local_path', '')
+        if not fn:
+            return
+        if fn.endswith(GZIP_EXTENSION):
+            self.load_data_from_csv(step, table_name=table_name)
+            return
+
+        try:
+            ranges = get_csv_partitions(fn, partitions)
+        except FileNotFoundError as e:
+            raise MissingFileError(e)
+
+        def load_range(byte_range):
+            with DatabaseInteractions(config=self.config, schema_base_path=self.schema_base_path,
+                                      logger=self._logger, pool=self.pool) as conn:
+                conn.load_data_from_csv_range(step, byte_range[0], byte_range[1], table_name=table_name)
+
+        self._logger.info("Loading data from {fn} in {count} partitions".format(fn=fn, count=len(ranges)))
+        with ThreadPoolExecutor(max_workers=max(len(ranges), 1)) as executor:
+            # consume all results so that the first error is raised once all running loads have completed
+            list(executor.map(load_range, ranges))
+
     def execute_sql_file(self, step):
         """Function to read an SQL file prior to executing against the database.
 
@@ -180,44 +663,209 @@ class DatabaseInteractions(object):
             with open(fn) as stream:
                 self.__exec(stream.read())
 
-    def create_table_from_yaml_file(self, step):
+    def _get_yaml_schema(self, step):
+        """Find and read the yaml file for the specified table.
+
+        :param step: A dict containing 'name' and 'type' (at least) keys
+        :return: tuple containing the yaml file path and the table schema, or (None, None) if not found or not a table
+        """
+        fn = find_file(self.schema_base_path, r'{name}(\..*)?\.(?:yml|yaml)'.format(name=step['name']))
+        if fn and step['type'] == 'table':
+            with open(fn) as stream:
+                return fn, get_tableschema_descriptor(yaml.safe_load(stream), 'schema')
+        return None, None
+
+    @staticmethod
+    def _get_primary_key(schema):
+        pk = schema.get('primaryKey')
+        if pk:
+            return pk if is_nonstring_iterable(pk) else [pk]
+        return None
+
+    def create_table_from_yaml_file(self, step, table_name=None, primary_key=True):
         """Function to read an yaml file and use it to build a CREATE TABLE script for execution against the database.
 
         :param step: A dict containing 'name' and 'type' (at least) keys
         - step.name is the name used as part of the match regular expression
         - step.type is the type of database object. Type should always be table in this context
+        :param table_name: optional name of the table to create, if different from step.name (e.g. a staging table)
+        :param primary_key: whether to create the primary key along with the table
         """
-        fn = find_file(self.schema_base_path, r'{name}(\..*)?\.(?:yml|yaml)'.format(name=step['name']))
-        if fn and step['type'] == 'table':
+        fn, schema = self._get_yaml_schema(step)
+        if schema:
             self._logger.info("Creating {type} {name} from {fn}".format(fn=fn, **step))
-            with open(fn) as stream:
-                schema = get_tableschema_descriptor(yaml.safe_load(stream), 'schema')
-                columns = []
-                for f in schema['fields']:
-                    f['type'] = get_field_type(f['type'])
-                    columns.append('{name} {type}'.format(**f))
-                pk = schema.get('primaryKey')
-                if pk:
-                    pk = pk if is_nonstring_iterable(pk) else [pk]
-                    columns.append("PRIMARY KEY ({})".format(','.join(pk)))
-                self.__exec('CREATE TABLE {} ({})'.format(step['name'], ','.join(columns)))
+            columns = []
+            for f in schema['fields']:
+                f['type'] = get_field_type(f['type'])
+                columns.append('{name} {type}'.format(**f))
+            pk = self._get_primary_key(schema)
+            if pk and primary_key:
+                columns.append("PRIMARY KEY ({})".format(','.join(pk)))
+            self.__exec('CREATE TABLE {} ({})'.format(table_name or step['name'], ','.join(columns)))
+
+    def create_staging_table(self, step):
+        """Create an empty staging table for the specified table from its yaml file, replacing any existing staging
+        table left behind by a previous failed load.
+
+        The primary key is not created with the table, since it is faster to build the index once the data has been
+        loaded (see :py:meth:`create_staging_primary_key`).
+
+        :param step: A dict containing 'name', 'type' and 'local_path' (at least) keys
+        - step.name is the name of the live table
+        - step.type is the type of database object - the database transaction will only be performed if type = 'table'
+        - step.local_path is the full path to the source file (csv) - only tables with data to load are staged
+        """
+        if step['type'] == 'table' and step.get('local_path'):
+            self.drop_staging_table(step)
+            self.create_table_from_yaml_file(step, table_name=get_staging_table_name(step['name']), primary_key=False)
+
+    def create_staging_primary_key(self, step):
+        """Create the primary key of the staging table for the specified table, from its yaml file.
+
+        The constraint is explicitly named (see :py:func:`get_primary_key_name`), so that it can be renamed when the
+        staging table is swapped into place (see :py:meth:`swap_staging_table`).
+
+        :param step: A dict containing 'name', 'type' and 'local_path' (at least) keys
+        - step.name is the name of the live table
+        - step.type is the type of database object - the database transaction will only be performed if type = 'table'
+        - step.local_path is the full path to the source file (csv) - only tables with data to load are staged
+        """
+        if step['type'] == 'table' and step.get('local_path'):
+            _, schema = self._get_yaml_schema(step)
+            pk = self._get_primary_key(schema) if schema else None
+            if pk:
+                staging_name = get_staging_table_name(step['name'])
+                self.__exec("ALTER TABLE {} ADD CONSTRAINT {} PRIMARY KEY ({})".format(
+                    staging_name, get_primary_key_name(staging_name), ','.join(pk)))
+
+    def load_staging_data_from_csv(self, step, partitions=1):
+        """Load the csv file for the specified table into its staging table.
+
+        :param step: A dict containing 'name', 'type' and 'local_path' (at least) keys
+        - step.name is the name of the live table
+        - step.type is the type of database object - the database transaction will only be performed if type = 'table'
+        - step.local_path is the full path to the source file (csv)
+        :param partitions: if greater than 1, the maximum number of partitions of the file to load in parallel over
+            separate connections (see :py:meth:`load_data_from_csv_parallel`), in which case the staging table must
+            already be committed
+        """
+        if step['type'] == 'table':
+            if partitions > 1:
+                self.load_data_from_csv_parallel(step, partitions, table_name=get_staging_table_name(step['name']))
+            else:
+                self.load_data_from_csv(step, table_name=get_staging_table_name(step['name']))
+
+    def drop_staging_table(self, step):
+        """Drop the staging table for the specified table, if it exists.
+
+        :param step: A dict containing 'name' (at least) key
+        - step.name is the name of the live table
+        """
+        self.__exec("DROP TABLE IF EXISTS {} CASCADE".format(get_staging_table_name(step['name'])))
+
+    def swap_staging_table(self, step):
+        """Replace the specified table with its loaded staging table.
+
+        The live table is dropped with the CASCADE parameter (as per :py:meth:`drop_object`), and the staging table and
+        its primary key constraint are renamed in its place. When executed within a single transaction, readers will see
+        either the old or the new table, and never an empty or partially loaded one.
+
+        :param step: A dict containing 'name', 'type' and 'local_path' (at least) keys
+        - step.name is the name of the live table
+        - step.type is the type of database object - the database transaction will only be performed if type = 'table'
+        - step.local_path is the full path to the source file (csv) - only tables with data to load are staged
+        """
+        if step['type'] != 'table' or not step.get('local_path'):
+            return
+
+        staging_name = get_staging_table_name(step['name'])
+        self._logger.info("Swapping {staging_name} into place as {type} {name}".format(staging_name=staging_name,
+                                                                                      **step))
+        self.__exec("DROP TABLE IF EXISTS {} CASCADE".format(step['name']))
+        self.__exec("ALTER TABLE {} RENAME TO {}".format(staging_name, step['name']))
+
+        _, schema = self._get_yaml_schema(step)
+        if schema and self._get_primary_key(schema):
+            self.__exec("ALTER TABLE {} RENAME CONSTRAINT {} TO {}".format(
+                step['name'], get_primary_key_name(staging_name), get_primary_key_name(step['name'])))
 
     def get_spatial_extent(self, db_schema, table, column, resolution):
         """Function to retrieve spatial data from the database.
 
+        The result is cached for the lifetime of this instance (until data is modified by this instance).
+
         :param db_schema: string containing name of schema
         :param table: string containing name of table
         :param column: string containing name of column
         :param resolution: int as resolution of polygons
         """
-        self._logger.info("Retrieving spatial extent")
-        query = "SELECT BoundingPolygonAsGml3('{schema}','{table}','{column}',{resolution})".format(
-            schema=db_schema,
-            table=table,
-            column=column,
-            resolution=resolution
-        )
-        return self.__query(query)
+        key = ('spatial', db_schema, table, column, resolution)
+        if key not in self._extent_cache:
+            self._logger.info("Retrieving spatial extent")
+            query = "SELECT BoundingPolygonAsGml3('{schema}','{table}','{column}',{resolution})".format(
+                schema=db_schema,
+                table=table,
+                column=column,
+                resolution=resolution
+            )
+            self._extent_cache[key] = self.__query(query)
+        return self._extent_cache[key]
+
+    def get_extents(self, table, temporal_columns=(), vertical_columns=()):
+        """Function to retrieve the temporal and vertical extents of several columns of a table in a single scan.
+
+        Results are cached for the lifetime of this instance (until data is modified by this instance), so only the
+        extents which have not already been retrieved are queried.
+
+        :param table: string containing name of table
+        :param temporal_columns: list of names of timestamp columns
+        :param vertical_columns: list of names of numeric columns
+        :return: dict mapping ('temporal', column) and ('vertical', column) tuples to dicts containing 'min_value' and
+            'max_value' keys
+        """
+        requested = [('temporal', c) for c in temporal_columns] + [('vertical', c) for c in vertical_columns]
+        missing = [r for r in OrderedDict.fromkeys(requested) if (table, r) not in self._extent_cache]
+
+        if missing:
+            self._logger.info("Retrieving {kinds} extents of {table}".format(
+                kinds=' and '.join(sorted({kind for kind, _ in missing})), table=table))
+            expressions = []
+            for i, (kind, column) in enumerate(missing):
+                for func in ('MIN', 'MAX'):
+                    if kind == 'temporal':
+                        expression = "TO_CHAR(timezone('UTC'::text, {func}(\"{column}\")), 'YYYY-MM-DDThh:mm:ss')"
+                    else:
+                        expression = '{func}("{column}")'
+                    expressions.append('{expression} AS e{i}_{func}'.format(
+                        expression=expression.format(func=func, column=column), i=i, func=func.lower()))
+            query = "SELECT {expressions} FROM {table}".format(expressions=', '.join(expressions), table=table)
+
+            result = self.__query(query)
+            for i, r in enumerate(missing):
+                self._extent_cache[(table, r)] = {
+                    'min_value': result['e{}_min'.format(i)],
+                    'max_value': result['e{}_max'.format(i)]
+                }
+
+        return {r: self._extent_cache[(table, r)] for r in requested}
+
+    def prefetch_extents(self, metadata_updates):
+        """Function to retrieve the temporal and vertical extents required by a list of metadata updates, with a single
+        scan of each table, so that they are retrieved from the cache by :py:meth:`get_temporal_extent` and
+        :py:meth:`get_vertical_extent`.
+
+        :param metadata_updates: list of dicts containing optional 'temporal' and 'vertical' keys, each of which is a
+            dict containing 'table' and 'column' keys
+        :return: None
+        """
+        columns = OrderedDict()
+        for m in metadata_updates:
+            for kind in ('temporal', 'vertical'):
+                if m.get(kind):
+                    table_columns = columns.setdefault(m[kind]['table'], {'temporal': [], 'vertical': []})
+                    table_columns[kind].append(m[kind]['column'])
+        for table, c in columns.items():
+            self.get_extents(table, temporal_columns=c['temporal'], vertical_columns=c['vertical'])
 
     def get_temporal_extent(self, table, column):
         """Function to retrieve temporal data from the database.
@@ -225,17 +873,7 @@ class DatabaseInteractions(object):
         :param table: string containing name of table
         :param column: string containing name of column
         """
-        self._logger.info("Retrieving temporal extent")
-        query = """
-            SELECT 
-                TO_CHAR(timezone('UTC'::text, MIN("{column}")), 'YYYY-MM-DDThh:mm:ss') as min_value,
-                TO_CHAR(timezone('UTC'::text, MAX("{column}")), 'YYYY-MM-DDThh:mm:ss') as max_value
-            FROM {table}
-        """.format(
-            table=table,
-            column=column
-        )
-        return self.__query(query)
+        return self.get_extents(table, temporal_columns=[column])[('temporal', column)]
 
     def get_vertical_extent(self, table, column):
         """Function to retrieve vertical data from the database.
@@ -243,14 +881,4 @@ class DatabaseInteractions(object):
         :param table: string containing name of table
         :param column: string containing name of column
         """
-        self._logger.info("Retrieving vertical extent")
-        query = """
-            SELECT
-                MIN("{column}") as "min_value",
-                MAX("{column}") as "max_value"
-            FROM {table}
-        """.format(
-            table=table,
-            column=column
-        )
-        return self.__query(query)
+        return self.get_extents(table, vertical_columns=[column])[('vertical', column)]
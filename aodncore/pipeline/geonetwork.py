@@ -4,13 +4,17 @@ Geonetwork Library
 import contextlib
 import json
 import os
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from io import StringIO
 from xml.etree import ElementTree
 
 # 'requests>=2.5' is a dependency of tableschema (and possibly other aodncore requirements), however should tableschema
 # no longer be required, it may be necessary to explicitly install 'requests'
 import requests
+from requests.adapters import HTTPAdapter
 from requests.exceptions import ConnectionError, RequestException
+from urllib3.util.retry import Retry
 
 from ..util import list_not_empty, generate_id
 from .exceptions import GeonetworkRequestError, GeonetworkConnectionError
@@ -20,6 +24,32 @@ BASE_API = "srv/api/0.1"
 ENDPOINT_RECORD_GET = 'records'
 ENDPOINT_BATCH_UPDATE = 'records/batchediting'
 
+DEFAULT_POOL_SIZE = 4
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF_FACTOR = 0.5
+RETRY_STATUS_CODES = (429, 502, 503, 504)
+
+# the batchediting PUT replaces the extents of a record, so it is safe to retry along with the read-only methods
+RETRY_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT'])
+
+MetadataUpdateResult = namedtuple('MetadataUpdateResult', ('uuid', 'error'))
+
+
+def get_retry(max_retries, backoff_factor):
+    """Get a retry policy for the Geonetwork API, retrying connection errors and transient server errors
+
+    :param max_retries: maximum number of retries of each request
+    :param backoff_factor: backoff factor between retries, as per :py:class:`urllib3.util.retry.Retry`
+    :return: :py:class:`urllib3.util.retry.Retry` instance
+    """
+    kwargs = dict(total=max_retries, backoff_factor=backoff_factor, status_forcelist=RETRY_STATUS_CODES,
+                  raise_on_status=False)
+    try:
+        return Retry(allowed_methods=RETRY_METHODS, **kwargs)
+    except TypeError:
+        # urllib3 < 1.26
+        return Retry(method_whitelist=RETRY_METHODS, **kwargs)
+
 
 def dict_to_xml(tag, value=None, attr=None, elems=None, display=True):
     """Convert a dictionary of XML nodes into a nested XML string
@@ -61,18 +91,30 @@ def geonetwork_exception_handler():
 class Geonetwork(object):
     """Geonetwork API session handler
 
+    The session keeps up to `pool_size` connections to the Geonetwork instance alive for reuse, and retries requests
+    which fail due to connection errors or transient server errors with an exponential backoff.
+
     :param base_url: Geonetwork instance base url
     :param username: username for the Geonetwork API
     :param password: password for the Geonetwork API
-    :param logger: an instance of the logger
+    :param pool_size: maximum number of connections kept alive, and of concurrent requests made by the batch methods
+    :param max_retries: maximum number of retries of each request
+    :param backoff_factor: backoff factor between retries
     """
-    def __init__(self, base_url, username, password):
+    def __init__(self, base_url, username, password, pool_size=DEFAULT_POOL_SIZE, max_retries=DEFAULT_MAX_RETRIES,
+                 backoff_factor=DEFAULT_BACKOFF_FACTOR):
         self.base_url = base_url
+        self.pool_size = pool_size
 
         self.session = requests.Session()
         self.session.verify = True
         self.session.auth = (username, password)
 
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size,
+                              max_retries=get_retry(max_retries, backoff_factor))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
         # init cookies
         url = os.path.join(self.base_url, BASE_API)
         with geonetwork_exception_handler():
@@ -121,6 +163,74 @@ class Geonetwork(object):
         headers = {"accept": "application/json", "content-type": "application/json"}
         self._put(os.path.join(BASE_API, ENDPOINT_BATCH_UPDATE), data=changes, params=params, headers=headers)
 
+    def _map(self, func, items, max_workers=None):
+        """Call a function for each item concurrently, capturing the result or exception of each call
+
+        :param func: function accepting a single item
+        :param items: list of items
+        :param max_workers: maximum number of concurrent calls, defaulting to the connection pool size
+        :return: list of (result, exception) tuples, in the same order as the items
+        """
+        def call(item):
+            try:
+                return func(item), None
+            except Exception as e:
+                return None, e
+
+        if not items:
+            return []
+        with ThreadPoolExecutor(max_workers=min(max_workers or self.pool_size, len(items))) as executor:
+            return list(executor.map(call, items))
+
+    def get_records(self, uuids, max_workers=None):
+        """Retrieve many metadata records concurrently
+
+        :param uuids: list of Geonetwork record IDs
+        :param max_workers: maximum number of concurrent requests, defaulting to the connection pool size
+        :return: OrderedDict mapping each record ID to a tuple containing the record xml (or None) and the exception
+            raised when retrieving it (or None)
+        """
+        return OrderedDict(zip(uuids, self._map(self.get_record, uuids, max_workers)))
+
+    def update_records(self, changes, max_workers=None):
+        """Update many Geonetwork records concurrently
+
+        :param changes: dict mapping each record ID to its list of change dicts, as per :py:meth:`update_record`
+        :param max_workers: maximum number of concurrent requests, defaulting to the connection pool size
+        :return: OrderedDict mapping each record ID to the exception raised when updating it (or None)
+        """
+        uuids = list(changes)
+        results = self._map(lambda u: self.update_record(u, changes[u]), uuids, max_workers)
+        return OrderedDict((u, e) for u, (_, e) in zip(uuids, results))
+
+    def run_metadata_handlers(self, handlers, max_workers=None):
+        """Run many metadata handlers, fetching and updating their records concurrently
+
+        The extent data of each handler is collected in turn from its database connection, which is not shared between
+        threads, so any database error is raised immediately. Errors from the Geonetwork API are reported in the
+        results rather than raised, so that a failure to update one record does not prevent the others being updated.
+
+        :param handlers: list of :py:class:`GeonetworkMetadataHandler` instances
+        :param max_workers: maximum number of concurrent requests, defaulting to the connection pool size
+        :return: list of :py:class:`MetadataUpdateResult` instances, one for each handler with extents to update
+        """
+        handlers = [h for h in handlers if h.has_extents]
+        records = self.get_records([h.uuid for h in handlers], max_workers)
+
+        errors = OrderedDict()
+        changes = OrderedDict()
+        for handler in handlers:
+            xml_text, error = records[handler.uuid]
+            if error is not None:
+                errors[handler.uuid] = error
+                continue
+            handler.xml_text = xml_text
+            handler.collect_extent_data()
+            changes[handler.uuid] = handler.build_api_payload()
+
+        errors.update(self.update_records(changes, max_workers))
+        return [MetadataUpdateResult(h.uuid, errors.get(h.uuid)) for h in handlers]
+
 
 class GeonetworkMetadataHandler(object):
     """Handle changes to Geonetwork metadata from Harvester
@@ -211,17 +321,25 @@ class GeonetworkMetadataHandler(object):
              'xpath': './/mri:MD_DataIdentification/mri:extent'}
         ]
 
-    def run(self):
-        if list_not_empty([self.spatial, self.temporal, self.vertical]):
-            self._logger.info('Collecting extent data for {}'.format(self.uuid))
-            if self.spatial:
-                self.spatial_data = self._conn.get_spatial_extent(**self.spatial)
-            if self.temporal:
-                self.temporal_data = self._conn.get_temporal_extent(**self.temporal)
-            if self.vertical:
-                self.vertical_data = self._conn.get_vertical_extent(**self.vertical)
+    @property
+    def has_extents(self):
+        return list_not_empty([self.spatial, self.temporal, self.vertical])
 
+    def collect_extent_data(self):
+        """Collect the extent data from the database"""
+        self._logger.info('Collecting extent data for {}'.format(self.uuid))
+        if self.spatial:
+            self.spatial_data = self._conn.get_spatial_extent(**self.spatial)
+        if self.temporal:
+            self.temporal_data = self._conn.get_temporal_extent(**self.temporal)
+        if self.vertical:
+            self.vertical_data = self._conn.get_vertical_extent(**self.vertical)
+
+    def run(self):
+        if self.has_extents:
             self.xml_text = self._session.get_record(self.uuid)
+            self.collect_extent_data()
+
             payload = self.build_api_payload()
             self._logger.info('Updating extent data for {}'.format(self.uuid))
             self._session.update_record(_uuid=self.uuid, changes=payload)
@@ -2,6 +2,7 @@ import logging
 import logging.config
 import os
 import platform
+from collections import OrderedDict
 from datetime import datetime
 from tempfile import gettempdir
 
@@ -13,14 +14,17 @@ from .destpath import get_path_function
 from .exceptions import (PipelineProcessingError, HandlerAlreadyRunError, InvalidConfigError, InvalidInputFileError,
                          InvalidFileFormatError, MissingConfigParameterError, UnmatchedFilesError)
 from .files import PipelineFile, PipelineFileCollection
-from .log import SYSINFO, get_pipeline_logger
+from .log import SYSINFO, flush_logger, get_pipeline_logger
+from .metrics import TransitionMetricsRecorder, get_metrics_sink
 from .schema import (validate_check_params, validate_custom_params, validate_harvest_params, validate_notify_params,
                      validate_resolve_params)
 from .statequery import StateQuery
 from .steps import (get_check_runner, get_harvester_runner, get_notify_runner, get_resolve_runner, get_store_runner)
+from .steps.notify import NOTIFICATION_TABLE_ATTRIBUTES
 from ..util import (ensure_regex_list, ensure_writeonceordereddict, format_exception,
-                    get_file_checksum, iter_public_attributes, lazyproperty, matches_regexes, merge_dicts,
-                    validate_relative_path_attr, TemporaryDirectory, WfsBroker, DEFAULT_WFS_VERSION)
+                    get_file_checksum, get_regex_matcher, iter_public_attributes, lazyproperty, merge_dicts,
+                    validate_relative_path_attr, TemporaryDirectory, WfsBroker, DEFAULT_WFS_QUERY_BATCH_SIZE,
+                    DEFAULT_WFS_VERSION)
 from ..version import __version__ as _aodncore_version
 
 __all__ = [
@@ -342,6 +346,7 @@ class HandlerBase(object):
         self._dest_path_function_ref = None
         self._dest_path_function_name = None
         self._handler_run = False
+        self._metrics_recorder = TransitionMetricsRecorder()
 
         self._machine = Machine(model=self, states=HandlerBase.all_states, initial='HANDLER_INITIAL',
                                 auto_transitions=False, transitions=HandlerBase.all_transitions,
@@ -349,7 +354,7 @@ class HandlerBase(object):
 
     def __iter__(self):
         ignored_attributes = {'celery_task', 'config', 'default_addition_publish_type', 'default_deletion_publish_type',
-                              'input_file_object', 'logger', 'state', 'state_query', 'trigger'}
+                              'input_file_object', 'logger', 'metrics', 'state', 'state_query', 'trigger'}
         ignored_attributes.update("is_{state}".format(state=s) for s in self.all_states)
 
         return iter_public_attributes(self, ignored_attributes)
@@ -570,6 +575,31 @@ class HandlerBase(object):
         """
         return self._should_notify
 
+    @property
+    def metrics(self):
+        """Read-only property containing performance metrics for the handler instance
+
+        The 'transitions' key contains the wall time, CPU time, peak RSS increase and bytes read/written for each
+        state machine transition (i.e. handler step) which has been run.
+
+        The 'storage' key contains the transfer statistics of each storage broker used by the handler (e.g. 'upload',
+        'archive').
+
+        :return: dict containing handler metrics
+        :rtype: :py:class:`dict`
+        """
+        storage = OrderedDict()
+        for name in ('upload', 'archive'):
+            # only include store runners which have been used, without triggering the lazy instantiation of others
+            store_runner = self.__dict__.get("_{name}_store_runner".format(name=name))
+            if store_runner is not None:
+                storage[name] = store_runner.broker.stats
+
+        return OrderedDict([
+            ('transitions', self._metrics_recorder.transitions),
+            ('storage', storage)
+        ])
+
     @property
     def start_time(self):
         """Read-only property containing the timestamp of when this instance was created
@@ -586,8 +616,11 @@ class HandlerBase(object):
         :return: StateQuery instance
         :rtype: :py:class:`StateQuery`
         """
-        wfs_broker = WfsBroker(self.config.pipeline_config['global'].get('wfs_url'),
-                               version=self.config.pipeline_config['global'].get('wfs_version', DEFAULT_WFS_VERSION))
+        global_config = self.config.pipeline_config['global']
+        wfs_broker = WfsBroker(global_config.get('wfs_url'),
+                               version=global_config.get('wfs_version', DEFAULT_WFS_VERSION),
+                               batch_size=global_config.get('wfs_query_batch_size', DEFAULT_WFS_QUERY_BATCH_SIZE),
+                               url_cache_ttl=global_config.get('wfs_url_cache_ttl'))
         return StateQuery(storage_broker=self._upload_store_runner.broker, wfs_broker=wfs_broker)
 
     @property
@@ -788,7 +821,7 @@ class HandlerBase(object):
     #
 
     def _notify_common(self):
-        collection_headers, collection_data = self.file_collection.get_table_data()
+        collection_headers, collection_data = self.file_collection.get_table_data(NOTIFICATION_TABLE_ATTRIBUTES)
         checks = () if self.check_params is None else self.check_params.get('checks', ())
 
         class_dict = dict(self)
@@ -849,7 +882,7 @@ class HandlerBase(object):
             raise InvalidFileFormatError("input file extension '{self.file_extension}' "
                                          "not in allowed_extensions list: {self.allowed_extensions}".format(self=self))
 
-        if self.allowed_regexes and not matches_regexes(self.file_basename, include_regexes=self.allowed_regexes):
+        if self.allowed_regexes and not get_regex_matcher(self.allowed_regexes).matches(self.file_basename):
             raise InvalidInputFileError("input file '{self.file_basename}' does not match any patterns "
                                         "in the allowed_regexes list: {self.allowed_regexes}".format(self=self))
 
@@ -922,8 +955,8 @@ class HandlerBase(object):
 
             self._should_notify = should_notify
 
-            self._trigger_notify_error()
-            self._trigger_complete_with_errors()
+            self._run_transition('_trigger_notify_error')
+            self._run_transition('_trigger_complete_with_errors')
         except Exception as e:
             self.logger.exception('error during _handle_error method: {e}'.format(e=format_exception(e)))
 
@@ -941,11 +974,43 @@ class HandlerBase(object):
         self._should_notify = should_notify
 
         try:
-            self._trigger_notify_success()
-            self._trigger_complete_success()
+            self._run_transition('_trigger_notify_success')
+            self._run_transition('_trigger_complete_success')
         except Exception as e:
             self.logger.exception('error during _handle_success method: {e}'.format(e=format_exception(e)))
 
+    def _run_transition(self, trigger):
+        name = trigger.replace('_trigger_', '', 1)
+        try:
+            with self._metrics_recorder.measure(name):
+                self.trigger(trigger)
+        finally:
+            self.logger.sysinfo("transition metrics for '{name}': {metrics}".format(
+                name=name, metrics=dict(self._metrics_recorder.transitions[name])))
+
+    def _export_metrics(self):
+        for name, stats in self.metrics['storage'].items():
+            for operation, operation_stats in stats['operations'].items():
+                self.logger.sysinfo(
+                    "storage metrics for '{name}' ({stats[broker_type]}, prefix='{stats[prefix]}') {operation}: "
+                    "files={o[count]} errors={o[errors]} bytes={o[bytes]} duration={o[duration]:.3f}s "
+                    "retries={o[retries]}".format(name=name, stats=stats, operation=operation, o=operation_stats))
+
+        try:
+            metrics_sink = get_metrics_sink(self.config.pipeline_config.get('metrics'))
+            if metrics_sink is None:
+                return
+
+            labels = {
+                'handler': self.__class__.__name__,
+                'pipeline': self._pipeline_name,
+                'result': self._result.name
+            }
+            metrics_sink.write(self._pipeline_name, self.metrics, labels)
+            self.logger.sysinfo("exported metrics to {metrics_sink}".format(metrics_sink=metrics_sink))
+        except Exception as e:
+            self.logger.warning("failed to export metrics: {e}".format(e=format_exception(e)))
+
     def _set_input_file_attributes(self):
         try:
             self._file_checksum = get_file_checksum(self.input_file)
@@ -1051,10 +1116,14 @@ class HandlerBase(object):
             self._instance_working_directory = instance_working_directory
             try:
                 for transition in HandlerBase.ordered_transitions:
-                    self.trigger(transition['trigger'])
+                    self._run_transition(transition['trigger'])
             except PipelineProcessingError as e:
                 self._handle_error(e)
             except (Exception, KeyboardInterrupt, SystemExit) as e:
                 self._handle_error(e, system_error=True)
             else:
                 self._handle_success()
+            finally:
+                self._export_metrics()
+                # ensure any queued log records for this handler have been written before returning
+                flush_logger(self.logger)
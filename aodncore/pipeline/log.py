@@ -3,9 +3,13 @@ configured :py:class:`LoggerAdapter`/:py:class:`Logger` instances
 """
 
 import logging
+import logging.handlers
 import os
+import queue
+import threading
+from importlib import import_module
 
-from ..util import validate_nonstring_iterable
+from ..util import validate_membership, validate_nonstring_iterable
 
 # custom SYSINFO logging level
 SYSINFO = 15
@@ -13,11 +17,164 @@ logging.addLevelName(SYSINFO, 'SYSINFO')
 
 __all__ = [
     'SYSINFO',
+    'BufferedQueueHandler',
     'WorkerLoggingConfigBuilder',
+    'flush_logger',
+    'get_queued_handler_config',
     'get_watchservice_logging_config',
     'get_pipeline_logger'
 ]
 
+DEFAULT_LOG_QUEUE_SIZE = 10000
+LOG_QUEUE_OVERFLOW_POLICIES = ('block', 'drop_new', 'drop_oldest')
+
+validate_overflow_policy = validate_membership(LOG_QUEUE_OVERFLOW_POLICIES)
+
+
+class _BlockingQueueListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # the default implementation uses put_nowait, which would fail if the bounded queue happened to be full
+        self.queue.put(self._sentinel)
+
+
+class BufferedQueueHandler(logging.handlers.QueueHandler):
+    """Handler which formats records in the calling thread, and places them on a bounded queue to be written out by
+    a target handler running in a background listener thread, so that logging calls do not block on disk writes
+
+    Records are formatted by this handler (using the formatter assigned to it), so the target handler only needs to
+    write the pre-formatted message.
+
+    :param handler: dict containing a 'class' key with the fully qualified name of the target handler class, and any
+        keyword arguments for the target handler class (e.g. 'filename')
+    :param max_queue_size: maximum number of records which may be waiting to be written
+    :param overflow_policy: action to take when the queue is full, with 'block' waiting for space to become available,
+        'drop_new' discarding the new record and 'drop_oldest' discarding the oldest waiting record
+    """
+
+    def __init__(self, handler, max_queue_size=DEFAULT_LOG_QUEUE_SIZE, overflow_policy='block'):
+        validate_overflow_policy(overflow_policy)
+        super().__init__(queue.Queue(maxsize=max_queue_size))
+
+        handler_kwargs = dict(handler)
+        module_name, class_name = handler_kwargs.pop('class').rsplit('.', 1)
+        handler_class = getattr(import_module(module_name), class_name)
+
+        self.handler = handler_class(**handler_kwargs)
+        self.overflow_policy = overflow_policy
+
+        self._dropped_count = 0
+        self._dropped_count_lock = threading.Lock()
+
+        self._listener = _BlockingQueueListener(self.queue, self.handler)
+        self._listener.start()
+
+    @property
+    def dropped_count(self):
+        return self._dropped_count
+
+    def _record_dropped(self):
+        with self._dropped_count_lock:
+            self._dropped_count += 1
+
+    def _report_dropped(self):
+        with self._dropped_count_lock:
+            dropped_count, self._dropped_count = self._dropped_count, 0
+
+        if dropped_count:
+            record = logging.makeLogRecord({
+                'name': __name__,
+                'levelno': logging.WARNING,
+                'levelname': logging.getLevelName(logging.WARNING),
+                'msg': "{dropped_count} log records dropped due to full log queue (overflow_policy='{policy}')".format(
+                    dropped_count=dropped_count, policy=self.overflow_policy)
+            })
+            self.handler.handle(self.prepare(record))
+
+    def enqueue(self, record):
+        if self.overflow_policy == 'block':
+            self.queue.put(record)
+            return
+
+        while True:
+            try:
+                self.queue.put_nowait(record)
+                return
+            except queue.Full:
+                if self.overflow_policy == 'drop_new':
+                    self._record_dropped()
+                    return
+
+            try:
+                oldest = self.queue.get_nowait()
+            except queue.Empty:
+                continue
+            self.queue.task_done()
+
+            if oldest is _BlockingQueueListener._sentinel:
+                # the listener is being stopped, and would never return if the stop sentinel were discarded, so the
+                # sentinel is put back and the new record is dropped instead
+                self.queue.put(oldest)
+                self._record_dropped()
+                return
+
+            self._record_dropped()
+
+    def flush(self):
+        """Block until all queued records have been written by the target handler, and flush the target handler
+
+        :return: None
+        """
+        if self._listener is not None:
+            self.queue.join()
+        self._report_dropped()
+        self.handler.flush()
+
+    def close(self):
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+        self._report_dropped()
+        self.handler.close()
+        super().close()
+
+
+def get_queued_handler_config(handler_config, queue_config):
+    """Convert a handler config into one which routes records through a :py:class:`BufferedQueueHandler`, writing to
+    the originally configured handler from a background thread
+
+    :param handler_config: handler config, as used in the 'handlers' section of a :py:meth:`logging.config.dictConfig`
+        config
+    :param queue_config: the 'queue' dict from the logging section of the pipeline config
+    :return: handler config for the queued handler
+    """
+    wrapped_handler_config = dict(handler_config)
+    queued_handler_config = {
+        '()': BufferedQueueHandler,
+        'max_queue_size': queue_config.get('max_size', DEFAULT_LOG_QUEUE_SIZE),
+        'overflow_policy': queue_config.get('overflow_policy', 'block')
+    }
+    for key in ('filters', 'formatter', 'level'):
+        if key in wrapped_handler_config:
+            queued_handler_config[key] = wrapped_handler_config.pop(key)
+    queued_handler_config['handler'] = wrapped_handler_config
+    return queued_handler_config
+
+
+def flush_logger(logger):
+    """Flush the handlers attached to the given logger, and those of its ancestors it propagates records to, ensuring
+    that any queued records have been written out
+
+    :param logger: :py:class:`Logger` or :py:class:`LoggerAdapter` instance
+    :return: None
+    """
+    if isinstance(logger, logging.LoggerAdapter):
+        logger = logger.logger
+
+    while logger is not None:
+        for handler in logger.handlers:
+            handler.flush()
+        logger = logger.parent if logger.propagate else None
+
 
 class WorkerLoggingConfigBuilder(object):
     def __init__(self, pipeline_config):
@@ -63,7 +220,7 @@ class WorkerLoggingConfigBuilder(object):
 
         handler_name = "{name}_handler".format(name=name)
 
-        self._dict_config['handlers'][handler_name] = {
+        handler_config = {
             'level': level,
             'class': 'logging.FileHandler',
             'formatter': formatter,
@@ -71,6 +228,11 @@ class WorkerLoggingConfigBuilder(object):
                                      "{name}.log".format(name=name)),
             'delay': True
         }
+        queue_config = self.pipeline_config['logging'].get('queue')
+        if queue_config is not None:
+            handler_config = get_queued_handler_config(handler_config, queue_config)
+
+        self._dict_config['handlers'][handler_name] = handler_config
         self._dict_config['loggers'][name] = {
             'handlers': [handler_name],
             'level': level,
@@ -118,6 +280,12 @@ def get_watchservice_logging_config(pipeline_config):
             }
         }
     }
+
+    queue_config = pipeline_config['logging'].get('queue')
+    if queue_config is not None:
+        watchservice_logging_config['handlers']['watchservice_handler'] = get_queued_handler_config(
+            watchservice_logging_config['handlers']['watchservice_handler'], queue_config)
+
     return watchservice_logging_config
 
 
@@ -0,0 +1,245 @@
+"""This module provides code to collect performance metrics (timing and resource usage) for the steps of a pipeline
+handler, and to export them via a pluggable "metrics sink", with a Prometheus
+`textfile collector <https://github.com/prometheus/node_exporter#textfile-collector>`_ writer provided as the default.
+"""
+
+import abc
+import os
+import re
+import resource
+import tempfile
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from importlib import import_module
+
+from .exceptions import InvalidConfigError
+from ..util import format_exception, validate_type
+from ..util.process import MAXRSS_MULTIPLIER
+
+__all__ = [
+    'BaseMetricsSink',
+    'PrometheusTextfileMetricsSink',
+    'TransitionMetricsRecorder',
+    'get_metrics_sink',
+    'get_resource_usage',
+    'validate_metrics_sink'
+]
+
+PROC_SELF_IO = '/proc/self/io'
+
+RESOURCE_USAGE_FIELDS = ('wall_time', 'cpu_time', 'max_rss', 'read_bytes', 'write_bytes')
+
+
+def _read_proc_io():
+    try:
+        with open(PROC_SELF_IO) as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+        return int(fields['rchar']), int(fields['wchar'])
+    except (IOError, OSError, KeyError, ValueError):
+        return None, None
+
+
+def get_resource_usage():
+    """Get a snapshot of the resources used so far by the current process
+
+    Bytes read and written are taken from the /proc filesystem and include all I/O performed by the process (e.g. file
+    and network transfers), and will be None on platforms where they are not available.
+
+    :return: dict containing a monotonic wall clock time, CPU time (seconds), peak RSS (bytes), bytes read and bytes
+        written
+    """
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    read_bytes, write_bytes = _read_proc_io()
+    return {
+        'wall_time': time.monotonic(),
+        'cpu_time': usage.ru_utime + usage.ru_stime,
+        'max_rss': usage.ru_maxrss * MAXRSS_MULTIPLIER,
+        'read_bytes': read_bytes,
+        'write_bytes': write_bytes
+    }
+
+
+def _get_usage_delta(start, end):
+    delta = OrderedDict()
+    for field in RESOURCE_USAGE_FIELDS:
+        name = 'max_rss_delta' if field == 'max_rss' else field
+        delta[name] = None if start[field] is None or end[field] is None else end[field] - start[field]
+    return delta
+
+
+class TransitionMetricsRecorder(object):
+    """Records the wall time, CPU time, peak RSS increase and bytes read/written for each measured step
+
+    Since peak RSS can only increase, 'max_rss_delta' represents how much a step raised the peak memory usage of the
+    process, rather than the total memory used by the step.
+    """
+
+    def __init__(self):
+        self.transitions = OrderedDict()
+
+    @contextmanager
+    def measure(self, name):
+        """Context manager to measure the resources used by the enclosed block of code, storing the results under the
+        given name
+
+        :param name: name of the step being measured
+        :return: None
+        """
+        start = get_resource_usage()
+        try:
+            yield
+        finally:
+            self.transitions[name] = _get_usage_delta(start, get_resource_usage())
+
+
+class BaseMetricsSink(object, metaclass=abc.ABCMeta):
+    """Base class for metrics sinks, which export the metrics of a completed handler to an external system
+    """
+
+    @abc.abstractmethod
+    def write(self, name, metrics, labels):
+        """Export the metrics for a single handler run
+
+        :param name: name identifying the source of the metrics (e.g. the pipeline name)
+        :param metrics: dict containing the handler metrics, as per :py:attr:`HandlerBase.metrics`
+        :param labels: dict of additional labels (e.g. pipeline name, handler class, result) describing the metrics
+        :return: None
+        """
+        pass
+
+
+class PrometheusTextfileMetricsSink(BaseMetricsSink):
+    """Metrics sink which writes the most recent metrics for each pipeline to a file in the Prometheus text exposition
+    format, suitable for collection by the node_exporter textfile collector
+
+    :param textfile_dir: directory in which to write the metrics files (i.e. the textfile collector directory)
+    :param prefix: prefix for the metric names
+    """
+    help_text = {
+        'wall_time': 'Wall clock time of the handler step in seconds',
+        'cpu_time': 'CPU time (user and system) of the handler step in seconds',
+        'max_rss_delta': 'Increase in peak resident set size of the process during the handler step in bytes',
+        'read_bytes': 'Bytes read by the process during the handler step',
+        'write_bytes': 'Bytes written by the process during the handler step'
+    }
+
+    metric_suffixes = {
+        'wall_time': 'wall_seconds',
+        'cpu_time': 'cpu_seconds',
+        'max_rss_delta': 'max_rss_delta_bytes',
+        'read_bytes': 'read_bytes',
+        'write_bytes': 'write_bytes'
+    }
+
+    storage_help_text = {
+        'count': 'Number of files processed by the storage operation',
+        'errors': 'Number of failed files for the storage operation',
+        'bytes': 'Bytes transferred by the storage operation',
+        'duration': 'Total duration of the storage operation in seconds',
+        'retries': 'Number of retried attempts for the storage operation'
+    }
+
+    storage_metric_suffixes = {
+        'count': 'files',
+        'errors': 'errors',
+        'bytes': 'bytes',
+        'duration': 'seconds',
+        'retries': 'retries'
+    }
+
+    def __init__(self, textfile_dir, prefix='aodncore_handler_transition', storage_prefix='aodncore_handler_storage'):
+        self.textfile_dir = textfile_dir
+        self.prefix = prefix
+        self.storage_prefix = storage_prefix
+
+    def __repr__(self):
+        return "{self.__class__.__name__}(textfile_dir='{self.textfile_dir}')".format(self=self)
+
+    @staticmethod
+    def _format_labels(labels):
+        escaped = ('{key}="{value}"'.format(key=k, value=str(v).replace('\\', r'\\').replace('"', r'\"'))
+                   for k, v in sorted(labels.items()))
+        return "{{{labels}}}".format(labels=','.join(escaped))
+
+    def render(self, metrics, labels):
+        """Render the given metrics in the Prometheus text exposition format
+
+        :param metrics: dict containing the handler metrics
+        :param labels: dict of additional labels
+        :return: string containing the rendered metrics
+        """
+        lines = []
+        transitions = metrics.get('transitions', {})
+        for field, suffix in self.metric_suffixes.items():
+            metric_name = "{prefix}_{suffix}".format(prefix=self.prefix, suffix=suffix)
+            lines.append("# HELP {name} {help}".format(name=metric_name, help=self.help_text[field]))
+            lines.append("# TYPE {name} gauge".format(name=metric_name))
+            for transition, values in transitions.items():
+                if values.get(field) is None:
+                    continue
+                transition_labels = dict(labels, transition=transition)
+                lines.append("{name}{labels} {value}".format(name=metric_name,
+                                                             labels=self._format_labels(transition_labels),
+                                                             value=values[field]))
+
+        storage = metrics.get('storage', {})
+        for field, suffix in self.storage_metric_suffixes.items():
+            metric_name = "{prefix}_{suffix}".format(prefix=self.storage_prefix, suffix=suffix)
+            lines.append("# HELP {name} {help}".format(name=metric_name, help=self.storage_help_text[field]))
+            lines.append("# TYPE {name} gauge".format(name=metric_name))
+            for store, broker_stats in storage.items():
+                for operation, values in broker_stats['operations'].items():
+                    operation_labels = dict(labels, store=store, broker_type=broker_stats['broker_type'],
+                                            prefix=broker_stats['prefix'], operation=operation)
+                    lines.append("{name}{labels} {value}".format(name=metric_name,
+                                                                 labels=self._format_labels(operation_labels),
+                                                                 value=values[field]))
+        return "\n".join(lines) + "\n"
+
+    def write(self, name, metrics, labels):
+        safe_name = re.sub(r'[^A-Za-z0-9_.-]', '_', name)
+        path = os.path.join(self.textfile_dir, "{prefix}_{name}.prom".format(prefix=self.prefix, name=safe_name))
+
+        # write to a temporary file and rename it into place, so that the collector never reads a partial file
+        fd, temp_path = tempfile.mkstemp(dir=self.textfile_dir, prefix='.', suffix='.prom.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(self.render(metrics, labels))
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, path)
+        except Exception:
+            os.unlink(temp_path)
+            raise
+
+
+validate_metrics_sink = validate_type(BaseMetricsSink)
+
+
+def get_metrics_sink(metrics_config):
+    """Factory function to return a metrics sink instance based on the 'metrics' section of the pipeline config
+
+    The optional 'sink' key is the fully qualified name of a :py:class:`BaseMetricsSink` subclass (defaulting to
+    :py:class:`PrometheusTextfileMetricsSink`), and all other keys are passed to the sink class as keyword arguments.
+
+    :param metrics_config: dict containing the 'metrics' section of the pipeline config
+    :return: :py:class:`BaseMetricsSink` instance, or None if metrics export is not configured
+    """
+    if not metrics_config:
+        return None
+
+    sink_kwargs = dict(metrics_config)
+    sink_class_name = sink_kwargs.pop('sink', None)
+
+    if sink_class_name is None:
+        sink_class = PrometheusTextfileMetricsSink
+    else:
+        try:
+            module_name, class_name = sink_class_name.rsplit('.', 1)
+            sink_class = getattr(import_module(module_name), class_name)
+        except (AttributeError, ImportError, ValueError) as e:
+            raise InvalidConfigError("invalid metrics sink '{sink}': {e}".format(sink=sink_class_name, e=format_exception(e)))
+
+    sink = sink_class(**sink_kwargs)
+    validate_metrics_sink(sink)
+    return sink
@@ -36,7 +36,18 @@ HARVEST_PARAMS_SCHEMA = {
     'properties': {
         'slice_size': {'type': 'integer'},
         'undo_previous_slices': {'type': 'boolean'},
-        'ingest_type': {'type': 'string', 'enum': ['replace', 'truncate', 'append']},
+        'adaptive_slicing': {'type': 'boolean'},
+        'min_slice_size': {'type': 'integer', 'minimum': 1},
+        'max_slice_size': {'type': 'integer', 'minimum': 1},
+        'max_slice_bytes': {'type': 'integer', 'minimum': 1},
+        'target_slice_duration': {'type': 'number', 'exclusiveMinimum': 0},
+        'max_parallel_slices': {'type': 'integer', 'minimum': 1},
+        'ingest_type': {'type': 'string', 'enum': ['replace', 'truncate', 'append', 'swap']},
+        'parallel_load': {'type': 'boolean'},
+        'reuse_matching_tables': {'type': 'boolean'},
+        'max_parallel_loads': {'type': 'integer', 'minimum': 1},
+        'copy_partitions': {'type': 'integer', 'minimum': 1},
+        'max_metadata_workers': {'type': 'integer', 'minimum': 1},
         'db_schema': {'type': 'string'},
         'db_objects': {
             'type': 'array',
@@ -148,6 +159,7 @@ PIPELINE_CONFIG_SCHEMA = {
                     'items': {'type': 'string'}
                 },
                 'archive_uri': {'type': 'string'},
+                'broker_health_check_ttl': {'type': 'integer', 'minimum': 0},
                 'error_uri': {'type': 'string'},
                 'opendap_root': {'type': 'string'},
                 'processing_dir': {'type': 'string'},
@@ -155,6 +167,8 @@ PIPELINE_CONFIG_SCHEMA = {
                 'upload_uri': {'type': 'string'},
                 'wfs_url': {'type': 'string'},
                 'wfs_version': {'type': 'string'},
+                'wfs_query_batch_size': {'type': 'integer', 'minimum': 1},
+                'wfs_url_cache_ttl': {'type': 'number', 'minimum': 0},
                 'wip_dir': {'type': 'string'}
             },
             'required': ['admin_recipients', 'archive_uri', 'error_uri', 'processing_dir', 'upload_uri', 'wip_dir'],
@@ -167,11 +181,28 @@ PIPELINE_CONFIG_SCHEMA = {
                 'lib_level': {'$ref': '#/definitions/loggingLevel'},
                 'pipeline_format': {'type': 'string'},
                 'log_root': {'type': 'string'},
+                'queue': {
+                    'type': 'object',
+                    'properties': {
+                        'max_size': {'type': 'integer', 'minimum': 1},
+                        'overflow_policy': {'type': 'string', 'enum': ['block', 'drop_new', 'drop_oldest']}
+                    },
+                    'additionalProperties': False
+                },
                 'watchservice_format': {'type': 'string'}
             },
             'required': ['level', 'pipeline_format', 'log_root', 'watchservice_format'],
             'additionalProperties': False
         },
+        'metrics': {
+            'type': 'object',
+            'properties': {
+                'sink': {'type': 'string'},
+                'textfile_dir': {'type': 'string'}
+            },
+            # any other properties are passed to the sink class
+            'additionalProperties': True
+        },
         'mail': {
             'type': 'object',
             'properties': {
@@ -180,7 +211,28 @@ PIPELINE_CONFIG_SCHEMA = {
                 'smtp_server': {'type': 'string'},
                 'smtp_port': {'type': 'integer'},
                 'smtp_user': {'type': 'string'},
-                'smtp_pass': {'type': 'string'}
+                'smtp_pass': {'type': 'string'},
+                'smtp_tls': {'type': 'boolean'},
+                'smtp_pool': {
+                    'type': 'object',
+                    'properties': {
+                        'enabled': {'type': 'boolean'},
+                        'max_idle_time': {'type': 'number', 'minimum': 0},
+                        'max_size': {'type': 'integer', 'minimum': 0}
+                    },
+                    'additionalProperties': False
+                },
+                'delivery_queue': {
+                    'type': 'object',
+                    'properties': {
+                        'enabled': {'type': 'boolean'},
+                        'batch_size': {'type': 'integer', 'minimum': 1},
+                        'max_retries': {'type': 'integer', 'minimum': 0},
+                        'retry_delay': {'type': 'number', 'minimum': 0},
+                        'max_size': {'type': 'integer', 'minimum': 0}
+                    },
+                    'additionalProperties': False
+                }
             },
             'required': ['from', 'subject', 'smtp_server', 'smtp_user', 'smtp_pass'],
             'additionalProperties': False
@@ -198,7 +250,8 @@ PIPELINE_CONFIG_SCHEMA = {
         'talend': {
             'type': 'object',
             'properties': {
-                'talend_log_dir': {'type': 'string'}
+                'talend_log_dir': {'type': 'string'},
+                'talend_timeout': {'type': 'number', 'exclusiveMinimum': 0}
             },
             'required': ['talend_log_dir'],
             'additionalProperties': False
@@ -207,7 +260,17 @@ PIPELINE_CONFIG_SCHEMA = {
             'type': 'object',
             'properties': {
                 'config_dir': {'type': 'string'},
-                'schema_base_dir': {'type': 'string'}
+                'schema_base_dir': {'type': 'string'},
+                'connection_pool': {
+                    'type': 'object',
+                    'properties': {
+                        'enabled': {'type': 'boolean'},
+                        'max_idle_time': {'type': 'number', 'minimum': 0},
+                        'health_check_interval': {'type': 'number', 'minimum': 0},
+                        'max_size': {'type': 'integer', 'minimum': 0}
+                    },
+                    'additionalProperties': False
+                }
             },
             'required': ['config_dir', 'schema_base_dir'],
             'additionalProperties': False
@@ -218,6 +281,8 @@ PIPELINE_CONFIG_SCHEMA = {
                 'template_package': {'type': 'string'},
                 'html_notification_template': {'type': 'string'},
                 'text_notification_template': {'type': 'string'},
+                'bytecode_cache_dir': {'type': 'string'},
+                'max_collection_table_rows': {'type': 'integer', 'minimum': 0}
             },
             'required': ['template_package', 'html_notification_template', 'text_notification_template'],
             'additionalProperties': False
@@ -227,6 +292,22 @@ PIPELINE_CONFIG_SCHEMA = {
             'properties': {
                 'incoming_dir': {'type': 'string'},
                 'logger_name': {'type': 'string'},
+                'routing': {
+                    'type': 'object',
+                    'description': "Enabling routing declares the queues with the 'x-max-priority' argument. "
+                                   "Existing queues created without it fail to redeclare with PRECONDITION_FAILED, "
+                                   "and must be deleted (or the pipelines renamed) before routing is enabled.",
+                    'properties': {
+                        'default_priority': {'$ref': '#/definitions/taskPriority'},
+                        'lanes': {
+                            'type': 'array',
+                            'items': {'$ref': '#/definitions/routingLane'}
+                        },
+                        'starvation_limit': {'type': 'integer', 'minimum': 1}
+                    },
+                    'additionalProperties': False
+                },
+                'startup_scan_workers': {'type': 'integer', 'minimum': 1},
                 'task_namespace': {'type': 'string'}
             },
             'required': ['incoming_dir', 'logger_name', 'task_namespace'],
@@ -240,7 +321,24 @@ PIPELINE_CONFIG_SCHEMA = {
         'loggingLevel': {
             'type': 'string',
             'enum': ['CRITICAL', 'FATAL', 'ERROR', 'WARNING', 'WARN', 'INFO', 'SYSINFO', 'DEBUG', 'NOTSET']
-        }
+        },
+        'routingLane': {
+            'type': 'object',
+            'properties': {
+                'name': {'type': 'string'},
+                'priority': {'$ref': '#/definitions/taskPriority'},
+                'regexes': {
+                    'type': 'array',
+                    'items': {'type': 'string'}
+                },
+                'min_size': {'type': 'integer', 'minimum': 0},
+                'max_size': {'type': 'integer', 'minimum': 0},
+                'dedicated_queue': {'type': 'boolean'}
+            },
+            'required': ['name', 'priority'],
+            'additionalProperties': False
+        },
+        'taskPriority': {'type': 'integer', 'minimum': 0, 'maximum': 9}
     }
 }
 
@@ -64,6 +64,16 @@ class StateQuery(object):
         """
         return self._wfs_broker.query_file_exists(layer, name)
 
+    def query_wfs_files_exist(self, layer, names):  # pragma: no cover
+        """Returns a dict representing whether each of the given 'file_url' values are present in a layer, using as
+        few GetFeature requests as possible
+
+        :param layer: layer name supplied to GetFeature typename parameter
+        :param names: list of 'file_url' values to query
+        :return: :py:class:`OrderedDict` mapping each name to whether the file is present in the layer
+        """
+        return self._wfs_broker.query_files_exist(layer, names)
+
     # Storage methods
     def download(self, remotepipelinefilecollection, local_path):
         """Helper method to download a RemotePipelineFileCollection or RemotePipelineFile
@@ -9,11 +9,15 @@ The "talend" harvester runner runs Talend instances as subprocesses, whereas the
 """
 
 import abc
+import copy
 import itertools
 import os
 import re
 import json
-from collections import OrderedDict
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from tempfile import NamedTemporaryFile
 from pathlib import Path
 
@@ -23,17 +27,20 @@ from ..exceptions import (InvalidHarvesterError, UnmappedFilesError, MissingConf
                           InvalidSQLTransactionError)
 from ..files import PipelineFileCollection, validate_pipelinefilecollection
 from ..geonetwork import Geonetwork, GeonetworkMetadataHandler
-from ..db import DatabaseInteractions
-from ...util import (LoggingContext, SystemProcess, TemporaryDirectory, merge_dicts, mkdir_p, validate_string,
-                     validate_type)
+from ..db import DatabaseInteractions, get_connection_pool
+from ...util import (LoggingContext, SystemProcess, TemporaryDirectory, ensure_regex, format_exception,
+                     get_regex_literal_prefix, merge_dicts, mkdir_p, validate_string, validate_type)
 
 __all__ = [
+    'AdaptiveSliceSizer',
     'create_input_file_list',
     'create_symlink',
     'executor_conversion',
     'get_harvester_runner',
+    'get_trigger_config_matcher',
     'HarvesterMap',
     'TalendHarvesterRunner',
+    'TriggerConfigMatcher',
     'CsvHarvesterRunner',
     'TriggerEvent',
     'validate_harvestermap',
@@ -41,6 +48,15 @@ __all__ = [
     'validate_triggerevent'
 ]
 
+DEFAULT_SLICE_SIZE = 2048
+DEFAULT_TARGET_SLICE_DURATION = 300
+SLICE_LATENCY_SMOOTHING = 0.5
+DEFAULT_MAX_PARALLEL_LOADS = 4
+DEFAULT_MAX_METADATA_WORKERS = 4
+
+_trigger_config_matcher = (None, None)
+_trigger_config_matcher_lock = threading.Lock()
+
 
 def get_harvester_runner(harvester_name, store_runner, harvest_params, tmp_base_dir, config, logger):
     """Factory function to return appropriate harvester class
@@ -176,6 +192,158 @@ def executor_conversion(executor):
     return python_formatted_exec
 
 
+class TriggerConfigMatcher(object):
+    """Precompiled index of the regular expressions in the trigger config, used to assign files to all of their
+    matching harvester events in a single pass
+
+    Each unique regex is compiled once, and indexed by its literal prefix (see :py:func:`get_regex_literal_prefix`), so
+    that a path is only tested against the regexes whose literal prefix it starts with, rather than against every
+    regex of every event of every harvester.
+
+    :param trigger_config: dict containing the trigger config
+    """
+
+    def __init__(self, trigger_config):
+        self.events = []
+
+        patterns = OrderedDict()
+        for harvester, config_item in trigger_config.items():
+            for event in config_item['events']:
+                event_id = len(self.events)
+                self.events.append((harvester, event.get('extra_params')))
+
+                for regex in event.get('regex', []):
+                    pattern = ensure_regex(regex)
+                    patterns.setdefault((pattern.pattern, pattern.flags), (pattern, []))[1].append(event_id)
+
+        # index of prefix length -> literal prefix -> list of (pattern, event IDs) tuples
+        self._index = defaultdict(lambda: defaultdict(list))
+        for pattern, event_ids in patterns.values():
+            prefix = get_regex_literal_prefix(pattern)
+            self._index[len(prefix)][prefix].append((pattern, frozenset(event_ids)))
+        self._prefix_lengths = sorted(self._index)
+
+    def __repr__(self):
+        return "{self.__class__.__name__}(events={events})".format(self=self, events=len(self.events))
+
+    def match(self, path):
+        """Get the IDs of all events with at least one regex matching the given path
+
+        :param path: path to match
+        :return: set of event IDs, which are indexes into :py:attr:`events`
+        """
+        event_ids = set()
+        for length in self._prefix_lengths:
+            for pattern, pattern_event_ids in self._index[length].get(path[:length], ()):
+                if not pattern_event_ids.issubset(event_ids) and pattern.match(path):
+                    event_ids.update(pattern_event_ids)
+        return event_ids
+
+
+def get_trigger_config_matcher(trigger_config):
+    """Get a :py:class:`TriggerConfigMatcher` for the given trigger config, which is only rebuilt when a different
+    trigger config object is passed, so that the regexes are compiled once per worker
+
+    :param trigger_config: dict containing the trigger config
+    :return: :py:class:`TriggerConfigMatcher` instance
+    """
+    global _trigger_config_matcher
+
+    with _trigger_config_matcher_lock:
+        cached_trigger_config, matcher = _trigger_config_matcher
+        if cached_trigger_config is not trigger_config:
+            matcher = TriggerConfigMatcher(trigger_config)
+            _trigger_config_matcher = (trigger_config, matcher)
+        return matcher
+
+
+class AdaptiveSliceSizer(object):
+    """Class to determine harvest slice sizes from the observed per-file harvest latency, such that each slice takes
+    approximately target_duration seconds to harvest
+
+    The per-file latency is smoothed with an exponentially weighted moving average, and the slice size is always kept
+    between min_size and max_size. If max_bytes is set, slices are also limited by the total size of the files they
+    contain, in order to bound the memory used by the harvester for each slice.
+
+    :param initial_size: size of the first slice, before any latency has been observed
+    :param min_size: minimum slice size
+    :param max_size: maximum slice size
+    :param target_duration: target duration of each slice, in seconds
+    :param max_bytes: maximum total size of the files in each slice, in bytes
+    """
+
+    def __init__(self, initial_size=DEFAULT_SLICE_SIZE, min_size=1, max_size=None,
+                 target_duration=DEFAULT_TARGET_SLICE_DURATION, max_bytes=None):
+        self.min_size = min_size
+        self.max_size = max_size if max_size is not None else max(initial_size, min_size)
+        self.target_duration = target_duration
+        self.max_bytes = max_bytes
+
+        self.slice_size = self._clamp(initial_size)
+        self.per_file_latency = None
+
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "{self.__class__.__name__}(slice_size={self.slice_size}, per_file_latency={self.per_file_latency})" \
+            .format(self=self)
+
+    def _clamp(self, size):
+        return max(self.min_size, min(self.max_size, size))
+
+    @staticmethod
+    def _get_file_size(pipeline_file):
+        try:
+            return os.path.getsize(pipeline_file.src_path)
+        except (OSError, TypeError):
+            return 0
+
+    def record(self, file_count, duration):
+        """Record the duration of a harvested slice, and update the slice size accordingly
+
+        :param file_count: number of files in the slice
+        :param duration: duration of the slice, in seconds
+        :return: None
+        """
+        if not file_count:
+            return
+
+        latency = duration / file_count
+        with self._lock:
+            if self.per_file_latency is None:
+                self.per_file_latency = latency
+            else:
+                self.per_file_latency = (SLICE_LATENCY_SMOOTHING * latency +
+                                         (1 - SLICE_LATENCY_SMOOTHING) * self.per_file_latency)
+
+            if self.per_file_latency > 0:
+                self.slice_size = self._clamp(int(self.target_duration / self.per_file_latency))
+            else:
+                self.slice_size = self.max_size
+
+    def get_slices(self, pipeline_files):
+        """Generate slices of the given collection, with the size of each slice determined when it is requested
+
+        :param pipeline_files: :py:class:`PipelineFileCollection` to slice
+        :return: generator yielding :py:class:`PipelineFileCollection` slices
+        """
+        start = 0
+        while start < len(pipeline_files):
+            end = min(start + self.slice_size, len(pipeline_files))
+
+            if self.max_bytes is not None:
+                total_bytes = 0
+                for index in range(start, end):
+                    total_bytes += self._get_file_size(pipeline_files[index])
+                    # always include at least one file, even if it exceeds the limit on its own
+                    if total_bytes > self.max_bytes and index > start:
+                        end = index
+                        break
+
+            yield pipeline_files[start:end]
+            start = end
+
+
 def validate_harvester_mapping(pipeline_files, harvester_map):
     """Validate whether all files in the given :py:class:`PipelineFileCollection` are present at least once in the
     given :py:class:`HarvesterMap`
@@ -212,13 +380,27 @@ class TalendHarvesterRunner(BaseHarvesterRunner):
             harvest_params = {}
 
         self.deletion = deletion
-        self.slice_size = harvest_params.get('slice_size', 2048)
+        self.slice_size = harvest_params.get('slice_size', DEFAULT_SLICE_SIZE)
         self.undo_previous_slices = harvest_params.get('undo_previous_slices', True)
+        self.max_parallel_slices = harvest_params.get('max_parallel_slices', 1)
         self.params = harvest_params
         self.tmp_base_dir = tmp_base_dir
         self.storage_broker = storage_broker
         self.harvested_file_map = HarvesterMap()
 
+        self.slice_sizer = None
+        if harvest_params.get('adaptive_slicing', False):
+            self.slice_sizer = AdaptiveSliceSizer(initial_size=self.slice_size,
+                                                  min_size=harvest_params.get('min_slice_size', 1),
+                                                  max_size=harvest_params.get('max_slice_size'),
+                                                  target_duration=harvest_params.get('target_slice_duration',
+                                                                                     DEFAULT_TARGET_SLICE_DURATION),
+                                                  max_bytes=harvest_params.get('max_slice_bytes'))
+
+        self._harvested_file_map_lock = threading.Lock()
+        self._storage_lock = threading.Lock()
+        self._failed_events = []
+
     def run(self, pipeline_files):
         """The entry point to the ported talend trigger code to execute the harvester(s) for each file
 
@@ -230,53 +412,110 @@ class TalendHarvesterRunner(BaseHarvesterRunner):
         additions = pipeline_files.filter_by_bool_attribute('pending_harvest_addition')
         late_deletions = pipeline_files.filter_by_bool_attribute('pending_harvest_late_deletion')
 
-        self._logger.sysinfo("harvesting slice size: {slice_size}".format(slice_size=self.slice_size))
-        deletion_slices = deletions.get_slices(self.slice_size)
-        addition_slices = additions.get_slices(self.slice_size)
-        late_deletions_slices = late_deletions.get_slices(self.slice_size)
-
-        for file_slice in deletion_slices:
-            deletion_map = self.match_harvester_to_files(file_slice)
-            validate_harvester_mapping(file_slice, deletion_map)
-            self.run_deletions(deletion_map, self.tmp_base_dir)
-
-        for file_slice in addition_slices:
-            addition_map = self.match_harvester_to_files(file_slice)
-            validate_harvester_mapping(file_slice, addition_map)
-            self.run_additions(addition_map, self.tmp_base_dir)
-
-        for file_slice in late_deletions_slices:
-            late_deletion_map = self.match_harvester_to_files(file_slice)
-            validate_harvester_mapping(file_slice, late_deletion_map)
-            self.run_deletions(late_deletion_map, self.tmp_base_dir)
+        if self.slice_sizer is None:
+            self._logger.sysinfo("harvesting slice size: {slice_size}".format(slice_size=self.slice_size))
+        else:
+            self._logger.sysinfo("harvesting with adaptive slice size: {slice_sizer}".format(
+                slice_sizer=self.slice_sizer))
+        if self.max_parallel_slices > 1:
+            self._logger.sysinfo("harvesting up to {max_parallel_slices} slices in parallel".format(
+                max_parallel_slices=self.max_parallel_slices))
+
+        self.run_slices(deletions, self.run_deletions)
+        self.run_slices(additions, self.run_additions)
+        self.run_slices(late_deletions, self.run_deletions)
+
+    def get_slices(self, pipeline_files):
+        if self.slice_sizer is None:
+            return pipeline_files.get_slices(self.slice_size)
+        return self.slice_sizer.get_slices(pipeline_files)
+
+    def run_slices(self, pipeline_files, run_method):
+        """Slice the given collection, match each slice to its harvester(s), and run the given method for each slice
+
+        If max_parallel_slices is greater than one, consecutive slices which do not share any harvesters are run in
+        parallel, in "waves" of up to max_parallel_slices slices. Each wave is completed before the next is started, and
+        any slices which fail within a wave are undone together once the entire wave has completed.
+
+        :param pipeline_files: :py:class:`PipelineFileCollection` to harvest
+        :param run_method: method to run for each slice (i.e. :py:meth:`run_additions` or :py:meth:`run_deletions`)
+        :return: None
+        """
+        wave = []
+        wave_harvesters = set()
+
+        for file_slice in self.get_slices(pipeline_files):
+            harvester_map = self.match_harvester_to_files(file_slice)
+            validate_harvester_mapping(file_slice, harvester_map)
+
+            if self.max_parallel_slices == 1:
+                self._run_slice(run_method, file_slice, harvester_map)
+                continue
+
+            slice_harvesters = set(harvester_map.map)
+            if wave and (len(wave) >= self.max_parallel_slices or not wave_harvesters.isdisjoint(slice_harvesters)):
+                self._run_wave(run_method, wave)
+                wave = []
+                wave_harvesters = set()
+
+            wave.append((file_slice, harvester_map))
+            wave_harvesters.update(slice_harvesters)
+
+        if wave:
+            self._run_wave(run_method, wave)
+
+    def _run_slice(self, run_method, file_slice, harvester_map, **kwargs):
+        start_time = time.monotonic()
+        run_method(harvester_map, self.tmp_base_dir, **kwargs)
+        if self.slice_sizer is not None:
+            self.slice_sizer.record(len(file_slice), time.monotonic() - start_time)
+
+    def _run_wave(self, run_method, wave):
+        if len(wave) == 1:
+            file_slice, harvester_map = wave[0]
+            self._run_slice(run_method, file_slice, harvester_map)
+            return
+
+        self._failed_events = []
+        with ThreadPoolExecutor(max_workers=len(wave)) as executor:
+            futures = [executor.submit(self._run_slice, run_method, file_slice, harvester_map, parallel=True)
+                       for file_slice, harvester_map in wave]
+        errors = [f.exception() for f in futures if f.exception() is not None]
+
+        if self._failed_events:
+            undo_map = HarvesterMap()
+            for harvester, event in self._failed_events:
+                undo_map.add_event(harvester, event)
+            if self.undo_previous_slices:
+                undo_map.merge(self.harvested_file_map)
+            self.undo_processed_files(undo_map)
+
+        if errors:
+            raise errors[0]
 
     def match_harvester_to_files(self, pipeline_files):
         validate_pipelinefilecollection(pipeline_files)
 
+        matcher = get_trigger_config_matcher(self._config.trigger_config)
+
+        event_files = defaultdict(list)
+        for pipeline_file in pipeline_files:
+            for event_id in matcher.match(pipeline_file.dest_path):
+                event_files[event_id].append(pipeline_file)
+
         harvester_map = HarvesterMap()
 
-        for harvester, config_item in self._config.trigger_config.items():
-            for event in config_item['events']:
-                extra_params = None
-                matched_files = PipelineFileCollection()
-
-                for config_type, value in event.items():
-                    if config_type == 'regex':
-                        for regex in value:
-                            matched_files_for_regex = pipeline_files.filter_by_attribute_regexes('dest_path', regex)
-                            if matched_files_for_regex:
-                                for mf in matched_files_for_regex:
-                                    self._logger.sysinfo(
-                                        "harvester '{harvester}' matched file: {mf.src_path}".format(
-                                            harvester=harvester, mf=mf))
-
-                                matched_files.update(matched_files_for_regex, overwrite=True)
-                    elif config_type == 'extra_params':
-                        extra_params = value
-
-                if matched_files:
-                    event_obj = TriggerEvent(matched_files, extra_params)
-                    harvester_map.add_event(harvester, event_obj)
+        for event_id, (harvester, extra_params) in enumerate(matcher.events):
+            matched_files = event_files.get(event_id)
+            if not matched_files:
+                continue
+
+            for mf in matched_files:
+                self._logger.sysinfo("harvester '{harvester}' matched file: {mf.src_path}".format(harvester=harvester,
+                                                                                                  mf=mf))
+
+            event_obj = TriggerEvent(PipelineFileCollection(matched_files, validate_unique=False), extra_params)
+            harvester_map.add_event(harvester, event_obj)
 
         return harvester_map
 
@@ -286,7 +525,8 @@ class TalendHarvesterRunner(BaseHarvesterRunner):
         undo_map.set_pipelinefile_bool_attribute('should_undo', True)
         self.run_undo_deletions(undo_map)
 
-    def execute_talend(self, executor, pipeline_files, talend_base_dir, success_attribute='is_harvested'):
+    def execute_talend(self, executor, pipeline_files, talend_base_dir, success_attribute='is_harvested',
+                       parallel=False):
         validate_pipelinefilecollection(pipeline_files)
 
         matched_file_list = [mf.dest_path for mf in pipeline_files]
@@ -299,28 +539,31 @@ class TalendHarvesterRunner(BaseHarvesterRunner):
 
         self._logger.sysinfo("executing {talend_exec}".format(talend_exec=talend_exec))
 
-        p = SystemProcess(talend_exec, shell=True)
+        # output is logged line by line as it is produced, rather than buffered until the process exits
+        p = SystemProcess(talend_exec, shell=True, output_callback=self._logger.info,
+                          timeout=self._config.pipeline_config['talend'].get('talend_timeout'))
 
+        # handler formatters are shared between threads, so output keeps the standard format for parallel slices
         self._logger.info('--- START TALEND OUTPUT ---')
-        with LoggingContext(self._logger, format_='%(message)s'):
+        with LoggingContext(self._logger, format_=None if parallel else '%(message)s'):
             try:
                 p.execute()
-            except Exception:
-                self._logger.error(p.stdout_text)
-                raise
-            else:
-                pipeline_files.set_bool_attribute(success_attribute, True)
-                self._logger.info(p.stdout_text)
             finally:
                 self._logger.info('--- END TALEND OUTPUT ---')
+                if p.rusage is not None:
+                    self._logger.sysinfo("talend process resource usage: duration={duration:.3f}s {rusage}".format(
+                        duration=p.duration, rusage=p.rusage))
 
-    def run_deletions(self, harvester_map, tmp_base_dir):
+        pipeline_files.set_bool_attribute(success_attribute, True)
+
+    def run_deletions(self, harvester_map, tmp_base_dir, parallel=False):
         """Function to un-harvest and delete files using the appropriate file upload runner.
 
         Operates in newly created temporary directory as talend requires a non-existent file to perform un-harvesting
 
         :param harvester_map: :py:class:`HarvesterMap` containing the events to be deleted
         :param tmp_base_dir: temporary directory base for talend operation
+        :param parallel: whether the map is being run in parallel with other slices
         """
         validate_harvestermap(harvester_map)
 
@@ -334,11 +577,12 @@ class TalendHarvesterRunner(BaseHarvesterRunner):
                         harvester_command = "{harvester_command} {extra_params}".format(
                             harvester_command=harvester_command, extra_params=event.extra_params)
 
-                    self.execute_talend(harvester_command, event.matched_files, talend_base_dir)
+                    self.execute_talend(harvester_command, event.matched_files, talend_base_dir, parallel=parallel)
 
                 files_to_delete = event.matched_files.filter_by_bool_attribute('pending_store_deletion')
                 if files_to_delete:
-                    self.storage_broker.delete(pipeline_files=files_to_delete)
+                    with self._storage_lock:
+                        self.storage_broker.delete(pipeline_files=files_to_delete)
 
     def run_undo_deletions(self, harvester_map):
         """Function to un-harvest and undo stored files as appropriate in the case of errors.
@@ -364,9 +608,10 @@ class TalendHarvesterRunner(BaseHarvesterRunner):
 
                 files_to_delete = event.matched_files.filter_by_bool_attributes_and('pending_undo', 'is_stored')
                 if files_to_delete:
-                    self.storage_broker.delete(pipeline_files=files_to_delete, is_stored_attr='is_upload_undone')
+                    with self._storage_lock:
+                        self.storage_broker.delete(pipeline_files=files_to_delete, is_stored_attr='is_upload_undone')
 
-    def run_additions(self, harvester_map, tmp_base_dir):
+    def run_additions(self, harvester_map, tmp_base_dir, parallel=False):
         """Function to harvest and upload files using the appropriate file upload runner.
 
         Operates in newly created temporary directory and creates symlink between source and destination file. Talend
@@ -374,6 +619,8 @@ class TalendHarvesterRunner(BaseHarvesterRunner):
 
         :param harvester_map: :py:class:`HarvesterMap` containing the events to be added
         :param tmp_base_dir: temporary directory base for talend operation
+        :param parallel: whether the map is being run in parallel with other slices, in which case a failed event is
+            recorded for the caller to undo once all parallel slices have completed, rather than being undone here
         """
         validate_harvestermap(harvester_map)
 
@@ -391,8 +638,14 @@ class TalendHarvesterRunner(BaseHarvesterRunner):
                             harvester_command=harvester_command, extra_params=event.extra_params)
 
                     try:
-                        self.execute_talend(harvester_command, event.matched_files, talend_base_dir)
+                        self.execute_talend(harvester_command, event.matched_files, talend_base_dir,
+                                            parallel=parallel)
                     except Exception:
+                        if parallel:
+                            with self._harvested_file_map_lock:
+                                self._failed_events.append((harvester, event))
+                            raise
+
                         # add current event to undo_map
                         undo_map = HarvesterMap()
                         undo_map.add_event(harvester, event)
@@ -406,16 +659,65 @@ class TalendHarvesterRunner(BaseHarvesterRunner):
                         raise
 
                     # on success, register this event in the instance 'harvested_file_map' attribute
-                    self.harvested_file_map.add_event(harvester, event)
+                    with self._harvested_file_map_lock:
+                        self.harvested_file_map.add_event(harvester, event)
 
                 files_to_upload = event.matched_files.filter_by_bool_attribute('pending_store_addition')
                 if files_to_upload:
-                    self.storage_broker.upload(pipeline_files=files_to_upload)
+                    with self._storage_lock:
+                        self.storage_broker.upload(pipeline_files=files_to_upload)
+
+
+_config_file_cache = {}
+_config_file_cache_lock = threading.Lock()
+
+
+def read_config_file(path):
+    """Read a JSON harvester config file, caching the parsed contents until the file is modified
+
+    :param path: path to the JSON file
+    :return: deep copy of the parsed file contents, so that the cached contents cannot be modified by the caller
+    """
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with _config_file_cache_lock:
+        cached = _config_file_cache.get(path)
+    if cached is None or cached[0] != signature:
+        with open(path) as json_file:
+            cached = (signature, json.load(json_file))
+        with _config_file_cache_lock:
+            _config_file_cache[path] = cached
+    return copy.deepcopy(cached[1])
 
 
 class CsvHarvesterRunner(BaseHarvesterRunner):
     """:py:class:`BaseHarvesterRunner` implementation to load csv pipeline files to the database."""
 
+    ingest_processes = {
+        "replace": [
+            "drop_object",
+            "create_table_from_yaml_file",
+            "load_data_from_csv",
+            "execute_sql_file",
+        ],
+        "truncate": [
+            "truncate_table",
+            "load_data_from_csv",
+            "refresh_materialized_view",
+        ],
+        "append": [
+            "load_data_from_csv",
+            "refresh_materialized_view",
+        ],
+        "swap": [
+            "create_staging_table",
+            "load_staging_data_from_csv",
+            "create_staging_primary_key",
+            "swap_staging_table",
+            "restore_object",
+        ],
+    }
+
     def __init__(self, storage_broker, harvest_params, config, logger):
         super().__init__(config, logger)
         if harvest_params is None:
@@ -428,6 +730,27 @@ class CsvHarvesterRunner(BaseHarvesterRunner):
         self.db_objects_raw = self.params.get('db_objects')
         self.db_objects = list(map(self.build_dependency_tree, self.db_objects_raw)) if self.db_objects_raw else None
         self.unexpected_pipeline_files = []
+        self.metadata_results = []
+
+    def get_connection_pool(self):
+        """Function to return the worker connection pool, if enabled in the 'connection_pool' harvester config
+
+        :return: DatabaseConnectionPool() instance, or None if connection pooling is not enabled
+        """
+        pool_config = self._config.pipeline_config['harvester'].get('connection_pool')
+        if pool_config and pool_config.get('enabled', True):
+            return get_connection_pool(**{k: v for k, v in pool_config.items() if k != 'enabled'})
+        return None
+
+    def get_connection(self, database_config, schema_base_path):
+        """Function to return a database connection context, using the worker connection pool if enabled
+
+        :param database_config: dict containing database connection parameters
+        :param schema_base_path: base directory of the schema files
+        :return: DatabaseInteractions() instance
+        """
+        return DatabaseInteractions(config=database_config, schema_base_path=schema_base_path, logger=self.logger,
+                                    pool=self.get_connection_pool())
 
     def run(self, pipeline_files):
         """The entry point to the generic csv harvester
@@ -447,14 +770,18 @@ class CsvHarvesterRunner(BaseHarvesterRunner):
             raise MissingConfigParameterError('Generic CSV Harvester requires that the '
                                               'harvest_params["db_objects"] attribute be set')
 
-        with DatabaseInteractions(config=self.get_config_file('database.json'),
-                                  schema_base_path=self._config.pipeline_config['harvester']['schema_base_dir'],
-                                  logger=self.logger) as conn:
-            process = self.get_process_sequence(conn)
-            for step in runsheet:
-                self._logger.info('Executing steps for {}'.format(step['name']))
-                for task in process:
-                    getattr(conn, task)(step)
+        database_config = self.get_config_file('database.json')
+        schema_base_path = self._config.pipeline_config['harvester']['schema_base_dir']
+        with self.get_connection(database_config, schema_base_path) as conn:
+            process = self.get_process_sequence(conn, runsheet)
+            parallel_load = self.params.get('parallel_load', False)
+            if parallel_load and process == self.ingest_processes['replace']:
+                self.run_parallel_load(conn, runsheet, database_config, schema_base_path)
+            else:
+                if parallel_load:
+                    self._logger.warning("parallel_load is only supported for the `replace` process sequence, "
+                                         "loading sequentially")
+                self.run_process_sequence(conn, runsheet, process)
 
         files_to_upload = pipeline_files.filter_by_bool_attribute('pending_store_addition')
         if files_to_upload:
@@ -469,16 +796,24 @@ class CsvHarvesterRunner(BaseHarvesterRunner):
                 gn = Geonetwork(
                     base_url=gn_config['metadata_url'],
                     username=gn_config['metadata_username'],
-                    password=gn_config['metadata_password']
+                    password=gn_config['metadata_password'],
+                    pool_size=self.params.get('max_metadata_workers', DEFAULT_MAX_METADATA_WORKERS)
                 )
-                with DatabaseInteractions(config=self.get_config_file('database.json'),
-                                          schema_base_path=self._config.pipeline_config['harvester']['schema_base_dir'],
-                                          logger=self.logger) as conn:
+                with self.get_connection(database_config, schema_base_path) as conn:
+                    conn.prefetch_extents(metadata)
+                    handlers = []
                     for m in metadata:
                         if 'spatial' in m:
                             m['spatial']['db_schema'] = self.params['db_schema']
-                        handler = GeonetworkMetadataHandler(conn, gn, m, self.logger)
-                        handler.run()
+                        handlers.append(GeonetworkMetadataHandler(conn, gn, m, self.logger))
+                    self.metadata_results = gn.run_metadata_handlers(handlers)
+
+                for result in self.metadata_results:
+                    if result.error is None:
+                        self._logger.info('Updated extent data for {}'.format(result.uuid))
+                    else:
+                        self._logger.warning('Failed to update extent data for {uuid}: {e}'.format(
+                            uuid=result.uuid, e=format_exception(result.error)))
             except (InvalidSQLConnectionError, InvalidSQLTransactionError):
                 raise
             except Exception as e:
@@ -492,36 +827,39 @@ class CsvHarvesterRunner(BaseHarvesterRunner):
         harvest_config = self._config.pipeline_config['harvester']['config_dir']
         fn = os.path.join(harvest_config, self.params['db_schema'], filename)
         try:
-            with open(fn) as json_file:
-                return json.load(json_file)
+            return read_config_file(fn)
         except FileNotFoundError as e:
             raise MissingConfigFileError(e)
 
-    def get_process_sequence(self, conn):
+    def get_process_sequence(self, conn, runsheet=None):
         """Function to return the database transaction process sequence based in ingest_type.
 
+        The `truncate` and `append` process sequences reuse the existing tables, so they are only used if the tables in
+        the runsheet match their yaml definitions, otherwise the `replace` process sequence is used instead.
+
+        If the `reuse_matching_tables` parameter is enabled and the `replace` process sequence is configured, the
+        `truncate` process sequence is used instead when the tables already match their definitions and all other
+        objects in the runsheet exist. Note that the `truncate` process sequence does not execute the sql files of the
+        objects, so changes to views, indexes, grants or triggers in those files are not applied, and truncating a table
+        fails if it is referenced by a foreign key, so this is only suitable for schemas where neither applies. This
+        does not apply when `parallel_load` is enabled, which explicitly loads into new tables.
+
         :param conn: instance of DatabaseInteractions().
+        :param runsheet: list of db_objects to be processed
         :return: dict containing process sequence.
         """
-        processes = {
-            "replace": [
-                "drop_object",
-                "create_table_from_yaml_file",
-                "load_data_from_csv",
-                "execute_sql_file",
-            ],
-            "truncate": [
-                "truncate_table",
-                "load_data_from_csv",
-                "refresh_materialized_view",
-            ],
-            "append": [
-                "load_data_from_csv",
-                "refresh_materialized_view",
-            ],
-        }
-        # compare_schemas not yet implemented
-        ingest_type = self.params.get('ingest_type', 'replace') if conn.compare_schemas() else 'replace'
+        processes = self.ingest_processes
+        ingest_type = self.params.get('ingest_type', 'replace')
+        if ingest_type in ('truncate', 'append') and not conn.compare_schemas(runsheet or []):
+            self._logger.info("Table schemas do not match their definitions, unable to use process sequence `{}`"
+                              .format(ingest_type))
+            ingest_type = 'replace'
+        elif (ingest_type == 'replace' and runsheet and self.params.get('reuse_matching_tables', False) and
+              not self.params.get('parallel_load', False)):
+            if self._can_reuse_objects(conn, runsheet):
+                self._logger.info("Existing objects match their definitions, using process sequence `truncate` "
+                                  "instead of `replace`")
+                ingest_type = 'truncate'
         process = processes.get(ingest_type)
         if process:
             self._logger.info("Using process sequence `{}`".format(ingest_type))
@@ -529,6 +867,167 @@ class CsvHarvesterRunner(BaseHarvesterRunner):
         else:
             raise InvalidConfigError('No implementation for {} ingest_type'.format(ingest_type))
 
+    @staticmethod
+    def _can_reuse_objects(conn, runsheet):
+        """Determine whether the existing database objects can be reused rather than dropped and recreated, i.e. all
+        tables match their yaml definitions, and all other objects exist
+
+        :param conn: instance of DatabaseInteractions()
+        :param runsheet: list of db_objects to be processed
+        :return: boolean - True if the existing objects can be reused, else False
+        """
+        if not conn.compare_schemas(runsheet):
+            return False
+        return all(conn.object_exists(step['name']) for step in runsheet if step['type'] != 'table')
+
+    def run_process_sequence(self, conn, runsheet, process):
+        """Function to execute the process sequence for each db_object in the runsheet.
+
+        The `swap` process sequence is executed one task at a time for all db_objects, so that every staging table is
+        loaded before any live table is swapped (and locked), and readers are only blocked for the swap itself.
+        Otherwise, all tasks are executed for each db_object in turn.
+
+        :param conn: instance of DatabaseInteractions()
+        :param runsheet: list of db_objects to be processed
+        :param process: list of DatabaseInteractions method names, as returned by :py:meth:`get_process_sequence`
+        :return: None
+        """
+        if process == self.ingest_processes['swap']:
+            for task in process:
+                self._logger.info('Executing {} for all objects'.format(task))
+                for step in runsheet:
+                    getattr(conn, task)(step)
+            return
+
+        for step in runsheet:
+            self._logger.info('Executing steps for {}'.format(step['name']))
+            for task in process:
+                getattr(conn, task)(step)
+
+    def run_parallel_load(self, conn, runsheet, database_config, schema_base_path):
+        """Function to execute the `replace` process sequence, loading the data for independent tables in parallel.
+
+        Tables with data to load are first created and loaded as staging tables over separate database connections (see
+        :py:meth:`load_staging_tables`). Each staging table is then swapped in place of its live table, and the
+        remaining steps executed, within the single transaction of the given connection. If anything fails, the staging
+        tables are dropped and the live tables are left unchanged. Objects without a staging table (e.g. views, or
+        tables only included as dependencies) are recreated as in the `replace` process sequence.
+
+        :param conn: instance of DatabaseInteractions() for the main transaction
+        :param runsheet: list of db_objects to be processed
+        :param database_config: dict containing database connection parameters
+        :param schema_base_path: base directory of the schema files
+        :return: None
+        """
+        staged_steps = []
+        try:
+            staged_steps = self.load_staging_tables(runsheet, database_config, schema_base_path)
+            staged_names = {step['name'] for step in staged_steps}
+
+            for step in runsheet:
+                self._logger.info('Executing steps for {}'.format(step['name']))
+                if step['name'] in staged_names:
+                    conn.swap_staging_table(step)
+                else:
+                    conn.drop_object(step)
+                    conn.create_table_from_yaml_file(step)
+                    conn.load_data_from_csv(step)
+                conn.execute_sql_file(step)
+        except Exception:
+            # the swaps are rolled back with the main transaction, so the staging tables must be dropped separately
+            self.drop_staging_tables(staged_steps, database_config, schema_base_path)
+            raise
+
+    def load_staging_tables(self, runsheet, database_config, schema_base_path):
+        """Function to create and load a staging table for each table in the runsheet with data to load.
+
+        Each table is loaded over a separate database connection, and is started as soon as all of its dependencies
+        in the runsheet have been loaded, so that independent branches of the dependency tree are loaded in parallel.
+        If any table fails to load, no further tables are started, and all staging tables are dropped once the running
+        loads have completed.
+
+        :param runsheet: list of db_objects to be processed
+        :param database_config: dict containing database connection parameters
+        :param schema_base_path: base directory of the schema files
+        :return: list of db_objects for which a staging table was loaded
+        """
+        pending = OrderedDict((step['name'], step) for step in runsheet
+                              if step['type'] == 'table' and step.get('local_path'))
+        staged_names = set(pending)
+        loaded_steps = []
+        errors = []
+
+        max_workers = self.params.get('max_parallel_loads', DEFAULT_MAX_PARALLEL_LOADS)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            running = {}
+            while pending or running:
+                if not errors:
+                    loaded_names = {step['name'] for step in loaded_steps}
+                    for name, step in list(pending.items()):
+                        if staged_names.intersection(step.get('dependencies', [])).issubset(loaded_names):
+                            future = executor.submit(self._load_staging_table, step, database_config,
+                                                     schema_base_path)
+                            running[future] = pending.pop(name)
+
+                if not running:
+                    if pending:
+                        errors.append(InvalidConfigError("circular dependencies between db_objects: {names}".format(
+                            names=list(pending))))
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    step = running.pop(future)
+                    if future.exception() is None:
+                        loaded_steps.append(step)
+                    else:
+                        errors.append(future.exception())
+
+        if errors:
+            self.drop_staging_tables(loaded_steps, database_config, schema_base_path)
+            raise errors[0]
+
+        return loaded_steps
+
+    def _load_staging_table(self, step, database_config, schema_base_path):
+        self._logger.info('Loading staging table for {}'.format(step['name']))
+        copy_partitions = self.params.get('copy_partitions', 1)
+        if copy_partitions <= 1:
+            with self.get_connection(database_config, schema_base_path) as conn:
+                conn.create_staging_table(step)
+                conn.load_staging_data_from_csv(step)
+                conn.create_staging_primary_key(step)
+            return
+
+        # the staging table must be committed before it is visible to the connections loading each partition
+        with self.get_connection(database_config, schema_base_path) as conn:
+            conn.create_staging_table(step)
+        try:
+            with self.get_connection(database_config, schema_base_path) as conn:
+                conn.load_staging_data_from_csv(step, partitions=copy_partitions)
+                conn.create_staging_primary_key(step)
+        except Exception:
+            self.drop_staging_tables([step], database_config, schema_base_path)
+            raise
+
+    def drop_staging_tables(self, steps, database_config, schema_base_path):
+        """Function to drop the staging tables for the given db_objects, logging rather than raising any errors, so
+        that the original error is not masked
+
+        :param steps: list of db_objects
+        :param database_config: dict containing database connection parameters
+        :param schema_base_path: base directory of the schema files
+        :return: None
+        """
+        if not steps:
+            return
+        try:
+            with self.get_connection(database_config, schema_base_path) as conn:
+                for step in steps:
+                    conn.drop_staging_table(step)
+        except Exception as e:
+            self._logger.warning("failed to drop staging tables: {e}".format(e=format_exception(e)))
+
     def build_dependency_tree(self, obj):
         """Update one item from the db_objects list to include indirect dependencies.
         (i.e. dependencies of dependencies, etc...).
@@ -555,12 +1054,15 @@ class CsvHarvesterRunner(BaseHarvesterRunner):
         :return: bool
         """
         found = False
+        path = Path(pf.local_path)
+        # compressed files are named after the table with the extension of the uncompressed file, e.g. table.csv.gz
+        stem = (Path(path.stem).stem if path.suffix == '.gz' else path.stem).lower()
         for obj in self.db_objects:
-            if Path(pf.local_path).stem.lower() == obj['name'].lower() and obj['type'] == "table":
+            if stem == obj['name'].lower() and obj['type'] == "table":
                 obj['include'] = True
                 obj['local_path'] = pf.local_path
                 found = True
-            elif Path(pf.local_path).stem.lower() in obj.get('dependencies', []):
+            elif stem in obj.get('dependencies', []):
                 obj['include'] = True
         if not found:
             self.unexpected_pipeline_files.append(pf.local_path)
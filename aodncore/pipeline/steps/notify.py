@@ -7,9 +7,16 @@ The most common use of this step is to send email notifications.
 """
 
 import abc
+import csv
+import gzip
+import io
 import os
+import queue
 import smtplib
-from collections import OrderedDict
+import socket
+import threading
+import time
+from collections import OrderedDict, defaultdict
 from email import encoders
 from email.mime.base import MIMEBase
 from email.mime.multipart import MIMEMultipart
@@ -22,19 +29,44 @@ from tabulate import tabulate
 from .basestep import BaseStepRunner
 from ..common import (NotificationRecipientType, validate_recipienttype)
 from ..exceptions import InvalidRecipientError, NotificationFailedError
+from ..log import flush_logger
 from ...util import (IndexedSet, TemplateRenderer, format_exception, lazyproperty, validate_bool, validate_dict,
                      validate_nonstring_iterable, validate_type)
 
 __all__ = [
+    'flush_email_delivery_queue',
     'get_notify_runner',
+    'get_email_delivery_queue',
+    'get_smtp_connection_pool',
+    'precompile_notification_templates',
+    'EmailDeliveryQueue',
     'NotifyRunnerAdapter',
     'EmailNotifyRunner',
     'LogFailuresNotifyRunner',
     'NotifyList',
     'NotificationRecipient',
+    'SmtpConnectionPool',
     'SnsNotifyRunner'
 ]
 
+# attributes of each file required by the notification tables and attachments, used to avoid exporting every public
+# attribute of every file in the collection
+NOTIFICATION_TABLE_ATTRIBUTES = ('name', 'check_passed', 'published', 'check_log')
+
+DEFAULT_MAX_COLLECTION_TABLE_ROWS = 1000
+
+DEFAULT_SMTP_PORT = 587
+DEFAULT_SMTP_TIMEOUT = 60
+
+DEFAULT_SMTP_POOL_MAX_IDLE_TIME = 60
+DEFAULT_SMTP_POOL_MAX_SIZE = 2
+
+DEFAULT_DELIVERY_BATCH_SIZE = 20
+DEFAULT_DELIVERY_MAX_RETRIES = 3
+DEFAULT_DELIVERY_RETRY_DELAY = 30
+DEFAULT_DELIVERY_MAX_QUEUE_SIZE = 1000
+DEFAULT_DELIVERY_FLUSH_TIMEOUT = 30
+
 
 def get_notify_runner(notification_data, config, logger, notify_params=None):
     """Factory function to return notify runner class
@@ -104,6 +136,53 @@ class BaseNotifyRunner(BaseStepRunner, metaclass=abc.ABCMeta):
         template_values.update(tables)
         return template_values
 
+    @property
+    def max_collection_table_rows(self):
+        """Maximum number of files included in the collection tables rendered into the message body
+
+        :return: number of rows
+        """
+        return self._config.pipeline_config['templating'].get('max_collection_table_rows',
+                                                              DEFAULT_MAX_COLLECTION_TABLE_ROWS)
+
+    @property
+    def collection_table_truncated(self):
+        """Whether the collection has more files than are included in the collection tables
+
+        :return: True if the collection tables are truncated
+        """
+        return len(self.notification_data['collection_data']) > self.max_collection_table_rows
+
+    def _get_collection_columns(self):
+        """Get the attributes included in the collection tables, and their corresponding column headers
+
+        :return: tuple containing (list of attribute names, list of column headers)
+        """
+        # column ordering and inclusion for collection table is determined entirely from this collection
+        included_columns = ('name', 'check_passed', 'published')
+
+        attribute_friendly_name_map = {
+            'name': 'Name',
+            'check_passed': 'Checks passed',
+            'published': 'Published?'
+        }
+
+        # this validates that only existing columns are included, and becomes the authoritative list of included
+        # columns, used when generating final headers and data rows
+        raw_headers = [h for h in included_columns if h in self.notification_data['collection_headers']]
+
+        # determine final column names by checking the "friendly" map for overrides
+        collection_headers = [attribute_friendly_name_map.get(h, h) for h in raw_headers]
+
+        return raw_headers, collection_headers
+
+    def _iter_collection_rows(self, limit=None):
+        raw_headers, _ = self._get_collection_columns()
+        collection_data = self.notification_data['collection_data']
+        if limit is not None:
+            collection_data = collection_data[:limit]
+        return ([pf[attr] for attr in raw_headers] for pf in collection_data)
+
     @staticmethod
     def _get_html_input_file_table(table_data):
         html_lines = ["<table><tbody>"]
@@ -143,28 +222,24 @@ class BaseNotifyRunner(BaseStepRunner, metaclass=abc.ABCMeta):
         text_input_file_table = self._get_text_input_file_table(input_file_table_data)
         html_input_file_table = self._get_html_input_file_table(input_file_table_data)
 
-        # column ordering and inclusion for collection table is determined entirely from this collection
-        included_columns = ('name', 'check_passed', 'published')
-
-        attribute_friendly_name_map = {
-            'name': 'Name',
-            'check_passed': 'Checks passed',
-            'published': 'Published?'
-        }
-
-        # this validates that only existing columns are included, and becomes the authoritative list of included
-        # columns, used when generating final headers and data rows
-        raw_headers = [h for h in included_columns if h in self.notification_data['collection_headers']]
-
-        # determine final column names by checking the "friendly" map for overrides
-        collection_headers = [attribute_friendly_name_map.get(h, h) for h in raw_headers]
+        _, collection_headers = self._get_collection_columns()
 
-        # generate a "list of lists", where each element is the row containing only the desired elements (ordered)
-        collection_data = [[pf[attr] for attr in raw_headers] for pf in self.notification_data['collection_data']]
+        # generate a "list of lists", where each element is the row containing only the desired elements (ordered),
+        # limited to the first rows of large collections in order to bound the size of the message
+        collection_data = list(self._iter_collection_rows(self.max_collection_table_rows))
 
         text_collection_table = tabulate(collection_data, collection_headers, tablefmt='simple')
         html_collection_table = tabulate(collection_data, collection_headers, tablefmt='html')
 
+        if self.collection_table_truncated:
+            total = len(self.notification_data['collection_data'])
+            summary = "{omitted} further files not shown (showing {shown} of {total} files)".format(
+                omitted=total - len(collection_data), shown=len(collection_data), total=total)
+            text_collection_table = "{table}{sep}{sep}{summary}".format(table=text_collection_table, sep=os.linesep,
+                                                                        summary=summary)
+            html_collection_table = "{table}{sep}<p>{summary}</p>".format(table=html_collection_table, sep=os.linesep,
+                                                                          summary=summary)
+
         return {
             'text_input_file_table': text_input_file_table,
             'html_input_file_table': html_input_file_table,
@@ -183,7 +258,7 @@ class BaseNotifyRunner(BaseStepRunner, metaclass=abc.ABCMeta):
         return recipient_addresses
 
     def _render(self):
-        template_renderer = TemplateRenderer()
+        template_renderer = get_notification_template_renderer(self._config)
         text = template_renderer.render(self._config.pipeline_config['templating']['text_notification_template'],
                                         self.template_values)
         html = template_renderer.render(self._config.pipeline_config['templating']['html_notification_template'],
@@ -220,6 +295,7 @@ class NotifyRunnerAdapter(BaseNotifyRunner):
             notify_runner.run(type_notify_list)
 
         failed_notifications = notify_list_object.filter_by_failed()
+        pending_notifications = notify_list_object.filter_by_pending()
         if failed_notifications:
             self._logger.error(
                 "notifications failed to the following recipients: {failed}".format(
@@ -228,12 +304,40 @@ class NotifyRunnerAdapter(BaseNotifyRunner):
             if succeeded_notifications:
                 self._logger.info("notifications succeeded to the following recipients: {succeeded}".format(
                     succeeded=list(r.raw_string for r in succeeded_notifications)))
-        else:
+        elif not pending_notifications:
             self._logger.info('all notification attempts were successful')
 
+        if pending_notifications:
+            self._logger.info("notifications queued for delivery to the following recipients: {pending}".format(
+                pending=list(r.raw_string for r in pending_notifications)))
+
         return notify_list_object
 
 
+def get_notification_template_renderer(config):
+    """Get a :py:class:`TemplateRenderer` for the notification templates, as per the 'templating' section of the
+    pipeline config
+
+    :param config: :py:class:`LazyConfigManager` instance
+    :return: :py:class:`TemplateRenderer` instance
+    """
+    return TemplateRenderer(bytecode_cache_dir=config.pipeline_config['templating'].get('bytecode_cache_dir'))
+
+
+def precompile_notification_templates(config):
+    """Compile the configured notification templates, so that notifications only incur the cost of rendering them
+
+    This is intended to be called when a worker starts, before any worker processes are forked, so that every process
+    shares the compiled templates.
+
+    :param config: :py:class:`LazyConfigManager` instance
+    :return: None
+    """
+    templating_config = config.pipeline_config['templating']
+    get_notification_template_renderer(config).precompile(templating_config['text_notification_template'],
+                                                          templating_config['html_notification_template'])
+
+
 def smtp_server_init(host, port, timeout):
     try:
         smtp_server = smtplib.SMTP(host=host, port=port, timeout=timeout)
@@ -242,6 +346,409 @@ def smtp_server_init(host, port, timeout):
         return e
 
 
+def smtp_connect(mail_config):
+    """Open an SMTP connection, upgrade it to TLS (unless disabled) and login, as per the 'mail' section of the pipeline
+    config
+
+    :param mail_config: dict containing the 'mail' section of the pipeline config
+    :return: :py:class:`smtplib.SMTP` instance
+    """
+    smtp_server = smtplib.SMTP(host=mail_config['smtp_server'], port=mail_config.get('smtp_port', DEFAULT_SMTP_PORT),
+                               timeout=DEFAULT_SMTP_TIMEOUT)
+    try:
+        if mail_config.get('smtp_tls', True):
+            smtp_server.starttls()
+        smtp_server.login(mail_config['smtp_user'], mail_config['smtp_pass'])
+    except Exception:
+        smtp_server.close()
+        raise
+    return smtp_server
+
+
+def is_transient_smtp_error(error):
+    """Determine whether an SMTP error is likely to succeed if retried (i.e. a connection failure or a 4xx response)
+
+    :param error: :py:class:`Exception` instance
+    :return: True if the error is transient
+    """
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException) and not isinstance(error, smtplib.SMTPConnectError):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError)):
+        return True
+    # SMTPException is a subclass of OSError, so socket errors must be distinguished from other SMTP errors
+    return isinstance(error, socket.error) and not isinstance(error, smtplib.SMTPException)
+
+
+class SmtpConnectionPool(object):
+    """Thread safe pool of idle, logged in SMTP connections, keyed by the server and user, so that successive
+    notifications are sent without negotiating TLS and authenticating each time
+
+    Idle connections are checked with a NOOP command before being reused, and connections idle for longer than
+    `max_idle_time` seconds are closed rather than reused, since the server is likely to have closed them.
+
+    :param max_idle_time: number of seconds after which an idle connection is closed
+    :param max_size: maximum number of idle connections retained for each server and user
+    """
+
+    def __init__(self, max_idle_time=DEFAULT_SMTP_POOL_MAX_IDLE_TIME, max_size=DEFAULT_SMTP_POOL_MAX_SIZE):
+        self.max_idle_time = max_idle_time
+        self.max_size = max_size
+
+        self._idle = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(connections) for connections in self._idle.values())
+
+    @staticmethod
+    def _get_key(mail_config):
+        return (mail_config['smtp_server'], mail_config.get('smtp_port', DEFAULT_SMTP_PORT), mail_config['smtp_user'],
+                mail_config.get('smtp_tls', True))
+
+    @staticmethod
+    def discard(smtp_server):
+        """Close a connection which is not to be returned to the pool
+
+        :param smtp_server: :py:class:`smtplib.SMTP` instance
+        :return: None
+        """
+        try:
+            smtp_server.quit()
+        except Exception:
+            smtp_server.close()
+
+    @staticmethod
+    def _is_alive(smtp_server):
+        try:
+            return smtp_server.noop()[0] == 250
+        except Exception:
+            return False
+
+    def acquire(self, mail_config):
+        """Get a live idle connection for the given mail config, or a new connection if there are none
+
+        :param mail_config: dict containing the 'mail' section of the pipeline config
+        :return: :py:class:`smtplib.SMTP` instance
+        """
+        key = self._get_key(mail_config)
+        while True:
+            with self._lock:
+                connections = self._idle.get(key)
+                smtp_server, released = connections.pop() if connections else (None, None)
+
+            if smtp_server is None:
+                return smtp_connect(mail_config)
+            if time.monotonic() - released <= self.max_idle_time and self._is_alive(smtp_server):
+                return smtp_server
+            self.discard(smtp_server)
+
+    def release(self, mail_config, smtp_server):
+        """Return a connection to the pool, or close it if the pool is full
+
+        :param mail_config: dict containing the 'mail' section of the pipeline config used to create the connection
+        :param smtp_server: :py:class:`smtplib.SMTP` instance
+        :return: None
+        """
+        key = self._get_key(mail_config)
+        with self._lock:
+            connections = self._idle[key]
+            if len(connections) < self.max_size:
+                connections.append((smtp_server, time.monotonic()))
+                return
+        self.discard(smtp_server)
+
+    def close(self):
+        """Close all idle connections
+
+        :return: None
+        """
+        with self._lock:
+            connections = [c for idle in self._idle.values() for c, _ in idle]
+            self._idle.clear()
+        for smtp_server in connections:
+            self.discard(smtp_server)
+
+    def sendmail(self, mail_config, from_address, recipient_addresses, message_string):
+        """Send a message over a pooled connection, reconnecting once if the pooled connection has been closed by the
+        server since it was checked
+
+        :param mail_config: dict containing the 'mail' section of the pipeline config
+        :param from_address: sender address
+        :param recipient_addresses: list of recipient addresses
+        :param message_string: message to send
+        :return: dict as returned by :py:meth:`smtplib.SMTP.sendmail`
+        """
+        for attempt in range(2):
+            smtp_server = self.acquire(mail_config)
+            try:
+                result = smtp_server.sendmail(from_address, recipient_addresses, message_string)
+            except smtplib.SMTPServerDisconnected:
+                smtp_server.close()
+                if attempt:
+                    raise
+                continue
+            except smtplib.SMTPRecipientsRefused:
+                # the transaction was reset, so the connection can still be used
+                self.release(mail_config, smtp_server)
+                raise
+            except Exception:
+                self.discard(smtp_server)
+                raise
+            self.release(mail_config, smtp_server)
+            return result
+
+
+class EmailDeliveryQueue(object):
+    """Queue of outgoing email messages, delivered in batches by a background thread over pooled SMTP connections, so
+    that handlers are not delayed waiting for the SMTP server
+
+    The recipients of a queued message are marked as pending until delivery has been attempted. Messages which fail
+    with a transient error (see :py:func:`is_transient_smtp_error`) are retried after `retry_delay` seconds, up to
+    `max_retries` times. Once a message has been delivered, or has failed permanently, the status of each recipient in
+    its :py:class:`NotifyList` is updated, and the result is logged. Since this usually happens after the handler which
+    queued the message has completed, the logger is flushed after each batch so that late results are not left
+    buffered. Any messages still undelivered when :py:meth:`flush` times out are logged as errors.
+
+    :param pool: :py:class:`SmtpConnectionPool` used to send the messages, so that each batch reuses a connection
+    :param batch_size: maximum number of messages sent before the connection is returned to the pool
+    :param max_retries: maximum number of retries of each message
+    :param retry_delay: number of seconds to wait before retrying a message
+    :param max_size: maximum number of messages waiting to be sent, after which :py:meth:`put` blocks
+    """
+
+    def __init__(self, pool=None, batch_size=DEFAULT_DELIVERY_BATCH_SIZE, max_retries=DEFAULT_DELIVERY_MAX_RETRIES,
+                 retry_delay=DEFAULT_DELIVERY_RETRY_DELAY, max_size=DEFAULT_DELIVERY_MAX_QUEUE_SIZE):
+        self.pool = pool if pool is not None else SmtpConnectionPool()
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+
+        self._queue = queue.Queue(maxsize=max_size)
+        self._retries = []
+        self._retries_lock = threading.Lock()
+        self._retry_now = False
+        self._unfinished = {}
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='EmailDeliveryQueue', daemon=True)
+                self._thread.start()
+
+    def put(self, mail_config, from_address, recipient_addresses, notify_list, message_string, logger):
+        """Add a message to the queue
+
+        :param mail_config: dict containing the 'mail' section of the pipeline config
+        :param from_address: sender address
+        :param recipient_addresses: list of recipient addresses
+        :param notify_list: :py:class:`NotifyList` of the recipients, which is marked as pending until the message has
+            been delivered
+        :param message_string: message to send
+        :param logger: :py:class:`Logger` instance used to report the delivery status
+        :return: None
+        """
+        notify_list.set_notification_pending()
+        self._ensure_started()
+        item = {'mail_config': mail_config, 'from_address': from_address, 'recipient_addresses': recipient_addresses,
+                'notify_list': notify_list, 'message_string': message_string, 'logger': logger, 'attempts': 0}
+        with self._retries_lock:
+            self._unfinished[id(item)] = item
+        self._queue.put(item)
+
+    def flush(self, timeout=None, retry_now=False):
+        """Wait until all queued messages (including those waiting to be retried) have been delivered or have failed
+
+        If the timeout expires, each message which has not been delivered is logged as an error, along with its
+        recipients.
+
+        :param timeout: maximum number of seconds to wait, or None to wait indefinitely
+        :param retry_now: retry failed messages immediately rather than after `retry_delay` seconds while waiting, so
+            that the retries are not left until after the timeout (e.g. when the process is about to exit)
+        :return: True if the queue was emptied, False if the timeout expired
+        """
+        if retry_now:
+            with self._retries_lock:
+                self._retry_now = True
+                self._retries = [(0, item) for _, item in self._retries]
+        try:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            with self._queue.all_tasks_done:
+                while self._queue.unfinished_tasks:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        break
+                    self._queue.all_tasks_done.wait(remaining)
+                else:
+                    return True
+        finally:
+            if retry_now:
+                with self._retries_lock:
+                    self._retry_now = False
+
+        self._log_undelivered()
+        return False
+
+    def _log_undelivered(self):
+        with self._retries_lock:
+            undelivered = list(self._unfinished.values())
+        for item in undelivered:
+            item['logger'].error("email delivery to {recipients} did not complete before the delivery queue flush "
+                                 "timed out, after {attempts} attempt(s)".format(recipients=item['recipient_addresses'],
+                                                                                 attempts=item['attempts']))
+        for logger in {id(item['logger']): item['logger'] for item in undelivered}.values():
+            flush_logger(logger)
+
+    def _task_done(self, item):
+        with self._retries_lock:
+            self._unfinished.pop(id(item), None)
+        self._queue.task_done()
+
+    def _get_batch(self):
+        batch = []
+        now = time.monotonic()
+        with self._retries_lock:
+            due = [r for r in self._retries if r[0] <= now][:self.batch_size]
+            for r in due:
+                self._retries.remove(r)
+        batch.extend(item for _, item in due)
+
+        timeout = 1 if not batch else 0
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get(timeout=timeout) if timeout else self._queue.get_nowait())
+                timeout = 0
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._get_batch()
+            for item in batch:
+                try:
+                    finished = self._deliver(item)
+                except Exception as e:  # pragma: no cover
+                    item['logger'].exception(e)
+                    finished = True
+                if finished:
+                    self._task_done(item)
+
+            for logger in {id(item['logger']): item['logger'] for item in batch}.values():
+                flush_logger(logger)
+
+    def _deliver(self, item):
+        """Attempt to deliver a queued message
+
+        :param item: dict describing the queued message
+        :return: False if the message has been scheduled to be retried, otherwise True
+        """
+        notify_list = item['notify_list']
+        recipient_addresses = item['recipient_addresses']
+        item['attempts'] += 1
+        try:
+            error_dict = self.pool.sendmail(item['mail_config'], item['from_address'], recipient_addresses,
+                                            item['message_string'])
+        except Exception as e:
+            if is_transient_smtp_error(e) and item['attempts'] <= self.max_retries:
+                with self._retries_lock:
+                    delay = 0 if self._retry_now else self.retry_delay
+                    self._retries.append((time.monotonic() + delay, item))
+                item['logger'].warning("email delivery to {recipients} failed, retrying in {delay} seconds. {e}".format(
+                    recipients=recipient_addresses, delay=delay, e=format_exception(e)))
+                return False
+            if isinstance(e, smtplib.SMTPRecipientsRefused):
+                error_dict = e.recipients
+            else:
+                item['logger'].error("email delivery to {recipients} failed. {e}".format(
+                    recipients=recipient_addresses, e=format_exception(e)))
+                notify_list.set_error(e)
+                self._set_delivered(notify_list)
+                return True
+
+        if error_dict:
+            item['logger'].error("email delivery failed to the following recipients: {failed}".format(
+                failed=error_dict))
+        else:
+            item['logger'].info("queued email delivered to {recipients}".format(recipients=recipient_addresses))
+        notify_list.update_from_error_dict(error_dict or {})
+        self._set_delivered(notify_list)
+        return True
+
+    @staticmethod
+    def _set_delivered(notify_list):
+        # the recipient statuses are updated before the pending flag is cleared, so that a recipient is never seen as
+        # having failed while the result is being recorded
+        notify_list.set_notification_attempted()
+        notify_list.set_notification_pending(False)
+
+
+_smtp_connection_pool = None
+_email_delivery_queue = None
+_notify_pid = None
+_notify_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    global _smtp_connection_pool, _email_delivery_queue, _notify_pid
+    if _notify_pid != os.getpid():
+        _smtp_connection_pool = None
+        _email_delivery_queue = None
+        _notify_pid = os.getpid()
+
+
+def get_smtp_connection_pool(**kwargs):
+    """Get the SMTP connection pool for the current process, creating it with the given parameters if it does not exist
+
+    :param kwargs: keyword arguments passed to :py:class:`SmtpConnectionPool` when the pool is created
+    :return: :py:class:`SmtpConnectionPool` instance
+    """
+    global _smtp_connection_pool
+    with _notify_lock:
+        _reset_after_fork()
+        if _smtp_connection_pool is None:
+            _smtp_connection_pool = SmtpConnectionPool(**kwargs)
+        return _smtp_connection_pool
+
+
+def get_email_delivery_queue(pool, **kwargs):
+    """Get the email delivery queue for the current process, creating it with the given parameters if it does not exist
+
+    The queue is delivered by a daemon thread, so :py:func:`flush_email_delivery_queue` must be called before the
+    process exits in order for queued messages not to be lost. In Celery workers, this is done by the
+    'worker_process_shutdown' signal handler in :py:mod:`aodncore.pipeline.watch`.
+
+    :param pool: :py:class:`SmtpConnectionPool` used by the queue when it is created
+    :param kwargs: keyword arguments passed to :py:class:`EmailDeliveryQueue` when the queue is created
+    :return: :py:class:`EmailDeliveryQueue` instance
+    """
+    global _email_delivery_queue
+    with _notify_lock:
+        _reset_after_fork()
+        if _email_delivery_queue is None:
+            _email_delivery_queue = EmailDeliveryQueue(pool=pool, **kwargs)
+        return _email_delivery_queue
+
+
+def flush_email_delivery_queue(timeout=DEFAULT_DELIVERY_FLUSH_TIMEOUT, retry_now=False):
+    """Wait for the email delivery queue of the current process (if any) to be emptied
+
+    :param timeout: maximum number of seconds to wait, or None to wait indefinitely
+    :param retry_now: retry failed messages immediately while waiting (see :py:meth:`EmailDeliveryQueue.flush`)
+    :return: True if the queue was emptied (or does not exist), False if the timeout expired
+    """
+    with _notify_lock:
+        _reset_after_fork()
+        delivery_queue = _email_delivery_queue
+    if delivery_queue is None:
+        return True
+    return delivery_queue.flush(timeout, retry_now=retry_now)
+
+
 class EmailNotifyRunner(BaseNotifyRunner):
     def _construct_message(self, recipient_addresses, subject, from_address):
         rendered_text, rendered_html = self.message_parts
@@ -282,9 +789,53 @@ class EmailNotifyRunner(BaseNotifyRunner):
             attachment.add_header('Content-Disposition', 'attachment', filename='error_logs.zip')
             message.attach(attachment)
 
+        if self.collection_table_truncated:
+            message.attach(self._get_collection_table_attachment())
+
         return message
 
+    def _get_collection_table_attachment(self):
+        """Write the complete collection table to a compressed CSV attachment, for collections too large to include
+        in the message body
+
+        :return: :py:class:`MIMEBase` instance
+        """
+        _, collection_headers = self._get_collection_columns()
+        attachment = MIMEBase('application', 'gzip')
+
+        with SpooledTemporaryFile(prefix='file_collection', suffix='.csv.gz') as attachment_file:
+            with gzip.GzipFile(fileobj=attachment_file, mode='wb') as g:
+                with io.TextIOWrapper(g, encoding='utf-8', newline='') as t:
+                    writer = csv.writer(t)
+                    writer.writerow(collection_headers)
+                    writer.writerows(self._iter_collection_rows())
+
+            attachment_file.seek(0)
+            attachment.set_payload(attachment_file.read())
+
+        encoders.encode_base64(attachment)
+        attachment.add_header('Content-Disposition', 'attachment', filename='file_collection.csv.gz')
+        return attachment
+
+    def _get_smtp_connection_pool(self):
+        pool_config = self._config.pipeline_config['mail'].get('smtp_pool', {})
+        if not pool_config.get('enabled', False):
+            return None
+        return get_smtp_connection_pool(**{k: v for k, v in pool_config.items() if k != 'enabled'})
+
+    def _get_delivery_queue(self):
+        queue_config = self._config.pipeline_config['mail'].get('delivery_queue', {})
+        if not queue_config.get('enabled', False):
+            return None
+        pool = self._get_smtp_connection_pool() or get_smtp_connection_pool()
+        return get_email_delivery_queue(pool, **{k: v for k, v in queue_config.items() if k != 'enabled'})
+
     def _send(self, recipient_addresses, message):
+        pool = self._get_smtp_connection_pool()
+        if pool is not None:
+            return pool.sendmail(self._config.pipeline_config['mail'], self._config.pipeline_config['mail']['from'],
+                                 recipient_addresses, message.as_string())
+
         host = self._config.pipeline_config['mail']['smtp_server']
         port = self._config.pipeline_config['mail'].get('smtp_port', 587)
         timeout = 60
@@ -313,6 +864,10 @@ class EmailNotifyRunner(BaseNotifyRunner):
         The status of each individual attempt is stored in a :py:class:`dict` instance, as described in the
         :py:meth:`smtplib.SMTP.sendmail` method docs, which allows per-recipient status inspection/error logging.
 
+        If the 'mail.delivery_queue' option is enabled, the message is instead handed to the
+        :py:class:`EmailDeliveryQueue` of the current process and this method returns immediately, with each recipient
+        marked as pending until the queued delivery has been attempted.
+
         :param notify_list: :py:class:`NotifyList` instance
         :return: None
         """
@@ -325,6 +880,13 @@ class EmailNotifyRunner(BaseNotifyRunner):
         from_address = self._config.pipeline_config['mail']['from']
         message = self._construct_message(recipient_addresses, subject, from_address)
 
+        delivery_queue = self._get_delivery_queue()
+        if delivery_queue is not None:
+            delivery_queue.put(self._config.pipeline_config['mail'], from_address, recipient_addresses, notify_list,
+                               message.as_string(), self._logger)
+            self._logger.info("email queued for delivery to {count} recipients".format(count=len(recipient_addresses)))
+            return
+
         error_dict = None
         try:
             error_dict = self._send(recipient_addresses, message)
@@ -430,6 +992,9 @@ class NotifyList(object):
     def filter_by_succeeded(self):
         return NotifyList(r for r in self.__s if r.notification_attempted and r.notification_succeeded)
 
+    def filter_by_pending(self):
+        return NotifyList(r for r in self.__s if r.notification_pending)
+
     def filter_by_notify_type(self, notify_type):
         """Return a new :py:class:`NotifyList` containing only recipients of the given notify_type
 
@@ -449,6 +1014,15 @@ class NotifyList(object):
         for recipient in self.__s:
             recipient.notification_attempted = True
 
+    def set_notification_pending(self, pending=True):
+        """Set whether the notification of all elements is pending, i.e. has been queued but not yet attempted
+
+        :param pending: boolean value to set
+        :return: None
+        """
+        for recipient in self.__s:
+            recipient.notification_pending = pending
+
     def set_error(self, error):
         """Set the error attribute for all elements
 
@@ -484,6 +1058,7 @@ class NotificationRecipient(object):
         self.error = error
 
         self._notification_attempted = False
+        self._notification_pending = False
         self._notification_succeeded = False
 
     def __repr__(self):  # pragma: no cover
@@ -515,6 +1090,15 @@ class NotificationRecipient(object):
         validate_bool(notification_attempted)
         self._notification_attempted = notification_attempted
 
+    @property
+    def notification_pending(self):
+        return self._notification_pending
+
+    @notification_pending.setter
+    def notification_pending(self, notification_pending):
+        validate_bool(notification_pending)
+        self._notification_pending = notification_pending
+
     @property
     def notification_succeeded(self):
         return self._notification_succeeded
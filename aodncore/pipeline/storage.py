@@ -1,7 +1,11 @@
 import abc
 import errno
 import os
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime
+from functools import wraps
 from http.client import IncompleteRead
 from io import open
 from ssl import SSLError
@@ -14,10 +18,11 @@ from paramiko import SSHClient, AutoAddPolicy
 from .exceptions import AttributeNotSetError, InvalidStoreUrlError, StorageBrokerError
 from .files import (ensure_pipelinefilecollection, ensure_remotepipelinefilecollection, PipelineFileCollection,
                     RemotePipelineFile, RemotePipelineFileCollection)
-from ..util import (ensure_regex_list, filesystem_sort_key, format_exception, mkdir_p, retry_decorator, rm_f,
-                    safe_copy_file, validate_relative_path, validate_type)
+from ..util import (ensure_regex_list, filesystem_sort_key, format_exception, get_regex_literal_prefix, mkdir_p,
+                    retry_decorator, rm_f, safe_copy_file, validate_relative_path, validate_type)
 
 __all__ = [
+    'count_attempts',
     'get_storage_broker',
     'LocalFileStorageBroker',
     'S3StorageBroker',
@@ -25,10 +30,146 @@ __all__ = [
     'sftp_makedirs',
     'sftp_mkdir_p',
     'sftp_path_exists',
-    'validate_storage_broker'
+    'validate_storage_broker',
+    'StorageTransferStats'
 ]
 
 DISALLOWED_DELETE_REGEXES = {'', '.*', '.+'}
+DEFAULT_HEALTH_CHECK_TTL = 300
+
+# successful health checks, keyed by process ID and broker, with the value being the time at which the result expires
+_health_check_cache = {}
+
+# upper bounds of the histogram buckets for operation durations (in seconds) and file sizes (in bytes)
+DURATION_HISTOGRAM_BUCKETS = (0.01, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, float('inf'))
+SIZE_HISTOGRAM_BUCKETS = (2 ** 10, 2 ** 20, 10 * 2 ** 20, 100 * 2 ** 20, 2 ** 30, 10 * 2 ** 30, float('inf'))
+
+
+class StorageTransferStats(object):
+    """Thread-safe accumulator of statistics for the operations performed by a storage broker
+
+    For each operation type (e.g. 'upload'), this records the number of files, errors, bytes transferred, total
+    duration and retried attempts, along with histograms of the per-file durations and sizes.
+    """
+
+    def __init__(self):
+        self._operations = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @staticmethod
+    def _new_histogram(buckets):
+        return OrderedDict((bucket, 0) for bucket in buckets)
+
+    @staticmethod
+    def _observe(histogram, value):
+        for bucket in histogram:
+            if value <= bucket:
+                histogram[bucket] += 1
+                return
+
+    def record_attempt(self):
+        """Record an attempt at the operation currently being measured in this thread, so that attempts made by a retry
+        decorator can be counted
+
+        :return: None
+        """
+        self._local.attempts = getattr(self._local, 'attempts', 0) + 1
+
+    def record(self, operation, duration, size=None, retries=0, error=False):
+        """Record a single file operation
+
+        :param operation: name of the operation
+        :param duration: duration of the operation in seconds
+        :param size: number of bytes transferred (if applicable)
+        :param retries: number of times the operation was retried
+        :param error: whether the operation ultimately failed
+        :return: None
+        """
+        with self._lock:
+            stats = self._operations.get(operation)
+            if stats is None:
+                stats = OrderedDict([
+                    ('count', 0),
+                    ('errors', 0),
+                    ('bytes', 0),
+                    ('duration', 0.0),
+                    ('retries', 0),
+                    ('duration_histogram', self._new_histogram(DURATION_HISTOGRAM_BUCKETS)),
+                    ('size_histogram', self._new_histogram(SIZE_HISTOGRAM_BUCKETS))
+                ])
+                self._operations[operation] = stats
+
+            stats['count'] += 1
+            stats['errors'] += int(error)
+            stats['duration'] += duration
+            stats['retries'] += retries
+            self._observe(stats['duration_histogram'], duration)
+            if size is not None:
+                stats['bytes'] += size
+                self._observe(stats['size_histogram'], size)
+
+    def measure(self, operation):
+        """Return a context manager which measures the enclosed operation, recording it on exit
+
+        The context manager value has a 'size' attribute which may be set by the caller once the number of bytes
+        transferred is known.
+
+        :param operation: name of the operation
+        :return: context manager
+        """
+        return _TransferMeasurement(self, operation)
+
+    def as_dict(self):
+        """Get a snapshot of the statistics
+
+        :return: dict of operation name to statistics dict
+        """
+        with self._lock:
+            return OrderedDict((operation, OrderedDict((k, v.copy() if isinstance(v, OrderedDict) else v)
+                                                       for k, v in stats.items()))
+                               for operation, stats in self._operations.items())
+
+
+class _TransferMeasurement(object):
+    def __init__(self, transfer_stats, operation):
+        self.transfer_stats = transfer_stats
+        self.operation = operation
+        self.size = None
+        self._start = None
+
+    def __enter__(self):
+        self.transfer_stats._local.attempts = 0
+        self._start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        retries = max(self.transfer_stats._local.attempts - 1, 0)
+        self.transfer_stats.record(self.operation, time.monotonic() - self._start, size=self.size, retries=retries,
+                                   error=exc_type is not None)
+        return False
+
+
+def count_attempts(method):
+    """Decorator for storage broker methods which records each call as an attempt in the broker's transfer stats. When
+    applied *inside* a retry decorator, this allows the number of retries to be reported.
+
+    :param method: storage broker method
+    :return: decorated method
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        self._transfer_stats.record_attempt()
+        return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+def _get_file_size(path):
+    try:
+        return os.path.getsize(path)
+    except (OSError, TypeError):
+        return None
 
 
 def get_storage_broker(store_url):
@@ -57,6 +198,8 @@ class BaseStorageBroker(object, metaclass=abc.ABCMeta):
         self.prefix = None
         self.mode = None
 
+        self._transfer_stats = StorageTransferStats()
+
     @abc.abstractmethod
     def _delete_file(self, pipeline_file, dest_path_attr):
         pass
@@ -85,6 +228,27 @@ class BaseStorageBroker(object, metaclass=abc.ABCMeta):
     def _get_is_overwrite(self, pipeline_file, abs_path):
         pass
 
+    @property
+    def stats(self):
+        """Read-only property containing a snapshot of the transfer statistics for all operations performed by this
+        broker instance
+
+        :return: dict containing the broker type, prefix and per-operation statistics
+        """
+        return OrderedDict([
+            ('broker_type', self.__class__.__name__),
+            ('prefix', self.prefix),
+            ('operations', self._transfer_stats.as_dict())
+        ])
+
+    def _check_health(self):
+        """Perform a lightweight check of the storage backend. Sub-classes should override this where a cheaper or
+        more appropriate check is available.
+
+        :return: None
+        """
+        self._pre_run_hook()
+
     def _get_absolute_dest_path(self, pipeline_file, dest_path_attr):
         rel_path = getattr(pipeline_file, dest_path_attr)
         if not rel_path:
@@ -106,6 +270,31 @@ class BaseStorageBroker(object, metaclass=abc.ABCMeta):
             abs_path = self._get_absolute_dest_path(pipeline_file=pipeline_file, dest_path_attr=dest_path_attr)
             pipeline_file.is_overwrite = self._get_is_overwrite(pipeline_file, abs_path)
 
+    def check_health(self, ttl=DEFAULT_HEALTH_CHECK_TTL):
+        """Check that the storage backend is usable, without listing its contents
+
+        A successful result is cached for the current process for the given number of seconds, so that repeated checks
+        against the same storage location (e.g. once per task in a worker process) do not all reach the backend.
+
+        :param ttl: number of seconds for which a successful check is cached (0 disables caching)
+        :return: None
+        """
+        cache_key = (os.getpid(), repr(self))
+        now = time.monotonic()
+
+        expiry = _health_check_cache.get(cache_key)
+        if expiry is not None and now < expiry:
+            return
+
+        try:
+            self._check_health()
+        except Exception as e:
+            _health_check_cache.pop(cache_key, None)
+            raise StorageBrokerError("storage health check failed: {e}".format(e=format_exception(e)))
+
+        if ttl:
+            _health_check_cache[cache_key] = now + ttl
+
     def download(self, remote_pipeline_files, local_path):
         """Download the given RemotePipelineFileCollection or RemotePipelineFile from the storage backend
 
@@ -120,7 +309,9 @@ class BaseStorageBroker(object, metaclass=abc.ABCMeta):
         for remote_pipeline_file in download_collection:
             try:
                 self._prepare_file_for_download(remote_pipeline_file, local_path)
-                self._download_file(remote_pipeline_file)
+                with self._transfer_stats.measure('download') as measurement:
+                    self._download_file(remote_pipeline_file)
+                    measurement.size = _get_file_size(remote_pipeline_file.local_path)
             except Exception as e:
                 raise StorageBrokerError("error downloading '{dest_path}' to '{local_path}': {e}".format(
                     dest_path=remote_pipeline_file.dest_path, local_path=local_path, e=format_exception(e)))
@@ -142,7 +333,9 @@ class BaseStorageBroker(object, metaclass=abc.ABCMeta):
         for remote_pipeline_file in download_collection:
             try:
                 self._prepare_file_for_download(remote_pipeline_file, local_path)
-                self._download_file(remote_pipeline_file)
+                with self._transfer_stats.measure('download') as measurement:
+                    self._download_file(remote_pipeline_file)
+                    measurement.size = _get_file_size(remote_pipeline_file.local_path)
                 yield remote_pipeline_file
             except Exception as e:
                 raise StorageBrokerError("error downloading '{dest_path}' to '{local_path}': {e}".format(
@@ -166,7 +359,9 @@ class BaseStorageBroker(object, metaclass=abc.ABCMeta):
 
         for pipeline_file in upload_collection:
             try:
-                self._upload_file(pipeline_file=pipeline_file, dest_path_attr=dest_path_attr)
+                with self._transfer_stats.measure('upload') as measurement:
+                    self._upload_file(pipeline_file=pipeline_file, dest_path_attr=dest_path_attr)
+                    measurement.size = _get_file_size(pipeline_file.src_path)
             except Exception as e:
                 raise StorageBrokerError("error uploading '{dest_path}': {e}".format(
                     dest_path=getattr(pipeline_file, dest_path_attr), e=format_exception(e)))
@@ -189,7 +384,8 @@ class BaseStorageBroker(object, metaclass=abc.ABCMeta):
 
         for pipeline_file in delete_collection:
             try:
-                self._delete_file(pipeline_file=pipeline_file, dest_path_attr=dest_path_attr)
+                with self._transfer_stats.measure('delete'):
+                    self._delete_file(pipeline_file=pipeline_file, dest_path_attr=dest_path_attr)
             except Exception as e:
                 raise StorageBrokerError("error deleting '{dest_path}': {e}".format(
                     dest_path=getattr(pipeline_file, dest_path_attr), e=format_exception(e)))
@@ -215,13 +411,24 @@ class BaseStorageBroker(object, metaclass=abc.ABCMeta):
         if not delete_regexes:
             return PipelineFileCollection()
 
-        all_files = self.query()
+        all_files = self.query(self._get_regexes_query(delete_regexes))
         files_to_delete = PipelineFileCollection.from_remotepipelinefilecollection(all_files, are_deletions=True) \
                                                 .filter_by_attribute_regexes('dest_path', delete_regexes)
 
         self.delete(files_to_delete)
         return files_to_delete
 
+    def _get_regexes_query(self, regexes):
+        """Get the narrowest query which will return every file whose dest_path could match one of the given regexes
+
+        The query is the common literal prefix of the regexes, which avoids listing the entire storage when the regexes
+        only target a small subset of files (e.g. files with a specific name in a large error store).
+
+        :param regexes: list of compiled regexes
+        :return: query string suitable for passing to :py:meth:`query`
+        """
+        return os.path.commonprefix([get_regex_literal_prefix(r) for r in regexes])
+
     def query(self, query=''):
         """Query the storage for existing files
 
@@ -235,7 +442,8 @@ class BaseStorageBroker(object, metaclass=abc.ABCMeta):
         :return: RemotePipelineFileCollection of files matching the prefix
         """
         try:
-            return self._run_query(query)
+            with self._transfer_stats.measure('query'):
+                return self._run_query(query)
         except Exception as e:
             raise StorageBrokerError("error querying storage: {e}".format(query=query, e=format_exception(e)))
 
@@ -251,6 +459,11 @@ class LocalFileStorageBroker(BaseStorageBroker):
     def __repr__(self):
         return "{self.__class__.__name__}(prefix='{self.prefix}')".format(self=self)
 
+    def _check_health(self):
+        # the prefix is created on demand when uploading, so it is only an error if it exists as something else
+        if os.path.exists(self.prefix) and not os.path.isdir(self.prefix):
+            raise NotADirectoryError("prefix '{self.prefix}' is not a directory".format(self=self))
+
     def _delete_file(self, pipeline_file, dest_path_attr):
         abs_path = self._get_absolute_dest_path(pipeline_file=pipeline_file, dest_path_attr=dest_path_attr)
         rm_f(abs_path)
@@ -264,15 +477,26 @@ class LocalFileStorageBroker(BaseStorageBroker):
     def _pre_run_hook(self):
         return
 
+    def _get_regexes_query(self, regexes):
+        query = super()._get_regexes_query(regexes)
+        # local dest_paths are always relative, so an absolute prefix can't match anything and isn't a valid query
+        return '' if os.path.isabs(query) else query
+
     def _run_query(self, query):
         validate_relative_path(query)
 
         full_query = os.path.join(self.prefix, query)
 
+        def _could_contain_matches(path):
+            return path.startswith(full_query) or full_query.startswith(os.path.join(path, ''))
+
         def _find_prefix(path):
             parent_path = os.path.dirname(path)
             for root, dirs, files in os.walk(parent_path):
-                dirs = sorted(dirs, key=filesystem_sort_key)
+                # prune subdirectories which cannot contain any matching paths, so that a narrow query only walks the
+                # relevant part of the tree
+                dirs[:] = sorted((d for d in dirs if _could_contain_matches(os.path.join(root, d))),
+                                 key=filesystem_sort_key)
                 files = sorted(files, key=filesystem_sort_key)
 
                 for name in files:
@@ -331,12 +555,17 @@ class S3StorageBroker(BaseStorageBroker):
     def __repr__(self):
         return "{self.__class__.__name__}(bucket='{self.bucket}', prefix='{self.prefix}')".format(self=self)
 
+    def _check_health(self):
+        self._validate_bucket()
+
     @retry_decorator(**retry_kwargs)
+    @count_attempts
     def _delete_file(self, pipeline_file, dest_path_attr):
         abs_path = self._get_absolute_dest_path(pipeline_file=pipeline_file, dest_path_attr=dest_path_attr)
         self.s3_client.delete_object(Bucket=self.bucket, Key=abs_path)
 
     @retry_decorator(**retry_kwargs)
+    @count_attempts
     def _get_is_overwrite(self, pipeline_file, abs_path):
         response = self.s3_client.list_objects_v2(Bucket=self.bucket, Prefix=abs_path)
         return bool([k for k in response.get('Contents', []) if k['Key'] == abs_path])
@@ -362,6 +591,7 @@ class S3StorageBroker(BaseStorageBroker):
         ])
 
     @retry_decorator(**retry_kwargs)
+    @count_attempts
     def _run_query(self, query):
         full_query = os.path.join(self.prefix, query)
         raw_result = self.s3_client.list_objects_v2(Bucket=self.bucket, Prefix=full_query)
@@ -369,6 +599,7 @@ class S3StorageBroker(BaseStorageBroker):
         return collection
 
     @retry_decorator(**retry_kwargs)
+    @count_attempts
     def _download_file(self, remote_pipeline_file):
         abs_path = self._get_absolute_dest_path(pipeline_file=remote_pipeline_file, dest_path_attr='dest_path')
 
@@ -376,6 +607,7 @@ class S3StorageBroker(BaseStorageBroker):
             self.s3_client.download_fileobj(Bucket=self.bucket, Key=abs_path, Fileobj=f)
 
     @retry_decorator(**retry_kwargs)
+    @count_attempts
     def _upload_file(self, pipeline_file, dest_path_attr):
         abs_path = self._get_absolute_dest_path(pipeline_file=pipeline_file, dest_path_attr=dest_path_attr)
 
@@ -384,6 +616,7 @@ class S3StorageBroker(BaseStorageBroker):
                                           ExtraArgs={'ContentType': pipeline_file.mime_type})
 
     @retry_decorator(**retry_kwargs)
+    @count_attempts
     def _validate_bucket(self):
         self.s3_client.head_bucket(Bucket=self.bucket)
 
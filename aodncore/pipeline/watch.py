@@ -19,17 +19,21 @@ import logging.config
 import os
 import re
 import stat
+import threading
 import warnings
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from uuid import uuid4
 
 from enum import Enum
 from transitions import Machine
 
 from .files import PipelineFile
-from .log import get_pipeline_logger
-from .storage import get_storage_broker
-from ..util import (ensure_regex_list, format_exception, lazyproperty, mkdir_p, rm_f, rm_r, validate_dir_writable,
-                    validate_file_writable, validate_membership)
+from .log import flush_logger, get_pipeline_logger
+from .steps.notify import flush_email_delivery_queue, precompile_notification_templates
+from .storage import DEFAULT_HEALTH_CHECK_TTL, get_storage_broker
+from ..util import (ensure_regex_list, format_exception, lazyproperty, matches_regexes, mkdir_p, rm_f, rm_r,
+                    validate_dir_writable, validate_file_writable, validate_membership)
 
 # OS X test compatibility, due to absence of pyinotify (which is specific to the Linux kernel)
 try:
@@ -47,6 +51,7 @@ except ImportError:
                 raise NotImplementedError('pyinotify package is not installed')
 
 from celery import Task
+from celery.signals import worker_process_shutdown, worker_shutdown
 from celery.utils.log import get_task_logger
 
 from .exceptions import InvalidHandlerError
@@ -58,15 +63,32 @@ warnings.filterwarnings("ignore", message="numpy.dtype size changed")
 warnings.filterwarnings("ignore", message="numpy.ufunc size changed")
 
 __all__ = [
+    'configure_worker_logging',
+    'flush_email_delivery_queue_on_shutdown',
+    'get_file_identity',
     'get_task_name',
     'CeleryConfig',
     'CeleryContext',
     'IncomingFileEventHandler',
     'IncomingFileStateManager',
+    'TaskRoute',
+    'TaskRouter',
     'WatchServiceContext',
     'WatchServiceManager'
 ]
 
+DEFAULT_STARTUP_SCAN_WORKERS = 8
+
+DEFAULT_LANE_NAME = 'default'
+DEFAULT_STARVATION_LIMIT = 50
+DEFAULT_TASK_PRIORITY = 5
+MAX_TASK_PRIORITY = 9
+
+TaskRoute = namedtuple('TaskRoute', ('lane', 'priority', 'size', 'reason'))
+
+_applied_worker_logging_config = None
+_applied_worker_logging_config_lock = threading.Lock()
+
 
 def get_task_name(namespace, function_name):
     """Convenience function for :py:meth:`CeleryManager.get_task_name`
@@ -79,7 +101,73 @@ def get_task_name(namespace, function_name):
     return task_name
 
 
+def get_file_identity(pathname):
+    """Get a value which uniquely identifies a specific version of a file, such that the same file being seen by more
+    than one source (e.g. the startup scan *and* an inotify event) can be detected, while a new file subsequently
+    written to the same path is still considered distinct
+
+    :param pathname: path to the file
+    :return: tuple containing the path, device, inode and modification time of the file, or None if it cannot be read
+    """
+    try:
+        stats = os.stat(pathname)
+    except OSError:
+        return None
+    return pathname, stats.st_dev, stats.st_ino, stats.st_mtime_ns
+
+
+def configure_worker_logging(config, task_name):
+    """Apply the worker logging config for the given task, unless it is already the active logging config in this
+    process, avoiding the overhead of rebuilding and reapplying an identical config (which closes and reopens all of
+    the log file handlers) for every task
+
+    :param config: :py:class:`LazyConfigManager` instance
+    :param task_name: name of the task to configure logging for
+    :return: True if the logging config was applied, or False if it was already active
+    """
+    global _applied_worker_logging_config
+
+    worker_logging_config = config.get_worker_logging_config(task_name)
+    with _applied_worker_logging_config_lock:
+        if worker_logging_config is _applied_worker_logging_config:
+            return False
+        logging.config.dictConfig(worker_logging_config)
+        _applied_worker_logging_config = worker_logging_config
+    return True
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def flush_email_delivery_queue_on_shutdown(**kwargs):
+    """Deliver any queued notification emails before a worker process exits
+
+    Pool worker processes exit via :py:func:`os._exit` when they are recycled (e.g. after `worker_max_tasks_per_child`
+    tasks), which does not run :py:mod:`atexit` handlers, so the email delivery queue is flushed from the Celery
+    'worker_process_shutdown' signal instead. The 'worker_shutdown' signal covers tasks executed in the main worker
+    process (e.g. with the 'solo' pool).
+
+    Since the process is about to exit, failed messages are retried immediately rather than after the usual retry
+    delay, which would otherwise leave them scheduled beyond the flush timeout. Any messages still undelivered when the
+    flush times out are logged as errors by the queue.
+
+    :param kwargs: signal arguments
+    :return: None
+    """
+    flush_email_delivery_queue(retry_now=True)
+
+
 class CeleryConfig(object):
+    """Celery application configuration
+
+    Note: setting `queue_max_priority` declares the queues with the RabbitMQ 'x-max-priority' argument. RabbitMQ does
+    not allow the arguments of an existing queue to be changed, so redeclaring a queue which was created *without* this
+    argument fails with a PRECONDITION_FAILED channel error. When enabling task routing on an existing deployment, the
+    affected queues must first be drained and deleted (e.g. `rabbitmqctl delete_queue <queue>`), or the pipelines
+    renamed, so that they are recreated with the priority argument.
+
+    :param routes: task routes, as defined by :py:attr:`LazyConfigManager.celery_routes`
+    :param queue_max_priority: maximum task priority supported by the queues, or None for non-priority queues
+    """
     # TODO: remove this hardcoding and get values from pipeline_config
     broker_url = 'amqp://'
     accept_content = ['json']
@@ -89,8 +177,108 @@ class CeleryConfig(object):
 
     task_routes = {}
 
-    def __init__(self, routes=None):
+    def __init__(self, routes=None, queue_max_priority=None):
         self.task_routes = routes or {}
+        if queue_max_priority is not None:
+            self.task_queue_max_priority = queue_max_priority
+
+
+class TaskRouter(object):
+    """Assign incoming files to priority lanes based on their name and size, so that a large (or otherwise low value)
+    file does not hold up smaller, time-sensitive files queued behind it
+
+    Lanes are evaluated in the order they are configured, and the first lane where the file name matches one of the
+    lane regexes (if any) *and* the file size is within the lane size limits (if any) is used. Files not matching any
+    lane are assigned the default priority.
+
+    To keep lower priority lanes progressing under a sustained stream of higher priority tasks, once
+    `starvation_limit` higher priority tasks have been sent to a queue since the last task of a given lane, the next
+    task in that lane is promoted to the highest configured priority. Note that this only affects *new arrivals*, as
+    the priority of a message cannot be changed once it has been published, so a task already waiting in the queue is
+    not promoted, and may still wait behind a steady stream of higher priority tasks if no further files arrive in its
+    lane.
+
+    Where queued tasks in a lane must be guaranteed to progress, the lane may be configured with `dedicated_queue`, in
+    which case its tasks are sent to a separate queue named "<queue>.<lane>" instead of competing for priority in the
+    main queue. Workers must then consume from both queues (e.g. `celery worker -Q <queue>,<queue>.<lane>`), and since
+    the broker delivers from each consumed queue in turn, the lane receives a share of the workers regardless of the
+    load in the main queue.
+
+    :param routing_config: routing configuration, as defined by the 'routing' key in the 'watch' section of the
+        pipeline config
+    """
+
+    def __init__(self, routing_config):
+        self.default_priority = routing_config.get('default_priority', DEFAULT_TASK_PRIORITY)
+        self.starvation_limit = routing_config.get('starvation_limit', DEFAULT_STARVATION_LIMIT)
+        self.lanes = [dict(lane, regexes=ensure_regex_list(lane.get('regexes', [])))
+                      for lane in routing_config.get('lanes', [])]
+
+        self._lane_priorities = OrderedDict((lane['name'], lane['priority']) for lane in self.lanes)
+        self._dedicated_lanes = {lane['name'] for lane in self.lanes if lane.get('dedicated_queue', False)}
+        self._lane_priorities.setdefault(DEFAULT_LANE_NAME, self.default_priority)
+        self.max_priority = max(self._lane_priorities.values())
+
+        self._outpaced_counts = {}
+        self._outpaced_counts_lock = threading.Lock()
+
+    def _match_lane(self, pathname, size):
+        basename = os.path.basename(pathname)
+        for lane in self.lanes:
+            if lane['regexes'] and not matches_regexes(basename, lane['regexes']):
+                continue
+            if size < lane.get('min_size', 0):
+                continue
+            if 'max_size' in lane and size > lane['max_size']:
+                continue
+            return lane['name'], lane['priority']
+        return DEFAULT_LANE_NAME, self.default_priority
+
+    def get_lane_queue(self, queue, lane_name):
+        """Get the name of the queue to which tasks in the given lane are sent
+
+        :param queue: name of the queue for the pipeline
+        :param lane_name: name of the lane
+        :return: name of the dedicated lane queue if the lane is configured with one, otherwise the pipeline queue
+        """
+        if lane_name in self._dedicated_lanes:
+            return "{queue}.{lane_name}".format(queue=queue, lane_name=lane_name)
+        return queue
+
+    def route(self, queue, pathname):
+        """Determine the lane and priority for the given file
+
+        :param queue: name of the queue to which the task will be sent
+        :param pathname: the fully qualified path to the incoming file
+        :return: :py:class:`TaskRoute` instance
+        """
+        try:
+            size = os.path.getsize(pathname)
+        except OSError:
+            size = 0
+
+        lane_name, lane_priority = self._match_lane(pathname, size)
+
+        with self._outpaced_counts_lock:
+            queue_counts = self._outpaced_counts.setdefault(self.get_lane_queue(queue, lane_name), {})
+            outpaced = queue_counts.get(lane_name, 0)
+
+            if lane_priority < self.max_priority and outpaced >= self.starvation_limit:
+                priority = self.max_priority
+                reason = "starvation guard ({outpaced} higher priority tasks sent since last '{lane_name}' " \
+                         "task)".format(outpaced=outpaced, lane_name=lane_name)
+            else:
+                priority = lane_priority
+                reason = 'default' if lane_name == DEFAULT_LANE_NAME else 'lane match'
+
+            queue_counts[lane_name] = 0
+
+            # only lanes which have previously had a task sent to this queue are tracked
+            for other_lane_name in queue_counts:
+                if other_lane_name != lane_name and self._lane_priorities[other_lane_name] < priority:
+                    queue_counts[other_lane_name] += 1
+
+        return TaskRoute(lane_name, priority, size, reason)
 
 
 def delete_same_name_from_error_store_callback(handler, file_state_manager):
@@ -184,7 +372,7 @@ def build_task(config, pipeline_name, handler_class, success_exit_policies, erro
 
         def run(self, incoming_file):
             try:
-                logging.config.dictConfig(config.get_worker_logging_config(task_name))
+                configure_worker_logging(config, task_name)
                 logging_extra = {
                     'celery_task_id': self.request.id,
                     'celery_task_name': task_name
@@ -227,6 +415,9 @@ def build_task(config, pipeline_name, handler_class, success_exit_policies, erro
                 if self.logger:
                     self.logger.exception('unhandled exception in PipelineTask')
                 raise
+            finally:
+                if self.logger:
+                    flush_logger(self.logger)
 
     return PipelineTask()
 
@@ -252,8 +443,16 @@ class CeleryContext(object):
     def _configure_application(self):
         self._application.config_from_object(self._celeryconfig)
         self._register_tasks()
+        self._precompile_templates()
         self._application_configured = True
 
+    def _precompile_templates(self):
+        # compiled in the parent process, so that templates are shared by all forked worker processes
+        try:
+            precompile_notification_templates(self._config)
+        except Exception as e:
+            warnings.warn("failed to precompile notification templates: {e}".format(e=format_exception(e)))
+
     def _register_tasks(self):
         loaded_handlers, failed_handlers = self._config.discovered_handlers
 
@@ -325,6 +524,44 @@ class IncomingFileEventHandler(pyinotify.ProcessEvent):
         self._config = config
         self._logger = get_pipeline_logger(config.pipeline_config['watch']['logger_name'])
 
+        routing_config = config.pipeline_config['watch'].get('routing')
+        self._router = TaskRouter(routing_config) if routing_config is not None else None
+
+        self._seen_files = None
+        self._seen_files_lock = threading.Lock()
+
+    def start_deduplication(self):
+        """Start recording the identity of each queued file, so that a file seen more than once (e.g. by both the
+        startup scan and an inotify event) is only queued once
+
+        :return: None
+        """
+        with self._seen_files_lock:
+            self._seen_files = set()
+
+    def stop_deduplication(self):
+        """Stop recording queued files, and discard any previously recorded identities
+
+        :return: None
+        """
+        with self._seen_files_lock:
+            self._seen_files = None
+
+    def _is_duplicate(self, pathname):
+        with self._seen_files_lock:
+            if self._seen_files is None:
+                return False
+
+            identity = get_file_identity(pathname)
+            if identity is None:
+                # the file cannot be identified (e.g. it no longer exists), so it cannot be a known duplicate
+                return False
+            if identity in self._seen_files:
+                return True
+
+            self._seen_files.add(identity)
+            return False
+
     def process_default(self, event):
         # event_id is distinct from task_id, and exists in order to correlate log messages before *and* after a task
         # is queued for a given event
@@ -339,11 +576,15 @@ class IncomingFileEventHandler(pyinotify.ProcessEvent):
         :param directory: the watched directory
         :param pathname: the fully qualified path to the file which triggered the event
         :param event_id: UUID to identify this event in log files (will be generated if not present)
-        :return: None
+        :return: True if a task was queued, otherwise False
         """
         if should_ignore_event(pathname):
             self._logger.info("ignored event for '{pathname}'".format(pathname=pathname))
-            return
+            return False
+
+        if self._is_duplicate(pathname):
+            self._logger.info("ignored duplicate event for '{pathname}'".format(pathname=pathname))
+            return False
 
         queue = self._config.watch_directory_map[directory]
         task_name = get_task_name(self._config.pipeline_config['watch']['task_namespace'], queue)
@@ -359,7 +600,23 @@ class IncomingFileEventHandler(pyinotify.ProcessEvent):
             "task data: event_id='{event_id}' queue='{queue}' task_name='{task_name}' pathname='{pathname}'".format(
                 **task_data))
 
-        result = self._config.celery_application.send_task(task_name, args=[pathname])
+        send_task_kwargs = {}
+        if self._router is not None:
+            route = self._router.route(queue, pathname)
+            task_data.update(route._asdict())
+            send_task_kwargs['priority'] = route.priority
+
+            lane_queue = self._router.get_lane_queue(queue, route.lane)
+            if lane_queue != queue:
+                # routing key must also be overridden, since the configured task route would otherwise still apply
+                send_task_kwargs.update(queue=lane_queue, routing_key=lane_queue)
+                task_data['queue'] = lane_queue
+
+            self._logger.info(
+                "task route: event_id='{event_id}' queue='{queue}' lane='{lane}' priority={priority} size={size} "
+                "reason='{reason}'".format(**task_data))
+
+        result = self._config.celery_application.send_task(task_name, args=[pathname], **send_task_kwargs)
         task_data['task_id'] = result.id
 
         # pathname is deliberately duplicated here to enable cross-referencing from pipeline specific logs in order to
@@ -368,6 +625,7 @@ class IncomingFileEventHandler(pyinotify.ProcessEvent):
             "task sent: task_id='{task_id}' task_name='{task_name}' event_id='{event_id}' pathname='{pathname}'".format(
                 **task_data))
         self._logger.debug("full task_data: {task_data}".format(task_data=task_data))
+        return True
 
 
 class IncomingFileStateManager(object):
@@ -471,8 +729,9 @@ class IncomingFileStateManager(object):
             mkdir_p(self.processing_dir)
             validate_dir_writable(self.processing_dir)
 
-            # TODO: better validation of broker usability?
-            _ = self.error_broker.query()
+            health_check_ttl = self.config.pipeline_config['global'].get('broker_health_check_ttl',
+                                                                         DEFAULT_HEALTH_CHECK_TTL)
+            self.error_broker.check_health(ttl=health_check_ttl)
         except Exception:  # pragma: no cover
             self.logger.exception('exception occurred initialising IncomingFileStateManager')
             raise
@@ -541,15 +800,23 @@ class WatchServiceManager(object):
 
         self._logger = get_pipeline_logger(config.pipeline_config['watch']['logger_name'])
 
+        self._startup_scan_thread = None
+        self._stop_event = threading.Event()
+
     @property
     def watches(self):
         return [w.path for w in self._watch_manager.watches.values()]
 
+    @property
+    def startup_scan_complete(self):
+        return self._startup_scan_thread is not None and not self._startup_scan_thread.is_alive()
+
     # noinspection PyUnusedLocal
     def handle_signal(self, signo=None, stackframe=None):
         self.stop("received signal '{signo}'".format(signo=signo))
 
     def stop(self, reason='unknown'):
+        self._stop_event.set()
         self._logger.info("stopping Notifier event loop. Reason: {reason}".format(reason=reason))
         try:
             self.notifier.stop()
@@ -557,6 +824,16 @@ class WatchServiceManager(object):
             # already stopped
             pass
 
+    def wait_for_startup_scan(self, timeout=None):
+        """Block until the background startup scan has finished queuing existing files
+
+        :param timeout: maximum number of seconds to wait (wait indefinitely if None)
+        :return: True if the startup scan has completed, otherwise False
+        """
+        if self._startup_scan_thread is not None:
+            self._startup_scan_thread.join(timeout)
+        return self.startup_scan_complete
+
     def __enter__(self):
         self._queue_and_watch_directories()
         return self
@@ -565,19 +842,72 @@ class WatchServiceManager(object):
         self.stop('context manager exiting')
 
     def _queue_and_watch_directories(self):
-        """Configure the given WatchManager with the watches defined in the configuration, queuing any existing files
+        """Configure the given WatchManager with the watches defined in the configuration, and then queue any existing
+        files in a background thread
+
+        Watches are added *before* existing files are listed, so that no files arriving during the scan are missed, and
+        the Notifier event loop can start immediately rather than waiting for potentially large backlogs to be queued.
+        Files seen by both the scan and an inotify event are only queued once.
 
         :return: None
         """
-        for directory, queue in self._config.watch_directory_map.items():
-            for existing_file in list_regular_files(directory):
-                self._logger.info(
-                    "queuing existing file: existing_file='{existing_file}'".format(
-                        existing_file=existing_file))
-                self._event_handler.queue_task(directory, existing_file)
+        self._event_handler.start_deduplication()
 
+        for directory in self._config.watch_directory_map:
             self._logger.info("adding watch for '{directory}'".format(directory=directory))
             self._watch_manager.add_watch(directory, self.EVENT_MASK)
 
+        self._startup_scan_thread = threading.Thread(target=self._queue_existing_files, name='startup_scan',
+                                                     daemon=True)
+        self._startup_scan_thread.start()
+
+    def _queue_existing_files(self):
+        """Queue existing files from all watched directories, scanning directories concurrently
+
+        :return: None
+        """
+        directories = list(self._config.watch_directory_map)
+        max_workers = self._config.pipeline_config['watch'].get('startup_scan_workers',
+                                                                DEFAULT_STARTUP_SCAN_WORKERS)
+        total_queued = 0
+
+        self._logger.info("starting startup scan of {count} directories with {workers} workers".format(
+            count=len(directories), workers=max_workers))
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {executor.submit(self._queue_existing_files_for_directory, d): d for d in directories}
+                for completed, future in enumerate(as_completed(futures), start=1):
+                    directory = futures[future]
+                    try:
+                        queued = future.result()
+                    except Exception as e:
+                        self._logger.error("startup scan failed for '{directory}': {e}".format(
+                            directory=directory, e=format_exception(e)))
+                        continue
+
+                    total_queued += queued
+                    self._logger.info(
+                        "startup scan progress: {completed}/{total} directories scanned, "
+                        "{queued} existing files queued from '{directory}'".format(
+                            completed=completed, total=len(directories), queued=queued, directory=directory))
+        finally:
+            self._event_handler.stop_deduplication()
+            self._logger.info("startup scan complete: {total_queued} existing files queued".format(
+                total_queued=total_queued))
+
+    def _queue_existing_files_for_directory(self, directory):
+        queued = 0
+        for existing_file in list_regular_files(directory):
+            if self._stop_event.is_set():
+                self._logger.info("startup scan of '{directory}' interrupted".format(directory=directory))
+                break
+
+            self._logger.info(
+                "queuing existing file: existing_file='{existing_file}'".format(
+                    existing_file=existing_file))
+            if self._event_handler.queue_task(directory, existing_file):
+                queued += 1
+        return queued
+
 
 validate_exitpolicy = validate_membership(ExitPolicy)
@@ -7,9 +7,12 @@ import logging
 import os
 import re
 import sys
+import threading
 import types
+import weakref
 from collections import Iterable, OrderedDict, Mapping
 from enum import Enum, EnumMeta
+from functools import lru_cache
 from io import StringIO
 import uuid
 import random
@@ -18,6 +21,12 @@ import string
 import jinja2
 import pkg_resources
 
+try:
+    from re import _constants as sre_constants, _parser as sre_parse
+except ImportError:
+    import sre_constants
+    import sre_parse
+
 Pattern = type(re.compile(''))
 
 __all__ = [
@@ -28,6 +37,9 @@ __all__ = [
     'format_exception',
     'generate_id',
     'get_pattern_subgroups_from_string',
+    'get_public_attribute_names',
+    'get_regex_literal_prefix',
+    'get_regex_matcher',
     'get_regex_subgroups_from_string',
     'is_nonstring_iterable',
     'is_function',
@@ -55,10 +67,19 @@ __all__ = [
     'CaptureStdIO',
     'LoggingContext',
     'Pattern',
+    'RegexMatcher',
     'TemplateRenderer',
     'WriteOnceOrderedDict'
 ]
 
+DEFAULT_REGEX_MATCHER_CACHE_SIZE = 4096
+
+# default flags of a pattern compiled from a str without any flags, i.e. patterns which can be safely combined
+DEFAULT_REGEX_FLAGS = re.compile('').flags
+
+# backreferences and conditional groups, which would refer to the wrong group if the pattern were combined with others
+GROUP_REFERENCE_REGEX = re.compile(r'\\(?:[1-9]|g<)|\(\?P=|\(\?\(')
+
 
 def discover_entry_points(entry_point_group, working_set=pkg_resources.working_set):
     """Discover entry points registered under the given entry point group name in the given
@@ -153,6 +174,31 @@ def generate_id():
     return random.choice(string.ascii_lowercase) + str(uuid.uuid4().hex)
 
 
+def get_regex_literal_prefix(regex):
+    """Get the literal string which any string matched by the given regex (using :py:func:`re.match`) must start with
+
+    This allows the set of candidate strings to be narrowed (e.g. by a prefix query against a storage backend) before
+    applying the regex itself.
+
+    :param regex: regex (string or pre-compiled)
+    :return: literal prefix string, which will be empty if the regex does not start with a literal
+    """
+    pattern = ensure_regex(regex)
+    if pattern.flags & re.IGNORECASE:
+        return ''
+
+    prefix = []
+    for opcode, value in sre_parse.parse(pattern.pattern, pattern.flags):
+        if opcode == sre_constants.AT and value in (sre_constants.AT_BEGINNING, sre_constants.AT_BEGINNING_STRING):
+            if prefix:
+                break
+            continue
+        if opcode != sre_constants.LITERAL:
+            break
+        prefix.append(chr(value))
+    return ''.join(prefix)
+
+
 def get_regex_subgroups_from_string(string, regex):
     """Function to retrieve parts of a string given a compiled pattern (re.compile(pattern))
     the pattern needs to match the beginning of the string
@@ -199,6 +245,31 @@ def is_valid_email_address(address):
     return regex.match(address)
 
 
+_public_attribute_names = weakref.WeakKeyDictionary()
+
+
+def get_public_attribute_names(cls):
+    """Get the names of the public properties and slots of a class, in a consistent order
+
+    The names are determined once per class and cached, since inspecting the class with :py:func:`dir` is relatively
+    expensive compared to reading the attributes themselves.
+
+    :param cls: class to inspect
+    :return: :py:class:`tuple` of attribute names
+    """
+    try:
+        return _public_attribute_names[cls]
+    except KeyError:
+        pass
+
+    slot_names = set(getattr(cls, '__slots__', ()))
+    property_names = {p for p in dir(cls) if isinstance(getattr(cls, p), property)}
+    names = tuple(sorted(a for a in slot_names.union(property_names) if not a.startswith('_')))
+
+    _public_attribute_names[cls] = names
+    return names
+
+
 def iter_public_attributes(instance, ignored_attributes=None):
     """Get an iterator over an instance's public attributes, *including* properties
 
@@ -206,20 +277,16 @@ def iter_public_attributes(instance, ignored_attributes=None):
     :param ignored_attributes: set of attribute names to exclude
     :return: iterator over the instances public attributes
     """
-    ignored_attributes = {} if ignored_attributes is None else set(ignored_attributes)
+    ignored_attributes = set() if ignored_attributes is None else set(ignored_attributes)
 
-    def includeattr(attr):
-        if attr.startswith('_') or attr in ignored_attributes:
-            return False
-        return True
-
-    attribute_names = set(getattr(instance, '__slots__', getattr(instance, '__dict__', {})))
-    property_names = {p for p in dir(instance.__class__) if isinstance(getattr(instance.__class__, p), property)}
-    all_names = attribute_names.union(property_names)
+    all_names = get_public_attribute_names(instance.__class__)
+    if not hasattr(instance, '__slots__'):
+        instance_names = {a for a in getattr(instance, '__dict__', {}) if not a.startswith('_')}
+        all_names += tuple(sorted(instance_names.difference(all_names)))
 
-    public_attrs = {a: getattr(instance, a) for a in all_names if includeattr(a)}
+    public_attrs = [(a, getattr(instance, a)) for a in all_names if a not in ignored_attributes]
 
-    return iter(public_attrs.items())
+    return iter(public_attrs)
 
 
 def matches_regexes(input_string, include_regexes, exclude_regexes=None):
@@ -230,15 +297,107 @@ def matches_regexes(input_string, include_regexes, exclude_regexes=None):
     :param exclude_regexes: list of exclusions to *subtract* from the list produced by inclusions
     :return: True if the of the string matches one of the 'include_regexes' but *not* one of the 'exclude_regexes'
     """
-    includes = ensure_regex_list(include_regexes)
-    excludes = ensure_regex_list(exclude_regexes)
+    return get_regex_matcher(include_regexes, exclude_regexes).matches(input_string)
 
-    matches_includes = any(re.match(r, input_string) for r in includes)
-    matches_excludes = any(re.match(r, input_string) for r in excludes)
 
-    if matches_includes and not matches_excludes:
-        return True
-    return False
+class RegexMatcher(object):
+    """Matcher to filter strings (e.g. file paths) according to regular expression inclusions minus exclusions, with
+    the same semantics as :py:func:`matches_regexes`
+
+    Where possible, the patterns in each list are combined into a single alternation, so that each string is compared
+    with one match per list rather than one match per pattern. Patterns which cannot be safely combined (i.e. those
+    with flags or group references) are matched individually. The results for recently matched strings are memoised.
+
+    :param include_regexes: regex(es) for which a string must match one or more to be included
+    :param exclude_regexes: regex(es) which will exclude an already included string
+    :param cache_size: maximum number of results to memoise
+    """
+
+    def __init__(self, include_regexes, exclude_regexes=None, cache_size=DEFAULT_REGEX_MATCHER_CACHE_SIZE):
+        self.include_regexes = ensure_regex_list(include_regexes)
+        self.exclude_regexes = ensure_regex_list(exclude_regexes)
+
+        self._includes = self._combine(self.include_regexes)
+        self._excludes = self._combine(self.exclude_regexes)
+        self._cached_matches = lru_cache(maxsize=cache_size)(self._matches)
+
+    def __call__(self, input_string):
+        return self.matches(input_string)
+
+    def __repr__(self):  # pragma: no cover
+        return "{name}(include_regexes={include}, exclude_regexes={exclude})".format(
+            name=self.__class__.__name__, include=[p.pattern for p in self.include_regexes],
+            exclude=[p.pattern for p in self.exclude_regexes])
+
+    @staticmethod
+    def _combine(patterns):
+        """Combine the given patterns into as few patterns as possible
+
+        :param patterns: list of :py:class:`Pattern` instances
+        :return: list of :py:class:`Pattern` instances
+        """
+        combinable = [p for p in patterns if isinstance(p.pattern, str) and p.flags == DEFAULT_REGEX_FLAGS and
+                      not GROUP_REFERENCE_REGEX.search(p.pattern)]
+        if len(combinable) < 2:
+            return patterns
+
+        try:
+            combined = re.compile('|'.join("(?:{p.pattern})".format(p=p) for p in combinable))
+        except re.error:
+            # e.g. the same group name is used in more than one pattern
+            return patterns
+        return [combined] + [p for p in patterns if p not in combinable]
+
+    def _matches(self, input_string):
+        if not any(p.match(input_string) for p in self._includes):
+            return False
+        return not any(p.match(input_string) for p in self._excludes)
+
+    def matches(self, input_string):
+        """Determine whether a string matches one of the include regexes but *not* one of the exclude regexes
+
+        :param input_string: string for comparison to the regular expressions
+        :return: True if the string is included
+        """
+        try:
+            return self._cached_matches(input_string)
+        except TypeError:
+            # unhashable input, which will be rejected by the pattern unless it is a str subclass
+            return self._matches(input_string)
+
+    def filter(self, strings):
+        """Get the strings which are included by the matcher
+
+        :param strings: iterable of strings
+        :return: :py:class:`list` of strings which are included
+        """
+        return [s for s in strings if self.matches(s)]
+
+
+def _get_regex_key(o):
+    if o is None or isinstance(o, (str, Pattern)):
+        return o
+    return tuple(o)
+
+
+@lru_cache(maxsize=256)
+def _get_cached_regex_matcher(include_key, exclude_key):
+    return RegexMatcher(include_key, exclude_key)
+
+
+def get_regex_matcher(include_regexes, exclude_regexes=None):
+    """Get a :py:class:`RegexMatcher` for the given regexes, reusing a previously created matcher for the same regexes
+    where possible, so that the patterns are only combined (and the results memoised) once
+
+    :param include_regexes: regex(es) for which a string must match one or more to be included
+    :param exclude_regexes: regex(es) which will exclude an already included string
+    :return: :py:class:`RegexMatcher` instance
+    """
+    try:
+        return _get_cached_regex_matcher(_get_regex_key(include_regexes), _get_regex_key(exclude_regexes))
+    except TypeError:
+        # unhashable or non-iterable parameters, which will be validated (and possibly rejected) by the matcher
+        return RegexMatcher(include_regexes, exclude_regexes)
 
 
 def merge_dicts(*args):
@@ -497,15 +656,43 @@ class WriteOnceOrderedDict(OrderedDict):
     update = __readonly__
 
 
+_template_environments = {}
+_template_environments_lock = threading.Lock()
+
+
+def _get_template_environment(package, package_path, bytecode_cache_dir):
+    key = (package, package_path, bytecode_cache_dir)
+    with _template_environments_lock:
+        env = _template_environments.get(key)
+        if env is None:
+            env = jinja2.Environment(loader=jinja2.PackageLoader(package, package_path),
+                                     bytecode_cache=jinja2.FileSystemBytecodeCache(bytecode_cache_dir))
+            _template_environments[key] = env
+        return env
+
+
 class TemplateRenderer(object):
     """Simple template renderer
+
+    The underlying :py:class:`jinja2.Environment` is shared by all instances in the process with the same parameters,
+    so that each template is only parsed and compiled once (or loaded from the bytecode cache in `bytecode_cache_dir`,
+    which defaults to a per-user temporary directory) rather than each time a renderer is created.
     """
 
-    def __init__(self, package='aodncore.pipeline', package_path='templates'):
+    def __init__(self, package='aodncore.pipeline', package_path='templates', bytecode_cache_dir=None):
         super().__init__()
         self._package = package
-        self._loader = jinja2.PackageLoader(package, package_path)
-        self._env = jinja2.Environment(loader=self._loader)
+        self._env = _get_template_environment(package, package_path, bytecode_cache_dir)
+        self._loader = self._env.loader
+
+    def precompile(self, *names):
+        """Load and compile the given templates into the shared environment ahead of rendering
+
+        :param names: names of the templates to find in the :py:class:`jinja2.Environment`
+        :return: None
+        """
+        for name in names:
+            self._env.get_template(name)
 
     def render(self, name, values):
         """Render a template with the given values and return as a :py:class:`str`
@@ -2,7 +2,13 @@
 """
 
 import os
+import resource
+import signal
 import subprocess
+import sys
+import threading
+import time
+from collections import deque
 
 from .misc import format_exception
 from ..common import SystemCommandFailedError
@@ -11,12 +17,58 @@ __all__ = [
     'SystemProcess'
 ]
 
+DEFAULT_OUTPUT_TAIL_LINES = 100
+DEFAULT_TERMINATE_TIMEOUT = 10
+
+# ru_maxrss is reported in bytes on macOS, and kilobytes everywhere else
+MAXRSS_MULTIPLIER = 1 if sys.platform == 'darwin' else 1024
+
+
+def _get_children_rusage():
+    return resource.getrusage(resource.RUSAGE_CHILDREN)
+
+
+def _get_rusage_delta(start, end):
+    return {
+        'user_time': end.ru_utime - start.ru_utime,
+        'system_time': end.ru_stime - start.ru_stime,
+        'max_rss': end.ru_maxrss * MAXRSS_MULTIPLIER,
+        'read_blocks': end.ru_inblock - start.ru_inblock,
+        'write_blocks': end.ru_oublock - start.ru_oublock
+    }
+
 
 class SystemProcess(object):
     """Class to encapsulate a system command, including execution, output handling and returncode handling
+
+    If an output_callback is given, the combined stdout/stderr output is passed to the callback one line at a time (with
+    the trailing newline removed) as it is produced, instead of being buffered in memory until the process exits. In
+    this mode, :py:attr:`stdout_text` only retains the last `output_tail_lines` lines, for inclusion in error messages.
+
+    If a timeout (in seconds) is given, the process is started in a new process group, and the entire group (i.e.
+    including any children of a shell command) is sent SIGTERM when the timeout expires, followed by SIGKILL if it has
+    not exited within `terminate_timeout` seconds.
+
+    After execution, the resource usage of the process (including any children it waited for) is available in
+    :py:attr:`rusage`. The usage is measured as the difference in the accumulated usage of all children of the current
+    process, so it will also include any other child processes which were reaped concurrently, and 'max_rss' is the
+    largest peak RSS of any child reaped so far, rather than of this process alone.
+
+    :param command: command to execute, as a list or as a string if shell is True
+    :param stdin: stdin parameter passed to :py:class:`subprocess.Popen`
+    :param stdout: stdout parameter passed to :py:class:`subprocess.Popen`
+    :param stdin_text: text to write to the stdin of the process
+    :param env: dict containing the environment of the process, defaulting to a copy of the current environment
+    :param shell: execute the command via the shell
+    :param output_callback: callable to receive each line of output as it is produced
+    :param timeout: number of seconds to allow the process to run before it is terminated
+    :param terminate_timeout: number of seconds to wait after SIGTERM before sending SIGKILL
+    :param output_tail_lines: number of output lines to retain when an output_callback is used
     """
 
-    def __init__(self, command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stdin_text=None, env=None, shell=False):
+    def __init__(self, command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stdin_text=None, env=None, shell=False,
+                 output_callback=None, timeout=None, terminate_timeout=DEFAULT_TERMINATE_TIMEOUT,
+                 output_tail_lines=DEFAULT_OUTPUT_TAIL_LINES):
         super().__init__()
 
         self.command = command
@@ -34,7 +86,19 @@ class SystemProcess(object):
             _env = env
         self.env = _env
 
+        self.output_callback = output_callback
+        self.timeout = timeout
+        self.terminate_timeout = terminate_timeout
+        self.output_tail_lines = output_tail_lines
+
+        self.returncode = None
+        self.rusage = None
+        self.duration = None
+        self.timed_out = False
+
         self._executed = False
+        self._output_lines = []
+        self._callback_error = None
 
         self.validate_command()
 
@@ -50,6 +114,86 @@ class SystemProcess(object):
                 if not self.command:
                     raise SystemCommandFailedError("command param must not be empty if bash shell command")
 
+    def _read_output(self, stream):
+        try:
+            for line in stream:
+                self._output_lines.append(line)
+                if self._callback_error is None:
+                    try:
+                        self.output_callback(line.rstrip('\n'))
+                    except Exception as e:
+                        # keep draining the pipe so that the process is not blocked on a full buffer
+                        self._callback_error = e
+        finally:
+            stream.close()
+
+    def _write_input(self, stream):
+        try:
+            if self.stdin_text:
+                stream.write(self.stdin_text)
+        except BrokenPipeError:
+            pass
+        finally:
+            try:
+                stream.close()
+            except BrokenPipeError:
+                pass
+
+    def _terminate(self, proc):
+        """Terminate the process group of the given process, escalating to SIGKILL if it does not exit promptly
+
+        :param proc: :py:class:`subprocess.Popen` instance, which is also the leader of its process group
+        :return: None
+        """
+        try:
+            os.killpg(proc.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+        try:
+            proc.wait(timeout=self.terminate_timeout)
+        except subprocess.TimeoutExpired:
+            pass
+
+        # kill anything left in the group, including any children which outlived the process itself
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def _communicate(self, proc):
+        try:
+            self.stdout_text, _ = proc.communicate(input=self.stdin_text, timeout=self.timeout)
+        except subprocess.TimeoutExpired:
+            self.timed_out = True
+            self._terminate(proc)
+            self.stdout_text, _ = proc.communicate()
+        return proc.wait()
+
+    def _stream(self, proc):
+        self._output_lines = deque(maxlen=self.output_tail_lines)
+
+        threads = []
+        if proc.stdout is not None:
+            threads.append(threading.Thread(target=self._read_output, args=(proc.stdout,), daemon=True))
+        if proc.stdin is not None:
+            # written from a separate thread so that a process which never reads its input cannot defeat the timeout
+            threads.append(threading.Thread(target=self._write_input, args=(proc.stdin,), daemon=True))
+        for thread in threads:
+            thread.start()
+
+        try:
+            returncode = proc.wait(timeout=self.timeout)
+        except subprocess.TimeoutExpired:
+            self.timed_out = True
+            self._terminate(proc)
+            returncode = proc.wait()
+
+        for thread in threads:
+            thread.join()
+        self.stdout_text = ''.join(self._output_lines)
+        return returncode
+
     def execute(self):
         """Execute the system command
 
@@ -61,16 +205,34 @@ class SystemProcess(object):
 
         self._executed = True
 
+        start_time = time.monotonic()
+        start_rusage = _get_children_rusage()
         try:
             proc = subprocess.Popen(self.command, stdin=self.stdin, stdout=self.stdout, stderr=subprocess.STDOUT,
-                                    shell=self.shell, env=self.env, universal_newlines=True)
+                                    shell=self.shell, env=self.env, universal_newlines=True,
+                                    start_new_session=self.timeout is not None)
         except OSError as e:
             raise SystemCommandFailedError(
                 "system command failed to execute. {e}".format(e=format_exception(e)))
 
-        self.stdout_text, _ = proc.communicate(input=self.stdin_text)
-        returncode = proc.wait()
+        if self.output_callback is None:
+            returncode = self._communicate(proc)
+        else:
+            returncode = self._stream(proc)
+
+        self.returncode = returncode
+        self.rusage = _get_rusage_delta(start_rusage, _get_children_rusage())
+        self.duration = time.monotonic() - start_time
+
+        if self.timed_out:
+            raise SystemCommandFailedError(
+                "system command timed out after {timeout} seconds and was terminated, output is {stderr}".format(
+                    timeout=self.timeout, stderr=self.stdout_text))
 
         if returncode != 0:
             raise SystemCommandFailedError("system command exited with an error, output is {stderr}".format(
                 stderr=self.stdout_text))
+
+        if self._callback_error is not None:
+            raise SystemCommandFailedError("output callback failed. {e}".format(
+                e=format_exception(self._callback_error)))
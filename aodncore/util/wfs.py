@@ -1,21 +1,26 @@
 import json
+import threading
+import time
 import warnings
 from collections import OrderedDict
 
 from owslib.etree import etree
-from owslib.fes import PropertyIsEqualTo
+from owslib.fes import Or, PropertyIsEqualTo
 from owslib.wfs import WebFeatureService
 
 from ..util import IndexedSet, lazyproperty
 
 __all__ = [
+    'DEFAULT_WFS_QUERY_BATCH_SIZE',
     'DEFAULT_WFS_VERSION',
     'WfsBroker',
     'get_ogc_expression_for_file_url',
+    'get_ogc_expression_for_file_urls',
     'ogc_filter_to_string'
 ]
 
 DEFAULT_WFS_VERSION = '1.1.0'
+DEFAULT_WFS_QUERY_BATCH_SIZE = 50
 
 
 def ogc_filter_to_string(ogc_expression):
@@ -40,18 +45,49 @@ def get_ogc_expression_for_file_url(file_url, property_name='url'):
     return PropertyIsEqualTo(propertyname=property_name, literal=file_url)
 
 
+def get_ogc_expression_for_file_urls(file_urls, property_name='url'):
+    """Return OGCExpression to query for any of the given file_urls
+
+    :param file_urls: list of URL strings
+    :param property_name: URL property name to filter on
+    :return: OGCExpression which may be used to query the given URL values
+    """
+    expressions = [get_ogc_expression_for_file_url(u, property_name=property_name) for u in file_urls]
+    if len(expressions) == 1:
+        # an Or expression requires at least two operands
+        return expressions[0]
+    return Or(operations=expressions)
+
+
 class WfsBroker(object):
     """Simple higher level interface to a WebFeatureService instance, to provide common helper methods and standardise
     response handling around JSON
+
+    Layer schemas are cached for the lifetime of the broker, since they are required to determine the URL property
+    name for every query. If a `url_cache_ttl` (in seconds) is given, the complete set of URLs in a layer is retrieved
+    the first time a file existence is queried for the layer, and subsequent existence queries are answered from the
+    cached set until it expires.
+
+    :param wfs_url: URL of the WFS endpoint
+    :param version: WFS version
+    :param batch_size: maximum number of URLs included in the filter of a single GetFeature request
+    :param url_cache_ttl: number of seconds for which the URLs of a layer are cached, or None to disable the cache
     """
 
     # The *first* matching property name found by the WebFeatureService.get_schema method will be considered to be the
     # "url" property for a given layer. Accordingly, this should be ordered with highest priority name first.
     url_propertyname_candidates = ('file_url', 'url')
 
-    def __init__(self, wfs_url, version=DEFAULT_WFS_VERSION):
+    def __init__(self, wfs_url, version=DEFAULT_WFS_VERSION, batch_size=DEFAULT_WFS_QUERY_BATCH_SIZE,
+                 url_cache_ttl=None):
         self._wfs_url = wfs_url
         self._wfs_version = version
+        self.batch_size = batch_size
+        self.url_cache_ttl = url_cache_ttl
+
+        self._schemas = {}
+        self._url_cache = {}
+        self._cache_lock = threading.Lock()
 
     @lazyproperty
     def wfs(self):
@@ -91,13 +127,27 @@ class WfsBroker(object):
         finally:
             response.close()
 
+    def get_schema(self, layer):
+        """Get the schema for a given layer, making a DescribeFeatureType request only the first time a layer is queried
+
+        :param layer: layer name
+        :return: schema dict as returned by WebFeatureService.get_schema
+        """
+        with self._cache_lock:
+            schema = self._schemas.get(layer)
+        if schema is None:
+            schema = self.wfs.get_schema(layer)
+            with self._cache_lock:
+                self._schemas[layer] = schema
+        return schema
+
     def get_url_property_name(self, layer):
         """Get the URL property name for a given layer
 
         :param layer: schema dict as returned by WebFeatureService.get_schema
         :return: string containing the URL property name
         """
-        schema = self.wfs.get_schema(layer)
+        schema = self.get_schema(layer)
         for candidate in self.url_propertyname_candidates:
             if candidate in schema['properties']:
                 return candidate
@@ -133,6 +183,35 @@ class WfsBroker(object):
 
         return self.query_files(layer, ogc_expression=ogc_expression, url_property_name=url_property_name)
 
+    def _get_cached_files(self, layer):
+        """Get the set of URLs for a layer from the URL cache, refreshing the cache if it has expired
+
+        :param layer: layer name
+        :return: IndexedSet of the URLs in the layer
+        """
+        now = time.monotonic()
+        with self._cache_lock:
+            cached = self._url_cache.get(layer)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+
+        file_urls = self.query_files(layer)
+        with self._cache_lock:
+            self._url_cache[layer] = (now + self.url_cache_ttl, file_urls)
+        return file_urls
+
+    def invalidate_cache(self, layer=None):
+        """Discard the cached URLs for the given layer, or for all layers
+
+        :param layer: layer name, or None to discard the cached URLs for all layers
+        :return: None
+        """
+        with self._cache_lock:
+            if layer is None:
+                self._url_cache.clear()
+            else:
+                self._url_cache.pop(layer, None)
+
     def query_file_exists(self, layer, name):
         """Returns a bool representing whether a given 'file_url' is present in a layer
 
@@ -140,7 +219,28 @@ class WfsBroker(object):
         :param name: 'file_url' inserted into OGC filter, and supplied to GetFeature filter parameter
         :return: whether the given file is present in the layer
         """
+        return self.query_files_exist(layer, [name])[name]
+
+    def query_files_exist(self, layer, names):
+        """Returns a dict representing whether each of the given 'file_url' values are present in a layer
+
+        The URLs are queried in batches of at most :py:attr:`batch_size`, each with a single GetFeature request
+        filtered to match any of the URLs in the batch.
+
+        :param layer: layer name supplied to GetFeature typename parameter
+        :param names: list of 'file_url' values inserted into OGC filter, and supplied to GetFeature filter parameter
+        :return: :py:class:`OrderedDict` mapping each name to whether the file is present in the layer
+        """
+        names = list(OrderedDict.fromkeys(names))
+
+        if self.url_cache_ttl:
+            file_urls = self._get_cached_files(layer)
+            return OrderedDict((n, n in file_urls) for n in names)
+
         url_property_name = self.get_url_property_name(layer)
-        ogc_expression = get_ogc_expression_for_file_url(name, property_name=url_property_name)
-        file_urls = self.query_files(layer, ogc_expression=ogc_expression, url_property_name=url_property_name)
-        return name in file_urls
+        found = set()
+        for i in range(0, len(names), self.batch_size):
+            batch = names[i:i + self.batch_size]
+            ogc_expression = get_ogc_expression_for_file_urls(batch, property_name=url_property_name)
+            found.update(self.query_files(layer, ogc_expression=ogc_expression, url_property_name=url_property_name))
+        return OrderedDict((n, n in found) for n in names)
@@ -1,12 +1,13 @@
 import json
 import os
-from unittest.mock import patch
+from unittest.mock import call, patch, MagicMock
 from aodncore.common import SystemCommandFailedError
 from aodncore.pipeline import PipelineFile, PipelineFileCollection, PipelineFilePublishType
 from aodncore.pipeline.exceptions import InvalidHarvesterError, UnmappedFilesError, InvalidConfigError, \
     MissingConfigFileError, MissingConfigParameterError, UnexpectedCsvFilesError, GeonetworkConnectionError, \
-    InvalidSQLConnectionError
-from aodncore.pipeline.steps.harvest import (get_harvester_runner, HarvesterMap, TalendHarvesterRunner, TriggerEvent,
+    InvalidSQLConnectionError, InvalidSQLTransactionError
+from aodncore.pipeline.steps.harvest import (get_harvester_runner, get_trigger_config_matcher, AdaptiveSliceSizer,
+                                             HarvesterMap, TalendHarvesterRunner, TriggerConfigMatcher, TriggerEvent,
                                              validate_harvester_mapping, CsvHarvesterRunner)
 from aodncore.pipeline.steps.store import StoreRunner
 from aodncore.testlib import BaseTestCase, NullStorageBroker
@@ -557,6 +558,169 @@ class TestTalendHarvesterRunner(BaseTestCase):
         self.assertFalse(any(f.is_upload_undone for f in pending_slice))  # should *not* be undone, since never 'done'
 
 
+class TestTriggerConfigMatcher(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.trigger_config = {
+            'anmn_harvester': {'exec': 'echo anmn', 'events': [{'regex': [r'IMOS/ANMN/.*\.nc$']}]},
+            'anfog_harvester': {'exec': 'echo anfog',
+                                'events': [{'regex': [r'IMOS/ANFOG/.*\.nc$', r'IMOS/ANFOG/.*\.txt$']},
+                                           {'regex': [r'IMOS/ANFOG/.*\.nc$'], 'extra_params': '--extra'}]},
+            'all_harvester': {'exec': 'echo all', 'events': [{'regex': [r'(?i).*\.NC$']}]}
+        }
+
+    def test_match(self):
+        matcher = TriggerConfigMatcher(self.trigger_config)
+
+        self.assertListEqual([('anmn_harvester', None), ('anfog_harvester', None), ('anfog_harvester', '--extra'),
+                              ('all_harvester', None)], matcher.events)
+        self.assertSetEqual({0, 3}, matcher.match('IMOS/ANMN/file.nc'))
+        self.assertSetEqual({1, 2, 3}, matcher.match('IMOS/ANFOG/file.nc'))
+        self.assertSetEqual({1}, matcher.match('IMOS/ANFOG/file.txt'))
+        self.assertSetEqual(set(), matcher.match('IMOS/SOOP/file.txt'))
+        self.assertSetEqual(set(), matcher.match('IMOS'))
+
+    def test_get_trigger_config_matcher(self):
+        matcher = get_trigger_config_matcher(self.trigger_config)
+        self.assertIs(matcher, get_trigger_config_matcher(self.trigger_config))
+        self.assertIsNot(matcher, get_trigger_config_matcher(dict(self.trigger_config)))
+
+    def test_match_harvester_to_files(self):
+        self.config.__dict__['trigger_config'] = self.trigger_config
+
+        collection = PipelineFileCollection()
+        for dest_path in ('IMOS/ANMN/file.nc', 'IMOS/ANFOG/file.nc', 'IMOS/ANFOG/file.txt'):
+            local_path = os.path.join(self.temp_dir, dest_path.replace('/', '_'))
+            with open(local_path, 'w') as f:
+                f.write(dest_path)
+            collection.add(PipelineFile(local_path, dest_path=dest_path))
+
+        harvester_runner = TalendHarvesterRunner(NullStorageBroker("/"), None, TESTDATA_DIR, self.config,
+                                                 self.test_logger)
+        harvester_map = harvester_runner.match_harvester_to_files(collection)
+
+        self.assertListEqual(['anmn_harvester', 'anfog_harvester', 'all_harvester'], list(harvester_map.map))
+        anfog_events = harvester_map.map['anfog_harvester']
+        self.assertListEqual(['IMOS/ANFOG/file.nc', 'IMOS/ANFOG/file.txt'],
+                             [f.dest_path for f in anfog_events[0].matched_files])
+        self.assertListEqual(['IMOS/ANFOG/file.nc'], [f.dest_path for f in anfog_events[1].matched_files])
+        self.assertEqual('--extra', anfog_events[1].extra_params)
+        self.assertEqual(2, len(harvester_map.map['all_harvester'][0].matched_files))
+
+
+class TestAdaptiveSliceSizer(BaseTestCase):
+    def test_record(self):
+        slice_sizer = AdaptiveSliceSizer(initial_size=10, target_duration=5)
+        self.assertEqual(10, slice_sizer.slice_size)
+
+        slice_sizer.record(10, 10.0)
+        self.assertEqual(1.0, slice_sizer.per_file_latency)
+        self.assertEqual(5, slice_sizer.slice_size)
+
+        # latency is smoothed with the previous observations
+        slice_sizer.record(5, 0.5)
+        self.assertAlmostEqual(0.55, slice_sizer.per_file_latency)
+        self.assertEqual(9, slice_sizer.slice_size)
+
+    def test_record_limits(self):
+        slice_sizer = AdaptiveSliceSizer(initial_size=10, min_size=2, max_size=20, target_duration=5)
+
+        slice_sizer.record(10, 0.0)
+        self.assertEqual(20, slice_sizer.slice_size)
+
+        slice_sizer.record(1, 1000.0)
+        self.assertEqual(2, slice_sizer.slice_size)
+
+    def test_get_slices(self):
+        collection = get_harvest_collection()
+        slice_sizer = AdaptiveSliceSizer(initial_size=2, target_duration=1)
+
+        slices = slice_sizer.get_slices(collection)
+        first_slice = next(slices)
+        self.assertEqual(2, len(first_slice))
+
+        slice_sizer.record(len(first_slice), 2.0)
+        second_slice = next(slices)
+        self.assertEqual(1, len(second_slice))
+        self.assertEqual(0, len(list(slices)))
+
+        self.assertSetEqual(set(collection), set(first_slice) | set(second_slice))
+
+    def test_get_slices_max_bytes(self):
+        collection = PipelineFileCollection()
+        for name in ('file1', 'file2', 'file3'):
+            path = os.path.join(self.temp_dir, name)
+            with open(path, 'wb') as f:
+                f.write(b'0' * 10)
+            collection.add(path)
+
+        slices = list(AdaptiveSliceSizer(initial_size=3, max_bytes=25).get_slices(collection))
+        self.assertListEqual([2, 1], [len(s) for s in slices])
+
+        # a single file larger than the limit is still harvested in a slice on its own
+        slices = list(AdaptiveSliceSizer(initial_size=3, max_bytes=5).get_slices(collection))
+        self.assertListEqual([1, 1, 1], [len(s) for s in slices])
+
+
+class TestTalendHarvesterRunnerParallel(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.marker = os.path.join(self.temp_dir, 'marker')
+        self.config.__dict__['trigger_config'] = {
+            'a_harvester': {'exec': 'echo a_harvester %{file_list}', 'events': [{'regex': [r'.*/bad\.nc$']}]},
+            'b_harvester': {'exec': 'test -e {marker} || (touch {marker}; false)'.format(marker=self.marker),
+                            'events': [{'regex': [r'.*/empty\.nc$']}]},
+            'c_harvester': {'exec': 'echo c_harvester %{file_list}', 'events': [{'regex': [r'.*/good\.nc$']}]}
+        }
+        self.config.__dict__['pipeline_config'] = dict(self.config.pipeline_config,
+                                                       talend={'talend_log_dir': self.temp_dir})
+
+    def test_harvest_parallel(self):
+        # create the marker so that all harvesters succeed
+        open(self.marker, 'w').close()
+
+        collection = get_harvest_collection(with_store=True)
+        harvester_runner = TalendHarvesterRunner(NullStorageBroker("/"),
+                                                 {'slice_size': 1, 'max_parallel_slices': 3}, TESTDATA_DIR,
+                                                 self.config, self.test_logger)
+        with patch.object(harvester_runner, '_run_wave', wraps=harvester_runner._run_wave) as mock_run_wave:
+            harvester_runner.run(collection)
+
+        mock_run_wave.assert_called_once()
+        self.assertEqual(3, len(mock_run_wave.call_args[0][1]))
+
+        harvester_runner.storage_broker.assert_upload_call_count(3)
+        self.assertTrue(all(f.is_harvested for f in collection))
+        self.assertSetEqual({'a_harvester', 'b_harvester', 'c_harvester'},
+                            set(harvester_runner.harvested_file_map.map))
+
+    def test_harvest_parallel_undo(self):
+        collection = get_harvest_collection(with_store=True)
+        harvester_runner = TalendHarvesterRunner(NullStorageBroker("/"),
+                                                 {'slice_size': 1, 'max_parallel_slices': 3}, TESTDATA_DIR,
+                                                 self.config, self.test_logger)
+
+        with self.assertRaises(SystemCommandFailedError):
+            harvester_runner.run(collection)
+
+        # the failed slice and the other slices from the same wave are all undone once the wave has completed
+        self.assertTrue(all(f.is_harvest_undone for f in collection))
+        harvester_runner.storage_broker.assert_upload_call_count(2)
+        harvester_runner.storage_broker.assert_delete_call_count(2)
+
+    def test_harvest_adaptive(self):
+        open(self.marker, 'w').close()
+
+        collection = get_harvest_collection()
+        harvester_runner = TalendHarvesterRunner(NullStorageBroker("/"),
+                                                 {'slice_size': 1, 'adaptive_slicing': True, 'max_slice_size': 3},
+                                                 TESTDATA_DIR, self.config, self.test_logger)
+        harvester_runner.run(collection)
+
+        self.assertTrue(all(f.is_harvested for f in collection))
+        self.assertIsNotNone(harvester_runner.slice_sizer.per_file_latency)
+
+
 GOOD_CSV = os.path.join(TESTDATA_DIR, 'conn', 'test_table.csv')
 ANOTHER_CSV = os.path.join(TESTDATA_DIR, 'conn', 'another_table.csv')
 
@@ -632,6 +796,44 @@ class TestCsvHarvesterRunner(BaseTestCase):
         with self.assertRaises(MissingConfigFileError):
             harvester_runner.get_config_file('database.json')
 
+    def test_get_config_file_cached(self):
+        config_dir = os.path.join(self.temp_dir, 'test_schema')
+        os.mkdir(config_dir)
+        config_file = os.path.join(config_dir, 'database.json')
+        with open(config_file, 'w') as f:
+            json.dump({'dbname': 'first'}, f)
+
+        config = dummy_config()
+        config.pipeline_config['harvester']['config_dir'] = self.temp_dir
+        harvester_runner = CsvHarvesterRunner(self.uploader, {'db_schema': 'test_schema'}, config, self.test_logger)
+
+        with patch('aodncore.pipeline.steps.harvest.json.load', wraps=json.load) as mock_load:
+            database_config = harvester_runner.get_config_file('database.json')
+            database_config['dbname'] = 'modified'
+            self.assertDictEqual({'dbname': 'first'}, harvester_runner.get_config_file('database.json'))
+            self.assertEqual(1, mock_load.call_count)
+
+            with open(config_file, 'w') as f:
+                json.dump({'dbname': 'second', 'user': 'test'}, f)
+            database_config = harvester_runner.get_config_file('database.json')
+            self.assertDictEqual({'dbname': 'second', 'user': 'test'}, database_config)
+            self.assertEqual(2, mock_load.call_count)
+
+    @patch('aodncore.pipeline.steps.harvest.get_connection_pool')
+    @patch('aodncore.pipeline.steps.harvest.DatabaseInteractions')
+    def test_get_connection_pool(self, mock_db, mock_get_pool):
+        harvester_runner = CsvHarvesterRunner(self.uploader, None, dummy_config(), self.test_logger)
+        harvester_runner.get_connection({}, TESTDATA_DIR)
+        self.assertIsNone(mock_db.call_args[1]['pool'])
+        mock_get_pool.assert_not_called()
+
+        config = dummy_config()
+        config.pipeline_config['harvester']['connection_pool'] = {'max_idle_time': 60}
+        harvester_runner = CsvHarvesterRunner(self.uploader, None, config, self.test_logger)
+        harvester_runner.get_connection({}, TESTDATA_DIR)
+        mock_get_pool.assert_called_once_with(max_idle_time=60)
+        self.assertIs(mock_get_pool.return_value, mock_db.call_args[1]['pool'])
+
     @patch('aodncore.pipeline.steps.harvest.DatabaseInteractions')
     def test_get_process_sequence(self, mock_db):
         mock_db.return_value.compare_schemas.return_value = True
@@ -640,6 +842,97 @@ class TestCsvHarvesterRunner(BaseTestCase):
 
         self.assertEqual(replace, harvester_runner.get_process_sequence(mock_db))
 
+    @patch('aodncore.pipeline.steps.harvest.DatabaseInteractions')
+    def test_get_process_sequence_replace_schema_match(self, mock_db):
+        conn = mock_db.return_value
+        conn.compare_schemas.return_value = True
+        conn.object_exists.return_value = True
+        truncate = ["truncate_table", "load_data_from_csv", "refresh_materialized_view"]
+        params = {'ingest_type': 'replace', 'reuse_matching_tables': True}
+        harvester_runner = CsvHarvesterRunner(self.uploader, params, self.config, self.test_logger)
+        runsheet = [{'name': 'test_table', 'type': 'table'}, {'name': 'test_view', 'type': 'materialized view'}]
+
+        self.assertEqual(truncate, harvester_runner.get_process_sequence(conn, runsheet))
+        conn.compare_schemas.assert_called_once_with(runsheet)
+        conn.object_exists.assert_called_once_with('test_view')
+
+    @patch('aodncore.pipeline.steps.harvest.DatabaseInteractions')
+    def test_get_process_sequence_replace_schema_match_not_enabled(self, mock_db):
+        conn = mock_db.return_value
+        conn.compare_schemas.return_value = True
+        conn.object_exists.return_value = True
+        replace = ["drop_object", "create_table_from_yaml_file", "load_data_from_csv", "execute_sql_file"]
+        harvester_runner = CsvHarvesterRunner(self.uploader, {'ingest_type': 'replace'}, self.config, self.test_logger)
+        runsheet = [{'name': 'test_table', 'type': 'table'}, {'name': 'test_view', 'type': 'materialized view'}]
+
+        self.assertEqual(replace, harvester_runner.get_process_sequence(conn, runsheet))
+        conn.compare_schemas.assert_not_called()
+
+    @patch('aodncore.pipeline.steps.harvest.DatabaseInteractions')
+    def test_get_process_sequence_replace_schema_mismatch(self, mock_db):
+        conn = mock_db.return_value
+        replace = ["drop_object", "create_table_from_yaml_file", "load_data_from_csv", "execute_sql_file"]
+        params = {'ingest_type': 'replace', 'reuse_matching_tables': True}
+        harvester_runner = CsvHarvesterRunner(self.uploader, params, self.config, self.test_logger)
+        runsheet = [{'name': 'test_table', 'type': 'table'}, {'name': 'test_view', 'type': 'materialized view'}]
+
+        conn.compare_schemas.return_value = False
+        self.assertEqual(replace, harvester_runner.get_process_sequence(conn, runsheet))
+
+        # a missing view can only be recreated by the `replace` process sequence
+        conn.compare_schemas.return_value = True
+        conn.object_exists.return_value = False
+        self.assertEqual(replace, harvester_runner.get_process_sequence(conn, runsheet))
+
+    @patch('aodncore.pipeline.steps.harvest.DatabaseInteractions')
+    def test_get_process_sequence_truncate(self, mock_db):
+        conn = mock_db.return_value
+        conn.compare_schemas.return_value = True
+        truncate = ["truncate_table", "load_data_from_csv", "refresh_materialized_view"]
+        harvester_runner = CsvHarvesterRunner(self.uploader, {'ingest_type': 'truncate'}, self.config, self.test_logger)
+        runsheet = [{'name': 'test_table', 'type': 'table'}]
+
+        self.assertEqual(truncate, harvester_runner.get_process_sequence(conn, runsheet))
+        conn.compare_schemas.assert_called_once_with(runsheet)
+
+    @patch('aodncore.pipeline.steps.harvest.DatabaseInteractions')
+    def test_get_process_sequence_schema_mismatch(self, mock_db):
+        conn = mock_db.return_value
+        conn.compare_schemas.return_value = False
+        replace = ["drop_object", "create_table_from_yaml_file", "load_data_from_csv", "execute_sql_file"]
+        harvester_runner = CsvHarvesterRunner(self.uploader, {'ingest_type': 'append'}, self.config, self.test_logger)
+
+        self.assertEqual(replace, harvester_runner.get_process_sequence(conn, []))
+
+    @patch('aodncore.pipeline.steps.harvest.DatabaseInteractions')
+    def test_get_process_sequence_swap(self, mock_db):
+        mock_db.return_value.compare_schemas.return_value = True
+        swap = ["create_staging_table", "load_staging_data_from_csv", "create_staging_primary_key",
+                "swap_staging_table", "restore_object"]
+        harvester_runner = CsvHarvesterRunner(self.uploader, {'ingest_type': 'swap'}, self.config, self.test_logger)
+
+        self.assertEqual(swap, harvester_runner.get_process_sequence(mock_db))
+
+    @patch('aodncore.pipeline.steps.harvest.DatabaseInteractions')
+    def test_run_harvester_swap(self, mock_db):
+        conn = mock_db.return_value.__enter__.return_value
+        conn.compare_schemas.return_value = True
+
+        with open(GOOD_HARVEST_PARAMS) as f:
+            hp = json.load(f)
+            hp.pop("metadata_updates")
+            hp['ingest_type'] = 'swap'
+        collection = get_csv_harvest_collection(additional_files=[ANOTHER_CSV])
+        harvester_runner = CsvHarvesterRunner(self.uploader, hp, dummy_config(), self.test_logger)
+        harvester_runner.run(collection)
+
+        # every staging table is loaded before any live table is swapped
+        called = [(c[0], c[1][0]['name']) for c in conn.mock_calls if c[1] and isinstance(c[1][0], dict)]
+        expected = [(task, name) for task in harvester_runner.ingest_processes['swap']
+                    for name in ('test_table', 'another_table', 'test_view')]
+        self.assertListEqual(expected, called)
+        self.assertTrue(all(f.is_harvested for f in collection))
+
     @patch('aodncore.pipeline.steps.harvest.DatabaseInteractions')
     def test_get_process_sequence_invalid(self, mock_db):
         mock_db.return_value.compare_schemas.return_value = True
@@ -682,6 +975,21 @@ class TestCsvHarvesterRunner(BaseTestCase):
                             if o.get('include')]
         self.assertEqual(included_objects, ['test_table', 'test_view'])
 
+    def test_build_runsheet_gzip(self):
+        with open(GOOD_HARVEST_PARAMS) as f:
+            hp = json.load(f, object_pairs_hook=WriteOnceOrderedDict)
+            harvester_runner = CsvHarvesterRunner(self.uploader, hp, self.config, self.test_logger)
+
+        gzip_csv = os.path.join(self.temp_dir, 'test_table.csv.gz')
+        with open(gzip_csv, 'wb'):
+            pass
+        harvester_runner.build_runsheet(PipelineFile(gzip_csv))
+
+        included_objects = [o for o in harvester_runner.db_objects if o.get('include')]
+        self.assertEqual(['test_table', 'test_view'], [o['name'] for o in included_objects])
+        self.assertEqual(gzip_csv, included_objects[0]['local_path'])
+        self.assertListEqual([], harvester_runner.unexpected_pipeline_files)
+
     def test_build_runsheet_recursive(self):
         with open(RECURSIVE_HARVEST_PARAMS) as f:
             hp = json.load(f, object_pairs_hook=WriteOnceOrderedDict)
@@ -714,6 +1022,7 @@ class TestCsvHarvesterRunner(BaseTestCase):
         self.assertTrue(mock_db.called)
         self.assertTrue(mock_gn.called)
         self.assertTrue(mock_mh.called)
+        mock_gn.return_value.run_metadata_handlers.assert_called_once_with([mock_mh.return_value])
 
     @patch('aodncore.pipeline.steps.harvest.DatabaseInteractions')
     def test_run_harvester_no_db_objects(self, mock_db):
@@ -782,3 +1091,123 @@ class TestCsvHarvesterRunner(BaseTestCase):
         self.assertTrue(mock_gn.called)
         self.assertTrue(mock_mh.called)
         harvester_runner.storage_broker.assert_upload_call_count(1)
+
+    @patch('aodncore.pipeline.steps.harvest.DatabaseInteractions')
+    def test_run_harvester_parallel_load(self, mock_db):
+        conn = mock_db.return_value.__enter__.return_value
+        conn.compare_schemas.return_value = True
+
+        with open(GOOD_HARVEST_PARAMS) as f:
+            hp = json.load(f)
+            hp.pop("metadata_updates")
+            hp['parallel_load'] = True
+        collection = get_csv_harvest_collection(additional_files=[ANOTHER_CSV])
+        harvester_runner = CsvHarvesterRunner(self.uploader, hp, dummy_config(), self.test_logger)
+        harvester_runner.run(collection)
+
+        staged_tables = {c[1][0]['name'] for c in conn.load_staging_data_from_csv.mock_calls}
+        self.assertSetEqual({'test_table', 'another_table'}, staged_tables)
+
+        swapped_tables = [c[1][0]['name'] for c in conn.swap_staging_table.mock_calls]
+        self.assertListEqual(['test_table', 'another_table'], swapped_tables)
+        self.assertListEqual(['test_view'], [c[1][0]['name'] for c in conn.drop_object.mock_calls])
+        self.assertEqual(3, conn.execute_sql_file.call_count)
+        self.assertListEqual(['test_view'], [c[1][0]['name'] for c in conn.load_data_from_csv.mock_calls])
+        conn.drop_staging_table.assert_not_called()
+        self.assertTrue(all(f.is_harvested for f in collection))
+
+    @patch('aodncore.pipeline.steps.harvest.DatabaseInteractions')
+    def test_run_parallel_load_dependency_without_data(self, mock_db):
+        conn = MagicMock()
+        harvester_runner = CsvHarvesterRunner(self.uploader, {'parallel_load': True}, dummy_config(), self.test_logger)
+        lookup = {'name': 'lookup', 'type': 'table'}
+        data = {'name': 'data', 'type': 'table', 'local_path': 'data.csv', 'dependencies': ['lookup']}
+
+        harvester_runner.run_parallel_load(conn, [lookup, data], {}, TESTDATA_DIR)
+
+        self.assertListEqual([call.drop_object(lookup),
+                              call.create_table_from_yaml_file(lookup),
+                              call.load_data_from_csv(lookup),
+                              call.execute_sql_file(lookup),
+                              call.swap_staging_table(data),
+                              call.execute_sql_file(data)], conn.mock_calls)
+
+    @patch('aodncore.pipeline.steps.harvest.DatabaseInteractions')
+    def test_run_harvester_parallel_load_failure(self, mock_db):
+        conn = mock_db.return_value.__enter__.return_value
+        conn.compare_schemas.return_value = True
+
+        def load_staging_data_from_csv(step):
+            if step['name'] == 'another_table':
+                raise InvalidSQLTransactionError('load failed')
+        conn.load_staging_data_from_csv.side_effect = load_staging_data_from_csv
+
+        with open(GOOD_HARVEST_PARAMS) as f:
+            hp = json.load(f)
+            hp.pop("metadata_updates")
+            hp['parallel_load'] = True
+        collection = get_csv_harvest_collection(additional_files=[ANOTHER_CSV])
+        harvester_runner = CsvHarvesterRunner(self.uploader, hp, dummy_config(), self.test_logger)
+
+        with self.assertRaisesRegex(InvalidSQLTransactionError, 'load failed'):
+            harvester_runner.run(collection)
+
+        conn.swap_staging_table.assert_not_called()
+        self.assertListEqual(['test_table'], [c[1][0]['name'] for c in conn.drop_staging_table.mock_calls])
+        self.assertFalse(any(f.is_harvested for f in collection))
+
+    @patch('aodncore.pipeline.steps.harvest.DatabaseInteractions')
+    def test_load_staging_tables_dependencies(self, mock_db):
+        conn = mock_db.return_value.__enter__.return_value
+        harvester_runner = CsvHarvesterRunner(self.uploader, {'max_parallel_loads': 2}, dummy_config(),
+                                              self.test_logger)
+        runsheet = [
+            {'name': 'child', 'type': 'table', 'local_path': 'child.csv', 'dependencies': ['parent']},
+            {'name': 'parent', 'type': 'table', 'local_path': 'parent.csv'},
+            {'name': 'other', 'type': 'table', 'local_path': 'other.csv'},
+            {'name': 'view', 'type': 'materialized view', 'dependencies': ['child']}
+        ]
+
+        loaded_steps = harvester_runner.load_staging_tables(runsheet, {}, TESTDATA_DIR)
+
+        self.assertSetEqual({'child', 'parent', 'other'}, {s['name'] for s in loaded_steps})
+        loaded_order = [c[1][0]['name'] for c in conn.load_staging_data_from_csv.mock_calls]
+        self.assertLess(loaded_order.index('parent'), loaded_order.index('child'))
+
+    @patch('aodncore.pipeline.steps.harvest.DatabaseInteractions')
+    def test_load_staging_tables_copy_partitions(self, mock_db):
+        conn = mock_db.return_value.__enter__.return_value
+        harvester_runner = CsvHarvesterRunner(self.uploader, {'copy_partitions': 3}, dummy_config(), self.test_logger)
+        step = {'name': 'big', 'type': 'table', 'local_path': 'big.csv'}
+
+        loaded_steps = harvester_runner.load_staging_tables([step], {}, TESTDATA_DIR)
+
+        self.assertListEqual([step], loaded_steps)
+        conn.load_staging_data_from_csv.assert_called_once_with(step, partitions=3)
+        conn.create_staging_primary_key.assert_called_once_with(step)
+        conn.drop_staging_table.assert_not_called()
+
+    @patch('aodncore.pipeline.steps.harvest.DatabaseInteractions')
+    def test_load_staging_tables_copy_partitions_failure(self, mock_db):
+        conn = mock_db.return_value.__enter__.return_value
+        conn.load_staging_data_from_csv.side_effect = InvalidSQLTransactionError('load failed')
+        harvester_runner = CsvHarvesterRunner(self.uploader, {'copy_partitions': 3}, dummy_config(), self.test_logger)
+        step = {'name': 'big', 'type': 'table', 'local_path': 'big.csv'}
+
+        with self.assertRaisesRegex(InvalidSQLTransactionError, 'load failed'):
+            harvester_runner.load_staging_tables([step], {}, TESTDATA_DIR)
+
+        # the partially loaded staging table has already been committed, so must be dropped
+        conn.create_staging_table.assert_called_once_with(step)
+        conn.drop_staging_table.assert_called_once_with(step)
+
+    @patch('aodncore.pipeline.steps.harvest.DatabaseInteractions')
+    def test_load_staging_tables_circular(self, mock_db):
+        harvester_runner = CsvHarvesterRunner(self.uploader, None, dummy_config(), self.test_logger)
+        runsheet = [
+            {'name': 'first', 'type': 'table', 'local_path': 'first.csv', 'dependencies': ['second']},
+            {'name': 'second', 'type': 'table', 'local_path': 'second.csv', 'dependencies': ['first']}
+        ]
+
+        with self.assertRaisesRegex(InvalidConfigError, 'circular dependencies'):
+            harvester_runner.load_staging_tables(runsheet, {}, TESTDATA_DIR)
@@ -1,11 +1,18 @@
+import csv
+import gzip
+import io
 import os
 import smtplib
 import socket
+import threading
+from collections import OrderedDict
 from unittest.mock import MagicMock, patch
 from aodncore.pipeline import NotificationRecipientType, PipelineFile, PipelineFileCollection
-from aodncore.pipeline.steps.notify import (get_child_notify_runner, BaseNotifyRunner, EmailNotifyRunner,
-                                            LogFailuresNotifyRunner, NotifyList, NotificationRecipient, SnsNotifyRunner,
-                                            smtp_server_init)
+from aodncore.pipeline.steps.notify import (get_child_notify_runner, BaseNotifyRunner, EmailDeliveryQueue,
+                                            EmailNotifyRunner, LogFailuresNotifyRunner, NotifyList,
+                                            NotificationRecipient, SmtpConnectionPool, SnsNotifyRunner,
+                                            flush_email_delivery_queue, is_transient_smtp_error,
+                                            precompile_notification_templates, smtp_server_init)
 from aodncore.testlib import BaseTestCase
 
 TESTDATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'testdata')
@@ -65,6 +72,24 @@ class TestBaseNotifyRunner(BaseTestCase):
                          'text_input_file_table']
 
         self.assertCountEqual(expected_keys, list(file_tables.keys()))
+        self.assertNotIn('further files not shown', file_tables['text_collection_table'])
+
+    def test__get_file_tables_truncated(self):
+        notification_data = get_notification_data()
+        notification_data['collection_data'] = [
+            OrderedDict([('name', 'file{i}.nc'.format(i=i)), ('check_passed', 'True'), ('published', 'Yes'),
+                         ('check_log', '')]) for i in range(5)]
+        dummy_runner = DummyNotifyRunner(notification_data, self.config, self.test_logger)
+        self.config.pipeline_config['templating']['max_collection_table_rows'] = 2
+
+        file_tables = dummy_runner._get_file_tables()
+
+        self.assertTrue(dummy_runner.collection_table_truncated)
+        self.assertIn('file1.nc', file_tables['text_collection_table'])
+        self.assertNotIn('file2.nc', file_tables['text_collection_table'])
+        self.assertNotIn('file2.nc', file_tables['html_collection_table'])
+        self.assertIn('3 further files not shown (showing 2 of 5 files)', file_tables['text_collection_table'])
+        self.assertIn('3 further files not shown (showing 2 of 5 files)', file_tables['html_collection_table'])
 
 
 class TestEmailNotifyRunner(BaseTestCase):
@@ -88,6 +113,26 @@ class TestEmailNotifyRunner(BaseTestCase):
         self.assertTrue(recipient.notification_succeeded)
         self.assertIsNone(recipient.error)
 
+    @patch('aodncore.pipeline.steps.notify.TemplateRenderer')
+    def test_collection_table_attachment(self, mock_templaterenderer):
+        mock_templaterenderer.return_value.render.return_value = 'DUMMY EMAIL BODY'
+        notification_data = get_notification_data()
+        notification_data['collection_data'] = [
+            OrderedDict([('name', 'file{i}.nc'.format(i=i)), ('check_passed', 'True'), ('published', 'Yes'),
+                         ('check_log', '')]) for i in range(5)]
+        email_runner = EmailNotifyRunner(notification_data, self.config, self.test_logger)
+        self.config.pipeline_config['templating']['max_collection_table_rows'] = 2
+
+        message = email_runner._construct_message(['nobody@example.com'], 'subject', 'from@example.com')
+        attachments = [p for p in message.get_payload() if p.get_filename() == 'file_collection.csv.gz']
+        self.assertEqual(1, len(attachments))
+
+        with gzip.GzipFile(fileobj=io.BytesIO(attachments[0].get_payload(decode=True))) as g:
+            rows = list(csv.reader(io.TextIOWrapper(g, encoding='utf-8')))
+        self.assertListEqual(['Name', 'Checks passed', 'Published?'], rows[0])
+        self.assertListEqual(['file4.nc', 'True', 'Yes'], rows[-1])
+        self.assertEqual(6, len(rows))
+
     @patch('aodncore.pipeline.steps.notify.smtplib.SMTP')
     @patch('aodncore.pipeline.steps.notify.TemplateRenderer')
     def test_invalid_login(self, mock_templaterenderer, mock_smtp):
@@ -152,6 +197,242 @@ class TestEmailNotifyRunner(BaseTestCase):
         self.assertIsNone(self.email_runner.error)
 
 
+class TestSmtpConnectionPool(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.mail_config = self.config.pipeline_config['mail']
+        self.pool = SmtpConnectionPool()
+
+    @patch('aodncore.pipeline.steps.notify.smtplib.SMTP')
+    def test_reuse(self, mock_smtp):
+        mock_smtp.return_value.noop.return_value = (250, b'OK')
+
+        self.pool.sendmail(self.mail_config, 'from@example.com', ['nobody@example.com'], 'message 1')
+        self.pool.sendmail(self.mail_config, 'from@example.com', ['nobody@example.com'], 'message 2')
+
+        self.assertEqual(1, mock_smtp.call_count)
+        self.assertEqual(1, mock_smtp.return_value.login.call_count)
+        self.assertEqual(2, mock_smtp.return_value.sendmail.call_count)
+        self.assertEqual(1, len(self.pool))
+
+        self.pool.close()
+        self.assertEqual(0, len(self.pool))
+        mock_smtp.return_value.quit.assert_called_once()
+
+    @patch('aodncore.pipeline.steps.notify.smtplib.SMTP')
+    def test_dead_connection_replaced(self, mock_smtp):
+        dead_connection = MagicMock()
+        dead_connection.noop.side_effect = smtplib.SMTPServerDisconnected
+        self.pool.release(self.mail_config, dead_connection)
+
+        connection = self.pool.acquire(self.mail_config)
+
+        self.assertIs(mock_smtp.return_value, connection)
+        dead_connection.quit.assert_called_once()
+
+    @patch('aodncore.pipeline.steps.notify.smtplib.SMTP')
+    def test_expired_connection_replaced(self, mock_smtp):
+        self.pool.max_idle_time = 0
+        idle_connection = MagicMock()
+        self.pool.release(self.mail_config, idle_connection)
+
+        connection = self.pool.acquire(self.mail_config)
+
+        self.assertIs(mock_smtp.return_value, connection)
+        idle_connection.noop.assert_not_called()
+        idle_connection.quit.assert_called_once()
+
+    @patch('aodncore.pipeline.steps.notify.smtplib.SMTP')
+    def test_reconnect_after_disconnect(self, mock_smtp):
+        stale_connection = MagicMock()
+        stale_connection.noop.return_value = (250, b'OK')
+        stale_connection.sendmail.side_effect = smtplib.SMTPServerDisconnected
+        self.pool.release(self.mail_config, stale_connection)
+        mock_smtp.return_value.sendmail.return_value = {}
+
+        result = self.pool.sendmail(self.mail_config, 'from@example.com', ['nobody@example.com'], 'message')
+
+        self.assertDictEqual({}, result)
+        stale_connection.close.assert_called_once()
+        mock_smtp.return_value.sendmail.assert_called_once()
+
+    @patch('aodncore.pipeline.steps.notify.smtplib.SMTP')
+    def test_max_size(self, mock_smtp):
+        self.pool.max_size = 1
+        connections = [MagicMock(), MagicMock()]
+        for connection in connections:
+            self.pool.release(self.mail_config, connection)
+
+        self.assertEqual(1, len(self.pool))
+        connections[1].quit.assert_called_once()
+
+    def test_is_transient_smtp_error(self):
+        self.assertTrue(is_transient_smtp_error(smtplib.SMTPServerDisconnected()))
+        self.assertTrue(is_transient_smtp_error(socket.timeout()))
+        self.assertTrue(is_transient_smtp_error(smtplib.SMTPDataError(451, 'try again later')))
+        self.assertFalse(is_transient_smtp_error(smtplib.SMTPDataError(554, 'rejected')))
+        self.assertFalse(is_transient_smtp_error(smtplib.SMTPRecipientsRefused(
+            {'recipient1@example.com': (550, "User unknown")})))
+        self.assertFalse(is_transient_smtp_error(ValueError()))
+
+
+class TestEmailDeliveryQueue(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.mail_config = self.config.pipeline_config['mail']
+        self.pool = MagicMock()
+        self.delivery_queue = EmailDeliveryQueue(pool=self.pool, retry_delay=0)
+
+        self.recipient1 = NotificationRecipient.from_string('email:recipient1@example.com')
+        self.recipient2 = NotificationRecipient.from_string('email:recipient2@example.com')
+        self.notify_list = NotifyList([self.recipient1, self.recipient2])
+
+    def _put(self, logger=None):
+        self.delivery_queue.put(self.mail_config, 'from@example.com',
+                                ['recipient1@example.com', 'recipient2@example.com'], self.notify_list, 'message',
+                                logger or self.test_logger)
+
+    def test_delivery(self):
+        self.pool.sendmail.return_value = {'recipient1@example.com': (550, "User unknown")}
+        self._put()
+        self._put()
+
+        self.assertTrue(self.delivery_queue.flush(timeout=10))
+        self.assertEqual(2, self.pool.sendmail.call_count)
+        self.assertListEqual([self.recipient1], list(self.notify_list.filter_by_failed()))
+        self.assertIsNotNone(self.recipient1.error)
+        self.assertListEqual([self.recipient2], list(self.notify_list.filter_by_succeeded()))
+        self.assertFalse(self.notify_list.filter_by_pending())
+
+    def test_pending_until_delivered(self):
+        delivered = threading.Event()
+        self.pool.sendmail.side_effect = lambda *args: delivered.wait(10) and {}
+        self._put()
+
+        # recipients are neither succeeded nor failed while the message is waiting to be delivered
+        self.assertListEqual([self.recipient1, self.recipient2], list(self.notify_list.filter_by_pending()))
+        self.assertFalse(self.notify_list.filter_by_succeeded())
+        self.assertFalse(self.notify_list.filter_by_failed())
+        self.assertFalse(self.delivery_queue.flush(timeout=0.1))
+
+        delivered.set()
+        self.assertTrue(self.delivery_queue.flush(timeout=10))
+        self.assertFalse(self.notify_list.filter_by_pending())
+        self.assertListEqual([self.recipient1, self.recipient2], list(self.notify_list.filter_by_succeeded()))
+
+    def test_transient_failure_retried(self):
+        self.pool.sendmail.side_effect = [smtplib.SMTPServerDisconnected(), {}]
+        self._put()
+
+        self.assertTrue(self.delivery_queue.flush(timeout=10))
+        self.assertEqual(2, self.pool.sendmail.call_count)
+        self.assertTrue(self.recipient1.notification_succeeded)
+        self.assertTrue(self.recipient2.notification_succeeded)
+
+    def test_retries_exhausted(self):
+        self.delivery_queue.max_retries = 1
+        self.pool.sendmail.side_effect = smtplib.SMTPServerDisconnected()
+
+        with patch.object(self.test_logger, 'warning') as mock_warning, \
+                patch.object(self.test_logger, 'error') as mock_error:
+            self._put()
+            self.assertTrue(self.delivery_queue.flush(timeout=10))
+
+        self.assertEqual(2, self.pool.sendmail.call_count)
+        self.assertTrue(self.recipient1.notification_attempted)
+        self.assertFalse(self.recipient1.notification_succeeded)
+        self.assertIsInstance(self.recipient1.error, smtplib.SMTPServerDisconnected)
+        self.assertEqual(1, mock_warning.call_count)
+        self.assertEqual(1, mock_error.call_count)
+
+    def test_flush_timeout_logs_undelivered(self):
+        self.delivery_queue.retry_delay = 60
+        self.pool.sendmail.side_effect = [smtplib.SMTPServerDisconnected(), {}]
+
+        with patch.object(self.test_logger, 'error') as mock_error:
+            self._put()
+            self.assertFalse(self.delivery_queue.flush(timeout=0.5))
+
+        self.assertEqual(1, self.pool.sendmail.call_count)
+        mock_error.assert_called_once()
+        self.assertIn("['recipient1@example.com', 'recipient2@example.com']", mock_error.call_args[0][0])
+        self.assertListEqual([self.recipient1, self.recipient2], list(self.notify_list.filter_by_pending()))
+
+    def test_flush_retry_now(self):
+        self.delivery_queue.retry_delay = 60
+        self.pool.sendmail.side_effect = [smtplib.SMTPServerDisconnected(), {}]
+        self._put()
+
+        self.assertTrue(self.delivery_queue.flush(timeout=10, retry_now=True))
+        self.assertEqual(2, self.pool.sendmail.call_count)
+        self.assertListEqual([self.recipient1, self.recipient2], list(self.notify_list.filter_by_succeeded()))
+
+    def test_permanent_failure_not_retried(self):
+        self.pool.sendmail.side_effect = smtplib.SMTPDataError(554, 'rejected')
+        self._put()
+
+        self.assertTrue(self.delivery_queue.flush(timeout=10))
+        self.assertEqual(1, self.pool.sendmail.call_count)
+        self.assertFalse(self.recipient2.notification_succeeded)
+        self.assertIsInstance(self.recipient2.error, smtplib.SMTPDataError)
+
+    @patch('aodncore.pipeline.steps.notify.get_email_delivery_queue')
+    @patch('aodncore.pipeline.steps.notify.TemplateRenderer')
+    def test_email_runner_queued(self, mock_templaterenderer, mock_get_email_delivery_queue):
+        mock_templaterenderer.return_value.render.return_value = 'DUMMY EMAIL BODY'
+        mock_get_email_delivery_queue.return_value = self.delivery_queue
+        self.pool.sendmail.return_value = {}
+
+        pipeline_config = dict(self.config.pipeline_config)
+        pipeline_config['mail'] = dict(pipeline_config['mail'], delivery_queue={'enabled': True})
+        self.config.__dict__['pipeline_config'] = pipeline_config
+
+        recipient = NotificationRecipient.from_string('email:nobody@example.com')
+        email_runner = EmailNotifyRunner(get_notification_data(), self.config, self.test_logger)
+        with patch.object(self.delivery_queue, '_ensure_started'):
+            email_runner.run(NotifyList([recipient]))
+
+        # the recipient is only pending until the queued message has been delivered
+        self.assertTrue(recipient.notification_pending)
+        self.assertFalse(recipient.notification_attempted)
+        self.assertFalse(recipient.notification_succeeded)
+
+        self.delivery_queue._ensure_started()
+        self.assertTrue(self.delivery_queue.flush(timeout=10))
+        self.pool.sendmail.assert_called_once()
+        self.assertListEqual(['nobody@example.com'], self.pool.sendmail.call_args[0][2])
+        self.assertFalse(recipient.notification_pending)
+        self.assertTrue(recipient.notification_attempted)
+        self.assertTrue(recipient.notification_succeeded)
+
+    @patch('aodncore.pipeline.steps.notify._email_delivery_queue')
+    @patch('aodncore.pipeline.steps.notify._notify_pid', os.getpid())
+    def test_flush_email_delivery_queue(self, mock_email_delivery_queue):
+        mock_email_delivery_queue.flush.return_value = True
+        self.assertTrue(flush_email_delivery_queue(timeout=5))
+        mock_email_delivery_queue.flush.assert_called_once_with(5, retry_now=False)
+
+    @patch('aodncore.pipeline.steps.notify._email_delivery_queue', None)
+    @patch('aodncore.pipeline.steps.notify._notify_pid', os.getpid())
+    def test_flush_email_delivery_queue_none(self):
+        self.assertTrue(flush_email_delivery_queue())
+
+
+class TestNotificationTemplates(BaseTestCase):
+    @patch('aodncore.pipeline.steps.notify.TemplateRenderer')
+    def test_precompile_notification_templates(self, mock_templaterenderer):
+        precompile_notification_templates(self.config)
+
+        mock_templaterenderer.return_value.precompile.assert_called_once_with('notify.txt.j2', 'notify.html.j2')
+
+    def test_render(self):
+        email_runner = EmailNotifyRunner(get_notification_data(), self.config, self.test_logger)
+        text, html = email_runner._render()
+
+        self.assertIn('good.nc', text)
+        self.assertIn('good.nc', html)
+
+
 class TestLogFailuresNotifyRunner(BaseTestCase):
     def setUp(self):
         super().setUp()
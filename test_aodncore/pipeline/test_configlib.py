@@ -172,6 +172,18 @@ class TestLazyConfigManager(BaseTestCase):
         expected_logging_handlers = ['tasks.ANMN_QLD_XXXX_handler']
         self.assertCountEqual(expected_logging_handlers, worker_logging_config['handlers'].keys())
 
+    def test_get_worker_logging_config_cached(self):
+        worker_logging_config = self.config.get_worker_logging_config('tasks.ANMN_QLD_XXXX')
+        self.assertIs(worker_logging_config, self.config.get_worker_logging_config('tasks.ANMN_QLD_XXXX'))
+        self.assertIsNot(worker_logging_config, self.config.get_worker_logging_config('tasks.SOOP_DU_JOUR'))
+
+        updated_pipeline_config = dict(self.config.pipeline_config)
+        updated_pipeline_config['logging'] = dict(self.config.pipeline_config['logging'], level='DEBUG')
+        self.config.__dict__['pipeline_config'] = updated_pipeline_config
+        updated_logging_config = self.config.get_worker_logging_config('tasks.ANMN_QLD_XXXX')
+        self.assertIsNot(worker_logging_config, updated_logging_config)
+        self.assertEqual('DEBUG', updated_logging_config['handlers']['tasks.ANMN_QLD_XXXX_handler']['level'])
+
     def test_watch_directory_map(self):
         expected_map = {
             os.path.join(self.config.pipeline_config['watch']['incoming_dir'], 'ANMN/QLD/XXXX'): 'ANMN_QLD_XXXX',
@@ -1,10 +1,14 @@
+import gzip
 import os.path
+import shutil
+from unittest.mock import MagicMock, patch
 
 import psycopg2
-from psycopg2.extensions import parse_dsn
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INERROR, parse_dsn
 from testcontainers.postgres import PostgresContainer
 
-from aodncore.pipeline.db import DatabaseInteractions
+from aodncore.pipeline.db import (DatabaseConnectionPool, DatabaseInteractions, _FileRangeReader, get_connection_pool,
+                                  get_csv_partitions, get_primary_key_name, get_staging_table_name)
 from aodncore.testlib import BaseTestCase
 from test_aodncore import TESTDATA_DIR
 from aodncore.pipeline.exceptions import InvalidSQLConnectionError, InvalidSQLTransactionError, MissingFileError
@@ -18,6 +22,7 @@ BAD_SQL = {"name": "invalid", "type": "table"}
 SAMPLE_DATA = os.path.join(TESTDATA_DIR, "test.sample_data.csv")
 GOOD_CSV = {"name": "sample_data", "type": "table", "local_path": SAMPLE_DATA}
 NO_DATA = {"name": "no_data", "type": "table", "local_path": 'not/a/real/file'}
+STAGED_CSV = dict(GOOD_TABLE_DEFN, local_path=os.path.join(TESTDATA_DIR, "test_frictionless.csv"))
 EXTENT_COLUMNS = (("station_name", "varchar"), ("survey_datetime", "timestamp"), ("sample_depth", "numeric"))
 
 
@@ -109,9 +114,30 @@ class TestDatabaseInteractions(BaseTestCase):
         self.assertEqual(1, count)
 
     def test_compare_schemas(self):
-        # TODO: placeholder until function is implemented
+        self.drop_table(GOOD_TABLE_DEFN['name'])
+        with DatabaseInteractions(config=self.params, schema_base_path=TESTDATA_DIR, logger=self.test_logger) as db:
+            db.create_table_from_yaml_file(GOOD_TABLE_DEFN)
+            self.assertTrue(db.compare_schemas([GOOD_TABLE_DEFN, GOOD_VIEW_DEFN]))
+
+            expected = {
+                'fields': [('sample', 'integer'), ('taxon_name', 'character varying'),
+                           ('taxon_group', 'character varying'), ('taxon_grp01', 'character varying'),
+                           ('genus', 'character varying'), ('species', 'character varying'), ('spcode', 'integer'),
+                           ('zoop_abundance_m3', 'numeric')],
+                'primaryKey': ['sample', 'taxon_name']
+            }
+            self.assertDictEqual(expected, db.get_table_schema(GOOD_TABLE_DEFN['name']))
+            self.assertDictEqual(expected, db.get_expected_schema(GOOD_TABLE_DEFN))
+
+    def test_compare_schemas_mismatch(self):
+        self.create_sample_table(GOOD_TABLE_DEFN['name'], with_data=False)
+        with DatabaseInteractions(config=self.params, schema_base_path=TESTDATA_DIR, logger=self.test_logger) as db:
+            self.assertFalse(db.compare_schemas([GOOD_TABLE_DEFN]))
+
+        self.drop_table(GOOD_TABLE_DEFN['name'])
         with DatabaseInteractions(config=self.params, schema_base_path=TESTDATA_DIR, logger=self.test_logger) as db:
-            self.assertTrue(db.compare_schemas())
+            self.assertIsNone(db.get_table_schema(GOOD_TABLE_DEFN['name']))
+            self.assertFalse(db.compare_schemas([GOOD_TABLE_DEFN]))
 
     def test_truncate_table(self):
         self.create_sample_table(GOOD_TABLE_DEFN['name'])
@@ -143,6 +169,36 @@ class TestDatabaseInteractions(BaseTestCase):
                 # Pass in object with type != materialized view
                 db.refresh_materialized_view(GOOD_TABLE_DEFN)
 
+    def test_can_refresh_concurrently(self):
+        self.create_materialized_view(GOOD_TABLE_DEFN['name'])
+        with DatabaseInteractions(config=self.params, schema_base_path=TESTDATA_DIR, logger=self.test_logger) as db:
+            self.assertFalse(db.can_refresh_concurrently(GOOD_VIEW_DEFN['name']))
+            self.assertFalse(db.can_refresh_concurrently(GOOD_TABLE_DEFN['name']))
+
+        self.cursor.execute('CREATE UNIQUE INDEX ON {} (id, value)'.format(GOOD_VIEW_DEFN['name']))
+        self.conn.commit()
+        with DatabaseInteractions(config=self.params, schema_base_path=TESTDATA_DIR, logger=self.test_logger) as db:
+            self.assertTrue(db.can_refresh_concurrently(GOOD_VIEW_DEFN['name']))
+            db.truncate_table(GOOD_TABLE_DEFN)
+            db.refresh_materialized_view(GOOD_VIEW_DEFN)
+
+        count = self.get_table_count(GOOD_VIEW_DEFN['name'])
+        self.assertEqual(0, count)
+
+    def test_restore_object(self):
+        self.create_materialized_view(GOOD_TABLE_DEFN['name'])
+        self.drop_table(BAD_SQL['name'])
+        with DatabaseInteractions(config=self.params, schema_base_path=TESTDATA_DIR, logger=self.test_logger) as db:
+            self.assertTrue(db.object_exists(GOOD_VIEW_DEFN['name']))
+            self.assertFalse(db.object_exists(BAD_SQL['name']))
+
+            # an existing view is refreshed
+            db.truncate_table(GOOD_TABLE_DEFN)
+            db.restore_object(GOOD_VIEW_DEFN)
+
+        count = self.get_table_count(GOOD_VIEW_DEFN['name'])
+        self.assertEqual(0, count)
+
     def test_drop_object_table(self):
         self.create_sample_table(GOOD_TABLE_DEFN['name'])
         with DatabaseInteractions(config=self.params, schema_base_path=TESTDATA_DIR, logger=self.test_logger) as db:
@@ -200,6 +256,65 @@ class TestDatabaseInteractions(BaseTestCase):
             with DatabaseInteractions(config=self.params, schema_base_path=TESTDATA_DIR, logger=self.test_logger) as db:
                 db.load_data_from_csv(GOOD_CSV)
 
+    def test_load_data_from_csv_gzip(self):
+        gzip_csv = dict(GOOD_CSV, local_path=os.path.join(self.temp_dir, 'sample_data.csv.gz'))
+        with open(SAMPLE_DATA, 'rb') as f_in, gzip.open(gzip_csv['local_path'], 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out)
+
+        self.create_sample_table(GOOD_CSV['name'])
+        expected = self.get_table_count(GOOD_CSV['name'])
+        self.create_sample_table(GOOD_CSV['name'], with_data=False)
+        with DatabaseInteractions(config=self.params, schema_base_path=TESTDATA_DIR, logger=self.test_logger) as db:
+            db.load_data_from_csv(gzip_csv)
+
+        count = self.get_table_count(GOOD_CSV['name'])
+        self.assertEqual(expected, count)
+
+    def test_load_staging_data_from_csv_partitions(self):
+        with DatabaseInteractions(config=self.params, schema_base_path=TESTDATA_DIR, logger=self.test_logger) as db:
+            db.create_staging_table(STAGED_CSV)
+        with open(STAGED_CSV['local_path']) as f:
+            expected = sum(1 for _ in f) - 1
+
+        with patch('aodncore.pipeline.db.MIN_COPY_PARTITION_SIZE', 1):
+            with DatabaseInteractions(config=self.params, schema_base_path=TESTDATA_DIR, logger=self.test_logger) as db:
+                db.load_staging_data_from_csv(STAGED_CSV, partitions=4)
+
+        count = self.get_table_count(get_staging_table_name(STAGED_CSV['name']))
+        self.assertEqual(expected, count)
+        self.drop_table(get_staging_table_name(STAGED_CSV['name']))
+
+    def test_swap_staging_table(self):
+        self.drop_table(STAGED_CSV['name'])
+        # swap twice, to ensure that the renamed primary key index does not collide with the next staging table
+        for _ in range(2):
+            with DatabaseInteractions(config=self.params, schema_base_path=TESTDATA_DIR, logger=self.test_logger) as db:
+                db.create_staging_table(STAGED_CSV)
+                db.load_staging_data_from_csv(STAGED_CSV)
+                db.create_staging_primary_key(STAGED_CSV)
+                db.swap_staging_table(STAGED_CSV)
+
+        count = self.get_table_count(STAGED_CSV['name'])
+        self.assertGreater(count, 0)
+
+        cond = {'table_schema': self.params['user'], 'table_name': STAGED_CSV['name'],
+                'constraint_type': 'PRIMARY KEY', 'constraint_name': get_primary_key_name(STAGED_CSV['name'])}
+        count = self.get_table_count('information_schema.table_constraints', cond)
+        self.assertEqual(1, count)
+
+        cond = {'table_schema': self.params['user'], 'table_name': get_staging_table_name(STAGED_CSV['name'])}
+        count = self.get_table_count('information_schema.tables', cond)
+        self.assertEqual(0, count)
+
+    def test_drop_staging_table(self):
+        with DatabaseInteractions(config=self.params, schema_base_path=TESTDATA_DIR, logger=self.test_logger) as db:
+            db.create_staging_table(STAGED_CSV)
+            db.drop_staging_table(STAGED_CSV)
+
+        cond = {'table_schema': self.params['user'], 'table_name': get_staging_table_name(STAGED_CSV['name'])}
+        count = self.get_table_count('information_schema.tables', cond)
+        self.assertEqual(0, count)
+
     def test_execute_sql_file(self):
         self.drop_table(GOOD_TABLE_DEFN['name'])
         with self.assertNoException():
@@ -316,7 +431,211 @@ class TestDatabaseInteractions(BaseTestCase):
 
         self.drop_table('extent_data')
 
+    def test_get_extents(self):
+        self.create_sample_table(
+            table_name='extent_data',
+            cols=EXTENT_COLUMNS,
+            data_file=os.path.join(TESTDATA_DIR, 'test.extent_data.csv')
+        )
+        with DatabaseInteractions(config=self.params, schema_base_path=TESTDATA_DIR, logger=self.test_logger) as db:
+            actual = db.get_extents('extent_data', temporal_columns=['survey_datetime'],
+                                    vertical_columns=['sample_depth'])
+            self.assertDictEqual(dict(db.get_temporal_extent('extent_data', 'survey_datetime')),
+                                 actual[('temporal', 'survey_datetime')])
+
+        self.assertEqual({'min_value': 0, 'max_value': 107}, actual[('vertical', 'sample_depth')])
+        self.drop_table('extent_data')
+
     def test_query_exception(self):
         with self.assertRaises(InvalidSQLTransactionError):
             with DatabaseInteractions(config=self.params, schema_base_path=TESTDATA_DIR, logger=self.test_logger) as db:
                 db.get_vertical_extent('not_a_table', 'not_a_column')
+
+
+class TestGetPrimaryKeyName(BaseTestCase):
+    def test_get_primary_key_name(self):
+        self.assertEqual('test_table_pkey', get_primary_key_name('test_table'))
+
+    def test_get_primary_key_name_truncated(self):
+        self.assertEqual('{}_pkey'.format('a' * 58), get_primary_key_name('a' * 70))
+        self.assertEqual(63, len(get_primary_key_name(get_staging_table_name('a' * 60))))
+
+        # multibyte characters are not split
+        name = get_primary_key_name('a' * 57 + '\u00e9' * 5)
+        self.assertEqual('{}_pkey'.format('a' * 57), name)
+        self.assertLessEqual(len(name.encode('utf-8')), 63)
+
+
+class TestCsvPartitions(BaseTestCase):
+    def setUp(self):
+        self.csv_path = os.path.join(self.temp_dir, 'partitions.csv')
+        self.rows = ["{},value{}\n".format(i, i) for i in range(100)]
+        with open(self.csv_path, 'w') as f:
+            f.write("id,value\n")
+            f.writelines(self.rows)
+
+    def read_ranges(self, ranges):
+        rows = []
+        with open(self.csv_path, 'rb') as f:
+            for start, end in ranges:
+                reader = _FileRangeReader(f, start, end)
+                data = b''
+                chunk = reader.read(7)
+                while chunk:
+                    data += chunk
+                    chunk = reader.read(7)
+                rows.extend(data.decode('utf-8').splitlines(True))
+        return rows
+
+    def test_get_csv_partitions(self):
+        ranges = get_csv_partitions(self.csv_path, 4, min_partition_size=1)
+
+        self.assertEqual(4, len(ranges))
+        self.assertEqual(len("id,value\n"), ranges[0][0])
+        self.assertEqual(os.path.getsize(self.csv_path), ranges[-1][1])
+        for previous, current in zip(ranges, ranges[1:]):
+            self.assertEqual(previous[1], current[0])
+        self.assertListEqual(self.rows, self.read_ranges(ranges))
+
+    def test_get_csv_partitions_min_size(self):
+        ranges = get_csv_partitions(self.csv_path, 4, min_partition_size=os.path.getsize(self.csv_path))
+
+        self.assertEqual(1, len(ranges))
+        self.assertListEqual(self.rows, self.read_ranges(ranges))
+
+    def test_get_csv_partitions_header_only(self):
+        with open(self.csv_path, 'w') as f:
+            f.write("id,value\n")
+
+        self.assertListEqual([], get_csv_partitions(self.csv_path, 4, min_partition_size=1))
+
+
+def get_mock_connection():
+    conn = MagicMock()
+    conn.closed = 0
+    conn.get_transaction_status.return_value = TRANSACTION_STATUS_IDLE
+    return conn
+
+
+@patch('aodncore.pipeline.db._connect')
+class TestDatabaseConnectionPool(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.params = {'host': 'localhost', 'dbname': 'harvest', 'user': 'test'}
+
+    def test_reuse(self, mock_connect):
+        mock_connect.side_effect = lambda params: get_mock_connection()
+        pool = DatabaseConnectionPool()
+
+        conn = pool.acquire(self.params)
+        pool.release(self.params, conn)
+        self.assertEqual(1, len(pool))
+        conn.cursor.return_value.__enter__.return_value.execute.assert_called_once_with('DISCARD ALL')
+
+        self.assertIs(conn, pool.acquire(dict(self.params)))
+        self.assertEqual(1, mock_connect.call_count)
+
+        # different connection parameters never share a connection
+        self.assertIsNot(conn, pool.acquire(dict(self.params, dbname='other')))
+        self.assertEqual(2, mock_connect.call_count)
+
+    def test_max_idle_time(self, mock_connect):
+        mock_connect.side_effect = lambda params: get_mock_connection()
+        pool = DatabaseConnectionPool(max_idle_time=-1)
+
+        conn = pool.acquire(self.params)
+        pool.release(self.params, conn)
+
+        self.assertIsNot(conn, pool.acquire(self.params))
+        conn.close.assert_called_once_with()
+        self.assertEqual(0, len(pool))
+
+    def test_health_check(self, mock_connect):
+        mock_connect.side_effect = lambda params: get_mock_connection()
+        pool = DatabaseConnectionPool(health_check_interval=-1)
+
+        conn = pool.acquire(self.params)
+        pool.release(self.params, conn)
+        conn.cursor.side_effect = psycopg2.OperationalError('server closed the connection unexpectedly')
+
+        self.assertIsNot(conn, pool.acquire(self.params))
+        conn.close.assert_called_once_with()
+
+    def test_release_failed_transaction(self, mock_connect):
+        conn = get_mock_connection()
+        conn.get_transaction_status.return_value = TRANSACTION_STATUS_INERROR
+        mock_connect.return_value = conn
+        pool = DatabaseConnectionPool()
+
+        pool.release(self.params, pool.acquire(self.params))
+
+        conn.close.assert_called_once_with()
+        self.assertEqual(0, len(pool))
+
+    def test_max_size(self, mock_connect):
+        mock_connect.side_effect = lambda params: get_mock_connection()
+        pool = DatabaseConnectionPool(max_size=1)
+
+        first = pool.acquire(self.params)
+        second = pool.acquire(self.params)
+        pool.release(self.params, first)
+        pool.release(self.params, second)
+
+        self.assertEqual(1, len(pool))
+        first.close.assert_not_called()
+        second.close.assert_called_once_with()
+
+        pool.close()
+        self.assertEqual(0, len(pool))
+        first.close.assert_called_once_with()
+
+    def test_database_interactions(self, mock_connect):
+        mock_connect.side_effect = lambda params: get_mock_connection()
+        pool = DatabaseConnectionPool()
+
+        with DatabaseInteractions(config=self.params, schema_base_path=TESTDATA_DIR, logger=self.test_logger,
+                                  pool=pool) as db:
+            conn = db._conn
+        conn.commit.assert_called_once_with()
+        conn.close.assert_not_called()
+
+        with DatabaseInteractions(config=self.params, schema_base_path=TESTDATA_DIR, logger=self.test_logger,
+                                  pool=pool) as db:
+            self.assertIs(conn, db._conn)
+        self.assertEqual(1, mock_connect.call_count)
+
+    def test_get_connection_pool(self, mock_connect):
+        pool = get_connection_pool()
+        self.assertIs(pool, get_connection_pool())
+
+        # a forked child process must not reuse the connections of its parent
+        with patch('aodncore.pipeline.db.os.getpid', return_value=-1):
+            self.assertIsNot(pool, get_connection_pool())
+
+
+@patch('aodncore.pipeline.db.DatabaseInteractions._DatabaseInteractions__query')
+class TestDatabaseInteractionsExtents(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.db = DatabaseInteractions(config={}, schema_base_path=TESTDATA_DIR, logger=self.test_logger)
+
+    def test_prefetch_extents(self, mock_query):
+        mock_query.return_value = {'e0_min': '2000', 'e0_max': '2001', 'e1_min': 0, 'e1_max': 10, 'e2_min': 1,
+                                   'e2_max': 2}
+        metadata_updates = [
+            {'temporal': {'table': 'a_table', 'column': 'time'}, 'vertical': {'table': 'a_table', 'column': 'depth'}},
+            {'vertical': {'table': 'a_table', 'column': 'height'}}
+        ]
+
+        self.db.prefetch_extents(metadata_updates)
+
+        # all extents of the table are retrieved with a single scan
+        mock_query.assert_called_once()
+        query = mock_query.call_args[0][0]
+        self.assertIn('MIN("time")', query)
+        self.assertIn('MAX("height") AS e2_max', query)
+        self.assertNotIn('WHERE', query)
+
+        self.assertEqual({'min_value': '2000', 'max_value': '2001'}, self.db.get_temporal_extent('a_table', 'time'))
+        self.assertEqual({'min_value': 1, 'max_value': 2}, self.db.get_vertical_extent('a_table', 'height'))
+        mock_query.assert_called_once()
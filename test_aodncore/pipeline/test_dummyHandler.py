@@ -129,6 +129,45 @@ class TestDummyHandler(HandlerTestCase):
         nonexistent_file = get_nonexistent_path()
         self.run_handler_with_exception(InvalidInputFileError, nonexistent_file, dest_path_function=dest_path_testing)
 
+    def test_metrics(self):
+        handler = self.run_handler(self.temp_nc_file)
+
+        expected_transitions = ['initialise', 'resolve', 'preprocess', 'check', 'process', 'publish', 'postprocess',
+                                'notify_success', 'complete_success']
+        self.assertListEqual(expected_transitions, list(handler.metrics['transitions'].keys()))
+
+        resolve_metrics = handler.metrics['transitions']['resolve']
+        self.assertCountEqual(['wall_time', 'cpu_time', 'max_rss_delta', 'read_bytes', 'write_bytes'],
+                              resolve_metrics.keys())
+        self.assertGreaterEqual(resolve_metrics['wall_time'], 0)
+        self.assertGreaterEqual(resolve_metrics['cpu_time'], 0)
+
+        self.assertIn('upload', handler.metrics['storage'])
+        upload_stats = handler.metrics['storage']['upload']
+        self.assertEqual('LocalFileStorageBroker', upload_stats['broker_type'])
+        self.assertEqual(1, upload_stats['operations']['upload']['count'])
+
+    def test_metrics_error(self):
+        handler = self.run_handler_with_exception(InvalidFileFormatError, self.temp_nc_file,
+                                                  allowed_extensions=['.pdf'])
+        self.assertListEqual(['initialise', 'notify_error', 'complete_with_errors'],
+                             list(handler.metrics['transitions'].keys()))
+
+    @patch('aodncore.pipeline.handlerbase.get_metrics_sink')
+    def test_metrics_export(self, mock_get_metrics_sink):
+        handler = self.run_handler(self.temp_nc_file)
+
+        mock_sink = mock_get_metrics_sink.return_value
+        mock_sink.write.assert_called_once_with('NO_PIPELINE', handler.metrics,
+                                                {'handler': 'DummyHandler', 'pipeline': 'NO_PIPELINE',
+                                                 'result': 'SUCCESS'})
+
+    @patch('aodncore.pipeline.handlerbase.get_metrics_sink')
+    def test_metrics_export_failure(self, mock_get_metrics_sink):
+        mock_get_metrics_sink.return_value.write.side_effect = IOError('mock write failure')
+        handler = self.run_handler(self.temp_nc_file)
+        self.assertEqual(HandlerResult.SUCCESS, handler.result)
+
     def test_run_handler_twice(self):
         handler = self.run_handler(self.temp_nc_file)
         with self.assertRaises(HandlerAlreadyRunError):
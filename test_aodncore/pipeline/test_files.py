@@ -869,6 +869,36 @@ class TestPipelineFileCollection(BaseTestCase):
         self.assertSequenceEqual(fileobj1_keys, table_headers)
         self.assertSequenceEqual(fileobj2_keys, table_headers)
 
+    def test_get_table_data_attributes(self):
+        fileobj1 = PipelineFile(get_nonexistent_path(), is_deletion=True)
+        fileobj2 = PipelineFile(get_nonexistent_path(), is_deletion=True)
+        self.collection.update((fileobj1, fileobj2))
+
+        table_headers, table_data = self.collection.get_table_data(('name', 'published'))
+        self.assertListEqual(['name', 'published'], table_headers)
+        self.assertListEqual([OrderedDict([('name', fileobj1.name), ('published', fileobj1.published)]),
+                              OrderedDict([('name', fileobj2.name), ('published', fileobj2.published)])],
+                             table_data)
+
+    def test_get_attribute_table(self):
+        fileobj1 = PipelineFile(get_nonexistent_path(), is_deletion=True)
+        fileobj2 = PipelineFile(get_nonexistent_path(), is_deletion=True)
+        self.collection.update((fileobj1, fileobj2))
+
+        columns, rows = self.collection.get_attribute_table(('name', 'is_deletion'))
+        self.assertListEqual(['name', 'is_deletion'], columns)
+        self.assertListEqual([(fileobj1.name, True), (fileobj2.name, True)], rows)
+
+        columns, rows = self.collection.get_attribute_table(('name',))
+        self.assertListEqual([(fileobj1.name,), (fileobj2.name,)], rows)
+
+        columns, rows = self.collection.get_attribute_table()
+        self.assertListEqual([k for k, _ in fileobj1], columns)
+        self.assertTupleEqual(tuple(v for _, v in fileobj2), rows[1])
+
+    def test_get_attribute_table_empty(self):
+        self.assertTupleEqual(([], []), self.collection.get_attribute_table())
+
     def test_get_table_data_empty(self):
         table_headers, table_data = self.collection.get_table_data()
         self.assertListEqual([], table_headers)
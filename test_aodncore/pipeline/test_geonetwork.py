@@ -130,6 +130,70 @@ class TestGeonetwork(BaseTestCase):
             gn.update_record(None, None)
 
 
+@patch('aodncore.pipeline.geonetwork.requests.Session.post')
+class TestGeonetworkBatch(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        with open(GOOD_XML, encoding='utf-8') as xml:
+            self.xml_text = xml.read()
+
+    def get_handler(self, uuid, conn):
+        metadata = {'uuid': uuid, 'vertical': {'table': 'a_table', 'column': 'depth'}}
+        return GeonetworkMetadataHandler(conn, None, metadata, self.test_logger)
+
+    def test_session_adapter(self, mock_post):
+        gn = Geonetwork(TEST_BASE_URL, USERNAME, PASSWORD, pool_size=2, max_retries=5)
+
+        adapter = gn.session.get_adapter(TEST_BASE_URL)
+        self.assertEqual(5, adapter.max_retries.total)
+        self.assertIn(503, adapter.max_retries.status_forcelist)
+        self.assertEqual(2, adapter._pool_maxsize)
+
+    def test_get_records(self, mock_post):
+        gn = Geonetwork(TEST_BASE_URL, USERNAME, PASSWORD)
+
+        def get_record(uuid):
+            if uuid == 'bad':
+                raise GeonetworkConnectionError('connection failed')
+            return 'xml for {}'.format(uuid)
+
+        with patch.object(gn, 'get_record', side_effect=get_record):
+            records = gn.get_records(['first', 'bad', 'second'])
+
+        self.assertListEqual(['first', 'bad', 'second'], list(records))
+        self.assertEqual(('xml for first', None), records['first'])
+        self.assertIsInstance(records['bad'][1], GeonetworkConnectionError)
+
+    def test_run_metadata_handlers(self, mock_post):
+        gn = Geonetwork(TEST_BASE_URL, USERNAME, PASSWORD)
+        mock_conn = Mock()
+        mock_conn.get_vertical_extent.return_value = {'min_value': 0, 'max_value': 1}
+        handlers = [self.get_handler('first', mock_conn), self.get_handler('not_found', mock_conn),
+                    self.get_handler('bad_update', mock_conn), GeonetworkMetadataHandler(None, None, {}, None)]
+
+        def get_record(uuid):
+            if uuid == 'not_found':
+                raise GeonetworkRequestError('404 Client Error')
+            return self.xml_text
+
+        def update_record(uuid, changes):
+            if uuid == 'bad_update':
+                raise GeonetworkRequestError('500 Server Error')
+
+        with patch.object(gn, 'get_record', side_effect=get_record), \
+                patch.object(gn, 'update_record', side_effect=update_record) as mock_update:
+            results = gn.run_metadata_handlers(handlers, max_workers=2)
+
+        self.assertListEqual(['first', 'not_found', 'bad_update'], [r.uuid for r in results])
+        self.assertIsNone(results[0].error)
+        self.assertIsInstance(results[1].error, GeonetworkRequestError)
+        self.assertIsInstance(results[2].error, GeonetworkRequestError)
+
+        # the extents are only collected for records which were retrieved
+        self.assertEqual(2, mock_conn.get_vertical_extent.call_count)
+        self.assertSetEqual({'first', 'bad_update'}, {c[1][0] for c in mock_update.mock_calls})
+
+
 class TestGeonetworkMetadataHandler(BaseTestCase):
     def test_metadata_handler(self):
         with self.assertNoException():
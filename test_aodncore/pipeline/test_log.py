@@ -0,0 +1,133 @@
+import logging
+import logging.config
+import os
+
+from aodncore.pipeline.log import (BufferedQueueHandler, WorkerLoggingConfigBuilder, flush_logger,
+                                   get_queued_handler_config, get_watchservice_logging_config)
+from aodncore.testlib import BaseTestCase
+
+
+class TestBufferedQueueHandler(BaseTestCase):
+    def setUp(self):
+        self.log_file = os.path.join(self.temp_dir, 'queued.log')
+        self.target_config = {'class': 'logging.FileHandler', 'filename': self.log_file, 'delay': True}
+
+        self.logger = logging.getLogger('unittest.queued')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+
+    def tearDown(self):
+        for handler in list(self.logger.handlers):
+            self.logger.removeHandler(handler)
+            handler.close()
+        super().tearDown()
+
+    def _read_log(self):
+        with open(self.log_file) as f:
+            return f.read().splitlines()
+
+    def test_invalid_overflow_policy(self):
+        with self.assertRaises(ValueError):
+            BufferedQueueHandler(self.target_config, overflow_policy='invalid')
+
+    def test_flush(self):
+        handler = BufferedQueueHandler(self.target_config)
+        handler.setFormatter(logging.Formatter('%(levelname)s %(message)s'))
+        self.logger.addHandler(handler)
+
+        for i in range(100):
+            self.logger.info("message %d", i)
+        flush_logger(logging.LoggerAdapter(self.logger, {}))
+
+        lines = self._read_log()
+        self.assertEqual(100, len(lines))
+        self.assertEqual('INFO message 0', lines[0])
+        self.assertEqual('INFO message 99', lines[-1])
+
+    def test_drop_new(self):
+        handler = BufferedQueueHandler(self.target_config, max_queue_size=1, overflow_policy='drop_new')
+        self.logger.addHandler(handler)
+
+        # stop the listener so that the queue cannot drain
+        handler._listener.stop()
+        handler._listener = None
+
+        self.logger.info('first')
+        self.logger.info('second')
+        self.logger.info('third')
+        self.assertEqual(2, handler.dropped_count)
+        self.assertEqual('first', handler.queue.get_nowait().getMessage())
+
+        handler.flush()
+        self.assertEqual(0, handler.dropped_count)
+        self.assertIn('2 log records dropped', self._read_log()[-1])
+
+    def test_drop_oldest(self):
+        handler = BufferedQueueHandler(self.target_config, max_queue_size=1, overflow_policy='drop_oldest')
+        self.logger.addHandler(handler)
+
+        handler._listener.stop()
+        handler._listener = None
+
+        self.logger.info('first')
+        self.logger.info('second')
+        self.logger.info('third')
+        self.assertEqual(2, handler.dropped_count)
+        self.assertEqual('third', handler.queue.get_nowait().getMessage())
+
+    def test_drop_oldest_preserves_sentinel(self):
+        handler = BufferedQueueHandler(self.target_config, max_queue_size=1, overflow_policy='drop_oldest')
+        self.logger.addHandler(handler)
+
+        listener = handler._listener
+        listener.stop()
+        handler._listener = None
+
+        # simulate a record being logged while the listener is stopping and the queue is full
+        listener.enqueue_sentinel()
+        self.logger.info('first')
+        self.assertEqual(1, handler.dropped_count)
+        self.assertIs(listener._sentinel, handler.queue.get_nowait())
+
+
+class TestQueuedLoggingConfig(BaseTestCase):
+    def setUp(self):
+        self.pipeline_config = dict(self.config.pipeline_config)
+        self.pipeline_config['logging'] = dict(self.config.pipeline_config['logging'],
+                                               queue={'max_size': 100, 'overflow_policy': 'drop_new'})
+
+    def test_get_queued_handler_config(self):
+        handler_config = {'class': 'logging.StreamHandler', 'formatter': 'dummy_formatter', 'level': 'INFO'}
+        queued_handler_config = get_queued_handler_config(handler_config, {'max_size': 5})
+
+        expected = {
+            '()': BufferedQueueHandler,
+            'formatter': 'dummy_formatter',
+            'handler': {'class': 'logging.StreamHandler'},
+            'level': 'INFO',
+            'max_queue_size': 5,
+            'overflow_policy': 'block'
+        }
+        self.assertDictEqual(expected, queued_handler_config)
+
+    def test_worker_logging_config(self):
+        worker_logging_config = WorkerLoggingConfigBuilder(self.pipeline_config).add_watch_config('UNITTEST').build()
+        handler_config = worker_logging_config['handlers']['UNITTEST_handler']
+
+        self.assertIs(BufferedQueueHandler, handler_config['()'])
+        self.assertEqual('logging.FileHandler', handler_config['handler']['class'])
+
+        logging.config.dictConfig(worker_logging_config)
+        handler = logging.getLogger('UNITTEST').handlers[0]
+        self.assertIsInstance(handler, BufferedQueueHandler)
+        self.assertIsInstance(handler.handler, logging.FileHandler)
+        self.assertEqual('drop_new', handler.overflow_policy)
+        handler.close()
+
+    def test_watchservice_logging_config(self):
+        watchservice_logging_config = get_watchservice_logging_config(self.pipeline_config)
+        handler_config = watchservice_logging_config['handlers']['watchservice_handler']
+
+        self.assertIs(BufferedQueueHandler, handler_config['()'])
+        self.assertEqual('logging.StreamHandler', handler_config['handler']['class'])
+        self.assertEqual(100, handler_config['max_queue_size'])
@@ -0,0 +1,85 @@
+import os
+import time
+
+from aodncore.pipeline.exceptions import InvalidConfigError
+from aodncore.pipeline.metrics import (PrometheusTextfileMetricsSink, TransitionMetricsRecorder, get_metrics_sink,
+                                       get_resource_usage)
+from aodncore.testlib import BaseTestCase
+
+
+class TestPipelineMetrics(BaseTestCase):
+    def test_get_resource_usage(self):
+        usage = get_resource_usage()
+        self.assertCountEqual(['wall_time', 'cpu_time', 'max_rss', 'read_bytes', 'write_bytes'], usage.keys())
+        self.assertGreater(usage['max_rss'], 0)
+
+    def test_transition_metrics_recorder(self):
+        recorder = TransitionMetricsRecorder()
+        with recorder.measure('first'):
+            time.sleep(0.01)
+
+        with self.assertRaises(RuntimeError):
+            with recorder.measure('second'):
+                raise RuntimeError('mock error')
+
+        self.assertListEqual(['first', 'second'], list(recorder.transitions.keys()))
+        self.assertGreaterEqual(recorder.transitions['first']['wall_time'], 0.01)
+        self.assertGreaterEqual(recorder.transitions['first']['max_rss_delta'], 0)
+
+    def test_get_metrics_sink(self):
+        self.assertIsNone(get_metrics_sink(None))
+
+        sink = get_metrics_sink({'textfile_dir': self.temp_dir})
+        self.assertIsInstance(sink, PrometheusTextfileMetricsSink)
+        self.assertEqual(self.temp_dir, sink.textfile_dir)
+
+        sink = get_metrics_sink({'sink': 'aodncore.pipeline.metrics.PrometheusTextfileMetricsSink',
+                                 'textfile_dir': self.temp_dir, 'prefix': 'unittest'})
+        self.assertEqual('unittest', sink.prefix)
+
+        with self.assertRaises(InvalidConfigError):
+            get_metrics_sink({'sink': 'aodncore.pipeline.metrics.NonExistentSink'})
+
+        with self.assertRaises(TypeError):
+            get_metrics_sink({'sink': 'aodncore.pipeline.metrics.TransitionMetricsRecorder'})
+
+
+class TestPrometheusTextfileMetricsSink(BaseTestCase):
+    def setUp(self):
+        self.sink = PrometheusTextfileMetricsSink(self.temp_dir)
+        self.metrics = {
+            'transitions': {
+                'resolve': {'wall_time': 1.5, 'cpu_time': 0.5, 'max_rss_delta': 1024, 'read_bytes': 10,
+                            'write_bytes': None}
+            }
+        }
+        self.metrics['storage'] = {
+            'upload': {
+                'broker_type': 'LocalFileStorageBroker',
+                'prefix': '/upload',
+                'operations': {
+                    'upload': {'count': 2, 'errors': 0, 'bytes': 2048, 'duration': 0.5, 'retries': 1}
+                }
+            }
+        }
+        self.labels = {'pipeline': 'UNITTEST', 'result': 'SUCCESS'}
+
+    def test_render(self):
+        lines = self.sink.render(self.metrics, self.labels).splitlines()
+
+        self.assertIn('# TYPE aodncore_handler_transition_wall_seconds gauge', lines)
+        self.assertIn('aodncore_handler_transition_wall_seconds'
+                      '{pipeline="UNITTEST",result="SUCCESS",transition="resolve"} 1.5', lines)
+        self.assertIn('aodncore_handler_transition_max_rss_delta_bytes'
+                      '{pipeline="UNITTEST",result="SUCCESS",transition="resolve"} 1024', lines)
+        self.assertFalse(any(l.startswith('aodncore_handler_transition_write_bytes{') for l in lines))
+
+        self.assertIn('aodncore_handler_storage_bytes{broker_type="LocalFileStorageBroker",operation="upload",'
+                      'pipeline="UNITTEST",prefix="/upload",result="SUCCESS",store="upload"} 2048', lines)
+
+    def test_write(self):
+        self.sink.write('UNITTEST/PIPELINE', self.metrics, self.labels)
+
+        self.assertListEqual(['aodncore_handler_transition_UNITTEST_PIPELINE.prom'], os.listdir(self.temp_dir))
+        with open(os.path.join(self.temp_dir, 'aodncore_handler_transition_UNITTEST_PIPELINE.prom')) as f:
+            self.assertEqual(self.sink.render(self.metrics, self.labels), f.read())
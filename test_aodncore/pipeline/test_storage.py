@@ -17,7 +17,7 @@ from aodncore.pipeline.files import (PipelineFile, PipelineFileCollection, Remot
                                      RemotePipelineFileCollection)
 from aodncore.pipeline.storage import (get_storage_broker, sftp_path_exists, sftp_makedirs, sftp_mkdir_p,
                                        validate_storage_broker, LocalFileStorageBroker, S3StorageBroker,
-                                       SftpStorageBroker)
+                                       SftpStorageBroker, StorageTransferStats)
 from aodncore.testlib import BaseTestCase, NullStorageBroker, get_nonexistent_path
 from aodncore.util import TemporaryDirectory, list_regular_files
 from test_aodncore import TESTDATA_DIR
@@ -206,7 +206,67 @@ class TestPipelineStorage(BaseTestCase):
         validate_storage_broker(broker)
 
 
+class TestStorageTransferStats(BaseTestCase):
+    def test_record(self):
+        stats = StorageTransferStats()
+        stats.record('upload', 0.05, size=2048)
+        stats.record('upload', 2, size=512, retries=2, error=True)
+        stats.record('delete', 0.001)
+
+        snapshot = stats.as_dict()
+        self.assertListEqual(['upload', 'delete'], list(snapshot.keys()))
+
+        upload_stats = snapshot['upload']
+        self.assertEqual(2, upload_stats['count'])
+        self.assertEqual(1, upload_stats['errors'])
+        self.assertEqual(2560, upload_stats['bytes'])
+        self.assertAlmostEqual(2.05, upload_stats['duration'])
+        self.assertEqual(2, upload_stats['retries'])
+        self.assertEqual(1, upload_stats['duration_histogram'][0.1])
+        self.assertEqual(1, upload_stats['duration_histogram'][5])
+        self.assertEqual(1, upload_stats['size_histogram'][2 ** 10])
+        self.assertEqual(1, upload_stats['size_histogram'][2 ** 20])
+
+        self.assertEqual(0, snapshot['delete']['bytes'])
+        self.assertEqual(0, sum(snapshot['delete']['size_histogram'].values()))
+
+        # snapshot is not affected by subsequent records
+        stats.record('upload', 0.05, size=2048)
+        self.assertEqual(2, upload_stats['count'])
+        self.assertEqual(1, upload_stats['duration_histogram'][0.1])
+
+    def test_measure(self):
+        stats = StorageTransferStats()
+        with stats.measure('download') as measurement:
+            stats.record_attempt()
+            stats.record_attempt()
+            measurement.size = 100
+
+        with self.assertRaises(ValueError):
+            with stats.measure('download'):
+                raise ValueError('mock failure')
+
+        download_stats = stats.as_dict()['download']
+        self.assertEqual(2, download_stats['count'])
+        self.assertEqual(1, download_stats['errors'])
+        self.assertEqual(100, download_stats['bytes'])
+        self.assertEqual(1, download_stats['retries'])
+
+
 class TestBaseStorageBroker(BaseTestCase):
+    def test_stats(self):
+        broker = NullStorageBroker('/null/prefix')
+        broker.upload(get_upload_collection())
+        broker.delete(get_upload_collection(delete=True))
+
+        stats = broker.stats
+        self.assertEqual('NullStorageBroker', stats['broker_type'])
+        self.assertEqual('/null/prefix', stats['prefix'])
+        self.assertEqual(4, stats['operations']['upload']['count'])
+        self.assertEqual(4, stats['operations']['delete']['count'])
+        self.assertEqual(sum(os.path.getsize(f.src_path) for f in get_upload_collection()),
+                         stats['operations']['upload']['bytes'])
+
     def test_delete_fail(self):
         collection = get_upload_collection(delete=True)
         broker = NullStorageBroker("/", fail=True)
@@ -244,6 +304,29 @@ class TestBaseStorageBroker(BaseTestCase):
         with self.assertRaises(StorageBrokerError):
             broker.query('')
 
+    def test_check_health(self):
+        broker = NullStorageBroker(get_nonexistent_path())
+        with patch.object(broker, '_check_health') as mock_check_health:
+            broker.check_health()
+            broker.check_health()
+        mock_check_health.assert_called_once_with()
+
+    def test_check_health_no_cache(self):
+        broker = NullStorageBroker(get_nonexistent_path())
+        with patch.object(broker, '_check_health') as mock_check_health:
+            broker.check_health(ttl=0)
+            broker.check_health(ttl=0)
+        self.assertEqual(mock_check_health.call_count, 2)
+
+    def test_check_health_fail(self):
+        broker = NullStorageBroker(get_nonexistent_path())
+        with patch.object(broker, '_check_health', side_effect=RuntimeError()) as mock_check_health:
+            with self.assertRaises(StorageBrokerError):
+                broker.check_health()
+            with self.assertRaises(StorageBrokerError):
+                broker.check_health()
+        self.assertEqual(mock_check_health.call_count, 2)
+
     def test_set_is_overwrite_with_unset_file(self):
         collection = get_upload_collection()
 
@@ -397,6 +480,25 @@ class TestLocalFileStorageBroker(BaseTestCase):
 
         self.assertEqual(expected_remaining, remaining_files)
 
+    def test_delete_regexes_narrowed_query(self):
+        with patch.object(self.test_broker, '_run_query', wraps=self.test_broker._run_query) as mock_run_query:
+            deleted_files = self.test_broker.delete_regexes([r'^dummy\.input_file\.[0-9a-f\-]{36}$'])
+        mock_run_query.assert_called_once_with('dummy.input_file.')
+        self.assertListEqual(['dummy.input_file.40c4ec0d-c9db-498d-84f9-01011330086e'],
+                             deleted_files.get_attribute_list('dest_path'))
+
+        with patch.object(self.test_broker, '_run_query', wraps=self.test_broker._run_query) as mock_run_query:
+            self.test_broker.delete_regexes([r'^subdirectory/targetfile\.ico$', r'^/absolute/path$'])
+        mock_run_query.assert_called_once_with('')
+
+        remaining_files = self.test_broker.query()
+        expected_remaining = RemotePipelineFileCollection([
+            RemotePipelineFile('subdirectory/targetfile.unknown_file_extension'),
+            RemotePipelineFile('subdirectory/targetfile.nc'),
+            RemotePipelineFile('subdirectory/targetfile.png')
+        ])
+        self.assertEqual(expected_remaining, remaining_files)
+
     def test_delete_regexes_with_allow_match_all(self):
         all_files = self.test_broker.query()
         expected = RemotePipelineFileCollection([
@@ -487,6 +589,15 @@ class TestLocalFileStorageBroker(BaseTestCase):
 
         self.assertEqual(result, RemotePipelineFileCollection())
 
+    def test_check_health(self):
+        with self.assertNoException():
+            LocalFileStorageBroker(get_nonexistent_path()).check_health(ttl=0)
+
+    def test_check_health_not_a_directory(self):
+        broker = LocalFileStorageBroker(self.temp_nc_file)
+        with self.assertRaises(StorageBrokerError):
+            broker.check_health(ttl=0)
+
     def test_query_error(self):
         with TemporaryDirectory() as d:
             subdir = os.path.join(d, 'subdir')
@@ -523,6 +634,36 @@ class TestS3StorageBroker(BaseTestCase):
 
         s3_storage_broker.s3_client.head_bucket.assert_called_with(Bucket=dummy_bucket)
 
+    @patch('aodncore.pipeline.storage.boto3')
+    def test_stats_retries(self, mock_boto3):
+        collection = get_upload_collection()
+        netcdf_file = collection[0]
+
+        s3_storage_broker = S3StorageBroker(str(uuid4()), str(uuid4()))
+        dummy_error = ClientError({'Error': {'Code': 'ServiceUnavailable'}}, 'PutObject')
+        s3_storage_broker.s3_client.upload_fileobj.side_effect = [dummy_error, None]
+
+        with patch('aodncore.util.external.retry.api.time.sleep', new=lambda x: None):
+            s3_storage_broker.upload(netcdf_file)
+
+        upload_stats = s3_storage_broker.stats['operations']['upload']
+        self.assertEqual(1, upload_stats['count'])
+        self.assertEqual(0, upload_stats['errors'])
+        self.assertEqual(1, upload_stats['retries'])
+        self.assertEqual(os.path.getsize(netcdf_file.src_path), upload_stats['bytes'])
+
+    @patch('aodncore.pipeline.storage.boto3')
+    def test_check_health(self, mock_boto3):
+        dummy_bucket = str(uuid4())
+        dummy_prefix = str(uuid4())
+        s3_storage_broker = S3StorageBroker(dummy_bucket, dummy_prefix)
+
+        s3_storage_broker.check_health()
+        s3_storage_broker.check_health()
+
+        s3_storage_broker.s3_client.head_bucket.assert_called_once_with(Bucket=dummy_bucket)
+        s3_storage_broker.s3_client.list_objects_v2.assert_not_called()
+
     @patch('aodncore.pipeline.storage.boto3')
     def test_set_is_overwrite_not_present_s3(self, mock_boto3):
         collection = get_upload_collection()
@@ -1,15 +1,18 @@
 import logging
 import os
 import stat
-from unittest.mock import MagicMock
+from unittest.mock import ANY, MagicMock, patch
+
+from celery.signals import worker_process_shutdown
 
 from aodncore.pipeline import PipelineFile, PipelineFileCollection
 from aodncore.pipeline.log import get_pipeline_logger
-from aodncore.pipeline.watch import (delete_same_name_from_error_store_callback,
+from aodncore.pipeline.watch import (configure_worker_logging, delete_same_name_from_error_store_callback,
                                      delete_custom_regexes_from_error_store_callback, get_task_name, CeleryConfig,
-                                     ExitPolicy, IncomingFileStateManager)
+                                     ExitPolicy, IncomingFileEventHandler, IncomingFileStateManager, TaskRoute,
+                                     TaskRouter, WatchServiceManager)
 from aodncore.testlib import BaseTestCase
-from aodncore.util import safe_copy_file
+from aodncore.util import mkdir_p, safe_copy_file
 from test_aodncore import TESTDATA_DIR
 
 GOOD_NC = os.path.join(TESTDATA_DIR, 'good.nc')
@@ -79,6 +82,25 @@ class TestPipelineWatch(BaseTestCase):
         self.assertCountEqual(expected_error_files_after_cleanup, actual_error_files_after_cleanup)
 
 
+class TestConfigureWorkerLogging(BaseTestCase):
+    @patch('aodncore.pipeline.watch.logging.config.dictConfig')
+    def test_configure_worker_logging(self, mock_dictconfig):
+        self.assertTrue(configure_worker_logging(self.config, 'tasks.ANMN_QLD_XXXX'))
+        self.assertFalse(configure_worker_logging(self.config, 'tasks.ANMN_QLD_XXXX'))
+        self.assertEqual(1, mock_dictconfig.call_count)
+
+        self.assertTrue(configure_worker_logging(self.config, 'tasks.SOOP_DU_JOUR'))
+        self.assertTrue(configure_worker_logging(self.config, 'tasks.ANMN_QLD_XXXX'))
+        self.assertEqual(3, mock_dictconfig.call_count)
+
+
+class TestFlushEmailDeliveryQueueOnShutdown(BaseTestCase):
+    @patch('aodncore.pipeline.watch.flush_email_delivery_queue')
+    def test_worker_process_shutdown(self, mock_flush_email_delivery_queue):
+        worker_process_shutdown.send(sender=None, pid=os.getpid(), exitcode=0)
+        mock_flush_email_delivery_queue.assert_called_once_with(retry_now=True)
+
+
 class TestCeleryConfig(BaseTestCase):
     def test_init(self):
         celeryconfig = CeleryConfig()
@@ -88,6 +110,11 @@ class TestCeleryConfig(BaseTestCase):
         routes = {'/some/directory': 'UNITTEST'}
         celeryconfig = CeleryConfig(routes)
         self.assertIs(celeryconfig.task_routes, routes)
+        self.assertFalse(hasattr(celeryconfig, 'task_queue_max_priority'))
+
+    def test_init_queue_max_priority(self):
+        celeryconfig = CeleryConfig(queue_max_priority=9)
+        self.assertEqual(celeryconfig.task_queue_max_priority, 9)
 
 
 class TestCeleryManager(BaseTestCase):
@@ -193,11 +220,149 @@ class TestIncomingFileStateManager(BaseTestCase):
         self.assertCountEqual(expected_error_files_after_cleanup, actual_error_files_after_cleanup)
 
 
-class TestIncomingFileEventHandler(BaseTestCase):
-    # TODO: write tests
-    pass
+class TestTaskRouter(BaseTestCase):
+    def setUp(self):
+        self.routing_config = {
+            'default_priority': 5,
+            'lanes': [
+                {'name': 'realtime', 'priority': 9, 'regexes': [r'.*_RT_.*']},
+                {'name': 'large', 'priority': 1, 'min_size': 1024}
+            ],
+            'starvation_limit': 2
+        }
+        self.router = TaskRouter(self.routing_config)
+
+        self.small_file = os.path.join(self.temp_dir, 'IMOS_RT_small.nc')
+        self.large_file = os.path.join(self.temp_dir, 'IMOS_large.nc')
+        self.default_file = os.path.join(self.temp_dir, 'IMOS_default.nc')
+        for path, size in ((self.small_file, 10), (self.large_file, 2048), (self.default_file, 10)):
+            with open(path, 'wb') as f:
+                f.write(b'0' * size)
+
+    def test_route(self):
+        self.assertEqual(TaskRoute('realtime', 9, 10, 'lane match'), self.router.route('UNITTEST', self.small_file))
+        self.assertEqual(TaskRoute('large', 1, 2048, 'lane match'), self.router.route('UNITTEST', self.large_file))
+        self.assertEqual(TaskRoute('default', 5, 10, 'default'), self.router.route('UNITTEST', self.default_file))
+
+        missing_route = self.router.route('UNITTEST', os.path.join(self.temp_dir, 'missing.nc'))
+        self.assertEqual(TaskRoute('default', 5, 0, 'default'), missing_route)
+
+    def test_route_starvation_guard(self):
+        self.assertEqual(1, self.router.route('UNITTEST', self.large_file).priority)
+
+        # tasks for a different queue do not count towards the limit
+        for _ in range(3):
+            self.assertEqual(9, self.router.route('OTHER', self.small_file).priority)
+
+        self.assertEqual(9, self.router.route('UNITTEST', self.small_file).priority)
+        self.assertEqual(5, self.router.route('UNITTEST', self.default_file).priority)
+
+        promoted_route = self.router.route('UNITTEST', self.large_file)
+        self.assertEqual('large', promoted_route.lane)
+        self.assertEqual(9, promoted_route.priority)
+        self.assertTrue(promoted_route.reason.startswith('starvation guard'))
+
+        self.assertEqual(1, self.router.route('UNITTEST', self.large_file).priority)
+
+    def test_route_dedicated_queue(self):
+        self.routing_config['lanes'][1]['dedicated_queue'] = True
+        router = TaskRouter(self.routing_config)
+
+        self.assertEqual('UNITTEST.large', router.get_lane_queue('UNITTEST', 'large'))
+        self.assertEqual('UNITTEST', router.get_lane_queue('UNITTEST', 'realtime'))
+        self.assertEqual('UNITTEST', router.get_lane_queue('UNITTEST', 'default'))
+
+        # a lane with a dedicated queue is not competing with the other lanes, so is never outpaced by them
+        self.assertEqual(1, router.route('UNITTEST', self.large_file).priority)
+        for _ in range(3):
+            self.assertEqual(9, router.route('UNITTEST', self.small_file).priority)
+        self.assertEqual(TaskRoute('large', 1, 2048, 'lane match'), router.route('UNITTEST', self.large_file))
 
 
-class TestInotifyManager(BaseTestCase):
-    # TODO: write tests
-    pass
+class TestIncomingFileEventHandler(BaseTestCase):
+    def setUp(self):
+        self.config.__dict__['celery_application'] = MagicMock()
+        self.event_handler = IncomingFileEventHandler(self.config)
+        self.directory = next(iter(self.config.watch_directory_map))
+        mkdir_p(self.directory)
+        self.pathname = os.path.join(self.directory, 'incoming.nc')
+        safe_copy_file(self.temp_nc_file, self.pathname)
+
+    def test_queue_task(self):
+        self.assertTrue(self.event_handler.queue_task(self.directory, self.pathname))
+        self.assertTrue(self.event_handler.queue_task(self.directory, self.pathname))
+        self.assertEqual(self.config.celery_application.send_task.call_count, 2)
+
+    def test_queue_task_routing(self):
+        self.config.pipeline_config['watch']['routing'] = {'default_priority': 3}
+        event_handler = IncomingFileEventHandler(self.config)
+
+        self.assertTrue(event_handler.queue_task(self.directory, self.pathname))
+        self.config.celery_application.send_task.assert_called_once_with(ANY, args=[self.pathname], priority=3)
+
+    def test_queue_task_routing_dedicated_queue(self):
+        self.config.pipeline_config['watch']['routing'] = {
+            'lanes': [{'name': 'bulk', 'priority': 1, 'dedicated_queue': True}]
+        }
+        event_handler = IncomingFileEventHandler(self.config)
+        lane_queue = "{queue}.bulk".format(queue=self.config.watch_directory_map[self.directory])
+
+        self.assertTrue(event_handler.queue_task(self.directory, self.pathname))
+        self.config.celery_application.send_task.assert_called_once_with(ANY, args=[self.pathname], priority=1,
+                                                                         queue=lane_queue, routing_key=lane_queue)
+
+    def test_queue_task_ignored(self):
+        self.assertFalse(self.event_handler.queue_task(self.directory, os.path.join(self.directory, 'missing.nc')))
+        self.config.celery_application.send_task.assert_not_called()
+
+    def test_queue_task_deduplication(self):
+        self.event_handler.start_deduplication()
+        self.assertTrue(self.event_handler.queue_task(self.directory, self.pathname))
+        self.assertFalse(self.event_handler.queue_task(self.directory, self.pathname))
+        self.event_handler.stop_deduplication()
+
+        self.assertTrue(self.event_handler.queue_task(self.directory, self.pathname))
+        self.assertEqual(self.config.celery_application.send_task.call_count, 2)
+
+    @patch('aodncore.pipeline.watch.get_file_identity')
+    def test_queue_task_deduplication_unidentified(self, mock_get_file_identity):
+        # files which cannot be stat'ed when checked for duplicates must not be treated as duplicates of each other
+        mock_get_file_identity.return_value = None
+        other_pathname = os.path.join(self.directory, 'other.nc')
+        safe_copy_file(self.temp_nc_file, other_pathname)
+
+        self.event_handler.start_deduplication()
+        self.assertTrue(self.event_handler.queue_task(self.directory, self.pathname))
+        self.assertTrue(self.event_handler.queue_task(self.directory, other_pathname))
+        self.assertEqual(self.config.celery_application.send_task.call_count, 2)
+
+
+class TestWatchServiceManager(BaseTestCase):
+    def setUp(self):
+        self.config.__dict__['celery_application'] = MagicMock()
+        self.event_handler = IncomingFileEventHandler(self.config)
+        self.watch_manager = MagicMock()
+        self.notifier = MagicMock(_watch_manager=self.watch_manager)
+
+        self.existing_files = []
+        for directory in self.config.watch_directory_map:
+            mkdir_p(directory)
+            for name in ('file1.nc', 'file2.nc'):
+                pathname = os.path.join(directory, name)
+                safe_copy_file(self.temp_nc_file, pathname)
+                self.existing_files.append(pathname)
+
+    def test_init_mismatched_notifier(self):
+        with self.assertRaises(ValueError):
+            WatchServiceManager(self.config, self.event_handler, MagicMock(), self.notifier)
+
+    def test_startup_scan(self):
+        with WatchServiceManager(self.config, self.event_handler, self.watch_manager, self.notifier) as manager:
+            self.assertTrue(manager.wait_for_startup_scan(timeout=30))
+
+        added_watches = [c[0][0] for c in self.watch_manager.add_watch.call_args_list]
+        self.assertCountEqual(added_watches, self.config.watch_directory_map.keys())
+
+        queued_files = [c[1]['args'][0] for c in self.config.celery_application.send_task.call_args_list]
+        self.assertCountEqual(queued_files, self.existing_files)
+        self.notifier.stop.assert_called_once()
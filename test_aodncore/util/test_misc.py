@@ -6,11 +6,13 @@ from collections import OrderedDict
 
 from aodncore.testlib import BaseTestCase
 from aodncore.util import (ensure_regex, ensure_regex_list, ensure_writeonceordereddict, format_exception,
-                           get_pattern_subgroups_from_string, is_function, is_nonstring_iterable, matches_regexes,
-                           merge_dicts, slice_sequence, str_to_list, validate_callable, validate_mandatory_elements,
-                           validate_membership, validate_nonstring_iterable, validate_regex, validate_regexes,
-                           validate_relative_path, validate_relative_path_attr, validate_type, CaptureStdIO, Pattern,
-                           WriteOnceOrderedDict, generate_id, list_not_empty)
+                           get_pattern_subgroups_from_string, get_public_attribute_names, get_regex_literal_prefix,
+                           get_regex_matcher, is_function, is_nonstring_iterable, iter_public_attributes,
+                           matches_regexes, merge_dicts, slice_sequence, str_to_list, validate_callable,
+                           validate_mandatory_elements, validate_membership, validate_nonstring_iterable,
+                           validate_regex, validate_regexes, validate_relative_path, validate_relative_path_attr,
+                           validate_type, CaptureStdIO, Pattern, RegexMatcher, TemplateRenderer, WriteOnceOrderedDict,
+                           generate_id, list_not_empty)
 
 TEST_ROOT = os.path.join(os.path.dirname(__file__))
 
@@ -52,6 +54,23 @@ class TestLoggingContext(BaseTestCase):
     pass
 
 
+class TestTemplateRenderer(BaseTestCase):
+    def test_shared_environment(self):
+        renderer1 = TemplateRenderer(bytecode_cache_dir=self.temp_dir)
+        renderer2 = TemplateRenderer(bytecode_cache_dir=self.temp_dir)
+        self.assertIs(renderer1._env, renderer2._env)
+        self.assertIsNot(renderer1._env, TemplateRenderer()._env)
+
+    def test_precompile(self):
+        renderer = TemplateRenderer(bytecode_cache_dir=self.temp_dir)
+        renderer.precompile('notify.txt.j2')
+
+        # the compiled template is cached in the environment and written to the bytecode cache
+        self.assertIs(renderer._env.get_template('notify.txt.j2'),
+                      TemplateRenderer(bytecode_cache_dir=self.temp_dir)._env.get_template('notify.txt.j2'))
+        self.assertTrue(any(f.endswith('.cache') for f in os.listdir(self.temp_dir)))
+
+
 class TestWriteOnceOrderedDict(BaseTestCase):
     def setUp(self):
         self.write_once_ordered_dict = WriteOnceOrderedDict({'key': 'value'})
@@ -297,6 +316,17 @@ class TestUtilMisc(BaseTestCase):
         with self.assertRaises(ValueError):
             get_pattern_subgroups_from_string(bad_file, r'^FILE_SUFFIX_(?P<product_code[A-Z]{3,4})')
 
+    def test_get_regex_literal_prefix(self):
+        self.assertEqual('dummy.input_file.', get_regex_literal_prefix(r'^dummy\.input_file\.[0-9a-f\-]{36}$'))
+        self.assertEqual('subdirectory/targetfile.', get_regex_literal_prefix(r'subdirectory/targetfile\.(ico|nc)$'))
+        self.assertEqual('ab', get_regex_literal_prefix(re.compile(r'\Aabc?')))
+        self.assertEqual('abc', get_regex_literal_prefix(re.compile(r'a b c', re.VERBOSE)))
+
+        self.assertEqual('', get_regex_literal_prefix(r'.*'))
+        self.assertEqual('', get_regex_literal_prefix(r'abc|def'))
+        self.assertEqual('', get_regex_literal_prefix(r'(?i)abc'))
+        self.assertEqual('', get_regex_literal_prefix(re.compile(r'abc', re.IGNORECASE)))
+
     def test_format_exception(self):
         try:
             raise OSError('dummy exception for format test')
@@ -343,6 +373,38 @@ class TestUtilMisc(BaseTestCase):
         self.assertFalse(matches_regexes('example-filename.nc', None))
         self.assertFalse(matches_regexes('example-filename.nc', []))
 
+    def test_regex_matcher(self):
+        matcher = RegexMatcher([r'.*\.nc$', r'IMOS_.*', re.compile(r'.*\.CSV$', re.IGNORECASE), r'(a)\1\.txt'],
+                               [r'.*_bad\..*', r'.*_worse\..*'])
+
+        # compatible patterns are combined into a single alternation
+        self.assertEqual(3, len(matcher._includes))
+        self.assertEqual(1, len(matcher._excludes))
+
+        self.assertTrue(matcher.matches('example.nc'))
+        self.assertTrue(matcher.matches('IMOS_example.zip'))
+        self.assertTrue(matcher.matches('example.csv'))
+        self.assertTrue(matcher.matches('aa.txt'))
+        self.assertFalse(matcher.matches('ab.txt'))
+        self.assertFalse(matcher.matches('example_bad.nc'))
+        self.assertFalse(matcher.matches('IMOS_example_worse.zip'))
+        self.assertFalse(matcher.matches('example.zip'))
+        self.assertListEqual(['example.nc', 'example.csv'],
+                             matcher.filter(['example.nc', 'example_bad.nc', 'example.csv', 'example.zip']))
+
+    def test_regex_matcher_duplicate_group_names(self):
+        matcher = RegexMatcher([r'(?P<name>a).*', r'(?P<name>b).*'])
+        self.assertEqual(2, len(matcher._includes))
+        self.assertTrue(matcher.matches('abc'))
+        self.assertTrue(matcher.matches('bcd'))
+        self.assertFalse(matcher.matches('cde'))
+
+    def test_get_regex_matcher(self):
+        matcher = get_regex_matcher([r'.*\.nc'], r'.*_bad\.nc')
+        self.assertIsInstance(matcher, RegexMatcher)
+        self.assertIs(matcher, get_regex_matcher([r'.*\.nc'], r'.*_bad\.nc'))
+        self.assertIsNot(matcher, get_regex_matcher([r'.*\.nc']))
+
     def test_merge_dicts(self):
         reference_dict = {
             'key1': 'value1_override',
@@ -491,6 +553,36 @@ class TestUtilMisc(BaseTestCase):
         self.assertEqual(33, len(_uuid))
         self.assertTrue(_uuid.islower())
 
+    def test_get_public_attribute_names(self):
+        class SlotsClass(object):
+            __slots__ = ['b', '_c']
+
+            @property
+            def a(self):
+                return 1
+
+            @property
+            def _d(self):
+                return 2
+
+        self.assertTupleEqual(('a', 'b'), get_public_attribute_names(SlotsClass))
+        self.assertIs(get_public_attribute_names(SlotsClass), get_public_attribute_names(SlotsClass))
+
+    def test_iter_public_attributes(self):
+        class DictClass(object):
+            def __init__(self):
+                self.c = 3
+                self._d = 4
+
+            @property
+            def a(self):
+                return 1
+
+        instance = DictClass()
+        instance.b = 2
+        self.assertListEqual([('a', 1), ('b', 2), ('c', 3)], list(iter_public_attributes(instance)))
+        self.assertListEqual([('a', 1), ('c', 3)], list(iter_public_attributes(instance, {'b'})))
+
     def test_list_not_empty(self):
         self.assertTrue(list_not_empty(['a', 'b', 'c']))
         self.assertTrue(list_not_empty(['a', None, 'c']))
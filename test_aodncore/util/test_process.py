@@ -1,5 +1,7 @@
 import os
+import signal
 import sys
+import time
 import uuid
 
 from aodncore.common import SystemCommandFailedError
@@ -82,3 +84,46 @@ class TestUtilProcess(BaseTestCase):
         process.execute()
         with self.assertRaisesRegex(SystemCommandFailedError, '.*command has already been executed'):
             process.execute()
+
+    def test_execute_rusage(self):
+        process = SystemProcess([TRUE_CMD])
+        process.execute()
+        self.assertEqual(0, process.returncode)
+        self.assertIsNotNone(process.duration)
+        self.assertSetEqual({'user_time', 'system_time', 'max_rss', 'read_blocks', 'write_blocks'},
+                            set(process.rusage))
+        self.assertGreater(process.rusage['max_rss'], 0)
+
+    def test_execute_failure_returncode(self):
+        process = SystemProcess([FALSE_CMD])
+        with self.assertRaises(SystemCommandFailedError):
+            process.execute()
+        self.assertEqual(1, process.returncode)
+        self.assertIsNotNone(process.rusage)
+
+    def test_execute_output_callback(self):
+        lines = []
+        process = SystemProcess('for i in 1 2 3 4 5; do echo line$i; done', shell=True, output_callback=lines.append,
+                                output_tail_lines=2)
+        process.execute()
+        self.assertListEqual(['line1', 'line2', 'line3', 'line4', 'line5'], lines)
+        self.assertEqual('line4\nline5\n', process.stdout_text)
+
+    def test_execute_output_callback_error(self):
+        def callback(_):
+            raise ValueError('callback error')
+
+        process = SystemProcess([ECHO_CMD, 'text'], output_callback=callback)
+        with self.assertRaisesRegex(SystemCommandFailedError, 'output callback failed.*callback error'):
+            process.execute()
+        self.assertEqual(0, process.returncode)
+
+    def test_execute_timeout(self):
+        process = SystemProcess('echo started; sleep 30 & sleep 30; wait', shell=True, timeout=0.5,
+                                terminate_timeout=1)
+        start_time = time.monotonic()
+        with self.assertRaisesRegex(SystemCommandFailedError, 'timed out after 0.5 seconds.*started'):
+            process.execute()
+        self.assertLess(time.monotonic() - start_time, 10)
+        self.assertTrue(process.timed_out)
+        self.assertEqual(-signal.SIGTERM, process.returncode)
@@ -3,11 +3,12 @@ import os
 from unittest.mock import patch
 
 from owslib.etree import etree
-from owslib.fes import PropertyIsEqualTo
+from owslib.fes import Or, PropertyIsEqualTo
 
 from aodncore.testlib import BaseTestCase
 from aodncore.util import IndexedSet
-from aodncore.util.wfs import WfsBroker, get_ogc_expression_for_file_url, ogc_filter_to_string
+from aodncore.util.wfs import (WfsBroker, get_ogc_expression_for_file_url, get_ogc_expression_for_file_urls,
+                               ogc_filter_to_string)
 from test_aodncore import TESTDATA_DIR
 
 
@@ -24,6 +25,17 @@ class TestPipelineWfs(BaseTestCase):
         self.assertEqual(property_name, 'file_url')
         self.assertEqual(literal, file_url)
 
+    def test_get_filter_for_file_urls(self):
+        file_urls = ['IMOS/test/file/url1', 'IMOS/test/file/url2']
+        ogc_expression = get_ogc_expression_for_file_urls(file_urls, property_name='file_url')
+        self.assertIsInstance(ogc_expression, Or)
+
+        root = etree.fromstring(ogc_filter_to_string(ogc_expression))
+        literals = [e.text for e in root.iterfind('.//ogc:Literal', namespaces=root.nsmap)]
+        self.assertListEqual(file_urls, literals)
+
+        self.assertIsInstance(get_ogc_expression_for_file_urls(file_urls[:1]), PropertyIsEqualTo)
+
 
 class TestWfsBroker(BaseTestCase):
     @patch('aodncore.util.wfs.WebFeatureService')
@@ -94,3 +106,44 @@ class TestWfsBroker(BaseTestCase):
 
         file_exists = self.broker.query_file_exists(layer='anmn_velocity_timeseries_map', name=file_to_check)
         self.assertFalse(file_exists)
+
+    def test_get_schema_cached(self):
+        self.broker.get_url_property_name('anmn_velocity_timeseries_map')
+        self.broker.get_url_property_name('anmn_velocity_timeseries_map')
+        self.broker.wfs.get_schema.assert_called_once_with('anmn_velocity_timeseries_map')
+
+    def test_query_files_exist(self):
+        with open(os.path.join(TESTDATA_DIR, 'wfs/GetFeature.json')) as f:
+            self.broker.wfs.getfeature().getvalue.return_value = f.read()
+        self.broker.wfs.getfeature.reset_mock()
+        self.broker.batch_size = 2
+
+        file_to_check = 'IMOS/ANMN/QLD/GBROTE/Velocity/IMOS_ANMN-QLD_AETVZ_20140408T102930Z_GBROTE_FV01_GBROTE-1404-AWAC-13_END-20141022T052930Z_C-20150215T063708Z.nc'
+        names = [file_to_check, 'IMOS/NONEXISTENT1.nc', 'IMOS/NONEXISTENT2.nc']
+
+        files_exist = self.broker.query_files_exist('anmn_velocity_timeseries_map', names)
+
+        self.assertListEqual(names, list(files_exist.keys()))
+        self.assertListEqual([True, False, False], list(files_exist.values()))
+        self.assertEqual(2, self.broker.wfs.getfeature.call_count)
+        self.broker.wfs.get_schema.assert_called_once()
+
+        first_filter = etree.fromstring(self.broker.wfs.getfeature.call_args_list[0][1]['filter'])
+        self.assertEqual(2, len(list(first_filter.iterfind('.//ogc:Literal', namespaces=first_filter.nsmap))))
+
+    def test_query_files_exist_cached(self):
+        with open(os.path.join(TESTDATA_DIR, 'wfs/GetFeature.json')) as f:
+            self.broker.wfs.getfeature().getvalue.return_value = f.read()
+        self.broker.wfs.getfeature.reset_mock()
+        self.broker.url_cache_ttl = 60
+
+        file_to_check = 'IMOS/ANMN/QLD/GBROTE/Velocity/IMOS_ANMN-QLD_AETVZ_20140408T102930Z_GBROTE_FV01_GBROTE-1404-AWAC-13_END-20141022T052930Z_C-20150215T063708Z.nc'
+
+        self.assertTrue(self.broker.query_file_exists('anmn_velocity_timeseries_map', file_to_check))
+        self.assertFalse(self.broker.query_file_exists('anmn_velocity_timeseries_map', 'IMOS/NONEXISTENT.nc'))
+        self.assertEqual(1, self.broker.wfs.getfeature.call_count)
+        self.assertNotIn('filter', self.broker.wfs.getfeature.call_args[1])
+
+        self.broker.invalidate_cache('anmn_velocity_timeseries_map')
+        self.assertTrue(self.broker.query_file_exists('anmn_velocity_timeseries_map', file_to_check))
+        self.assertEqual(2, self.broker.wfs.getfeature.call_count)